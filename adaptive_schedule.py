@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+# How long to wait before the next pokedex_bot.run, decided after every run
+# from what it did, instead of a fixed interval.
+#
+# With a backlog of candidates and rate limit budget to spare the interval
+# shrinks, so candidates are replied to while they are fresh. When searches
+# come back empty, the posting budget runs low or the run failed it grows,
+# so requests are not spent on nothing. Otherwise it drifts back to the base
+# interval. Every wait gets random jitter, so runs don't fall on the same
+# minute as the rate limit windows or other bots.
+#
+# simulate() runs a policy against a SimulatedClock, see
+# benchmarks/simulate_schedule.py for policies over a synthetic day.
+
+import logging
+import random
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+# Seconds
+BASE_INTERVAL = 34 * 60
+SHORTEST_INTERVAL = 8 * 60
+LONGEST_INTERVAL = 3 * 60 * 60
+# Waits are the interval times a random factor within 1 +- JITTER
+JITTER = 0.15
+# Candidates left in the pool that count as a backlog
+BACKLOG = 5
+# Fractions of the posting budget left, see RateBudget.headroom
+LOW_BUDGET = 0.1
+SPARE_BUDGET = 0.5
+SPEED_UP = 0.5
+BACK_OFF = 2.0
+# How far the interval moves back towards the base after an ordinary run
+RELAX = 0.5
+
+# What a run did, returned by pokedex_bot.run.
+# replied: replies posted, searched: whether it searched, found: new candidates
+# the search found, candidates: candidates left in the pool, budget: smallest
+# fraction of the budget left for any endpoint a reply needs
+RunOutcome = namedtuple('RunOutcome', ['replied', 'searched', 'found', 'candidates', 'budget'])
+
+
+# The interval adapts to the outcome of every run
+class AdaptivePolicy:
+	def __init__(self, base=BASE_INTERVAL, shortest=SHORTEST_INTERVAL, longest=LONGEST_INTERVAL,
+			jitter=JITTER, rng=None):
+		self.base = base
+		self.shortest = shortest
+		self.longest = longest
+		self.jitter = jitter
+		self.rng = rng or random.Random()
+		self.interval = base
+
+	# Seconds to wait after a run with outcome (a RunOutcome, None if the run failed)
+	def next_interval(self, outcome):
+		if outcome is None or outcome.budget < LOW_BUDGET or (outcome.searched and not outcome.found):
+			self.interval *= BACK_OFF
+		elif outcome.candidates >= BACKLOG and outcome.budget >= SPARE_BUDGET:
+			self.interval *= SPEED_UP
+		else:
+			self.interval += (self.base - self.interval) * RELAX
+		self.interval = min(self.longest, max(self.shortest, self.interval))
+		return self.interval * self.rng.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+# The same interval after every run, as clock.py did before
+class FixedPolicy:
+	def __init__(self, interval=BASE_INTERVAL, jitter=0, rng=None):
+		self.interval = interval
+		self.jitter = jitter
+		self.rng = rng or random.Random()
+
+	def next_interval(self, outcome):
+		return self.interval * self.rng.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+# Stands in for time.time and time.sleep, e.g. RateBudget(clock=c.time, sleep=c.sleep)
+class SimulatedClock:
+	def __init__(self, start=0.0):
+		self.now = start
+
+	def time(self):
+		return self.now
+
+	def sleep(self, seconds):
+		self.now += max(0, seconds)
+
+
+# Run job() every time policy says until clock.time() passes until.
+# job returns a RunOutcome and advances the clock by however long it takes.
+# Returns a list of (start time, outcome, wait) tuples, one per run.
+def simulate(job, policy, clock, until):
+	runs = []
+	while clock.time() < until:
+		start = clock.time()
+		try:
+			outcome = job()
+		except Exception:
+			log.exception('Simulated run failed')
+			outcome = None
+		wait = policy.next_interval(outcome)
+		runs.append((start, outcome, wait))
+		clock.sleep(wait)
+	return runs
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+# Per-run latency of pokedex_bot.run with a new BotContext every run (the
+# TweetBot, its clients and connections, the state loaded from disk and the
+# shuffled names, as clock.py used to) against one BotContext kept for all
+# runs. Runs against the local fake Twitter API, which delays every new
+# connection by --handshake seconds like the TCP and TLS handshakes with
+# the real API. New tweets arrive between runs.
+#
+#   python benchmarks/bench_bot_context.py [--runs 30] [--handshake 0.1] [--latency 0.03]
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+STATE_DIR = tempfile.mkdtemp(prefix='pokedex-bench-')
+os.environ['POKEDEX_STATE_DIR'] = STATE_DIR
+for variable in ('APP_KEY', 'APP_SECRET', 'OAUTH_TOKEN', 'OAUTH_TOKEN_SECRET'):
+	os.environ.setdefault(variable, 'fake')
+
+import pokedex_bot
+from fake_twitter import FakeTwitter, synthetic_corpus
+from media_cache import MediaCache
+from metrics import percentile
+from rate_budget import RateBudget
+from tweeter import TweetBot, SearchCursors
+
+
+# A context as BotContext() builds it, talking to fake
+def new_context(fake):
+	return pokedex_bot.BotContext(TweetBot('fake', 'fake', 'fake', 'fake',
+		search_concurrency=pokedex_bot.SEARCH_CONCURRENCY, budget=RateBudget.load(), cursors=SearchCursors.load(),
+		seen=pokedex_bot.seen_store(), media=MediaCache.load(), sprites=pokedex_bot.sprites(),
+		configure_client=fake.install))
+
+def measure(args, warm):
+	for name in os.listdir(STATE_DIR):
+		os.remove(os.path.join(STATE_DIR, name))
+	pokedex_bot._seen_store = None
+	fake = FakeTwitter(corpus=synthetic_corpus(args.corpus), latency=args.latency, jitter=0.3,
+		handshake=args.handshake).start()
+	context = new_context(fake) if warm else None
+	latencies = []
+	next_id = 10 ** 17 + args.corpus
+	for i in range(args.runs):
+		start = time.perf_counter()
+		run_context = context or new_context(fake)
+		pokedex_bot.run(max_replies=args.replies, context=run_context)
+		if not warm:
+			run_context.close()
+		latencies.append(time.perf_counter() - start)
+		fake.add_statuses(synthetic_corpus(args.arrivals, seed=i + 1, first_id=next_id, interval=0.1))
+		next_id += args.arrivals
+	if context is not None:
+		context.close()
+	fake.stop()
+	return latencies, fake
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--runs', type=int, default=30)
+	parser.add_argument('--replies', type=int, default=1, help='replies per run')
+	parser.add_argument('--handshake', type=float, default=0.1, help='seconds to set up a connection')
+	parser.add_argument('--latency', type=float, default=0.03, help='seconds per API request')
+	parser.add_argument('--corpus', type=int, default=2000, help='tweets before the first run')
+	parser.add_argument('--arrivals', type=int, default=100, help='new tweets between runs')
+	args = parser.parse_args()
+
+	# Everything but the connections, as the first run would load it
+	pokedex_bot.warm_start()
+	results = {}
+	print('{:<10} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8}'.format('context', 'mean ms', 'p50 ms', 'p95 ms', 'max ms',
+		'conns', 'searches'))
+	for name, warm in (('per run', False), ('reused', True)):
+		latencies, fake = measure(args, warm)
+		results[name] = latencies
+		print('{:<10} {:>8.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>8} {:>8}'.format(name,
+			1000 * sum(latencies) / len(latencies), *[1000 * percentile(latencies, p) for p in (50, 95, 100)],
+			fake.connections, fake.calls['search']))
+	saved = sum(results['per run']) - sum(results['reused'])
+	print('Reusing the context saved {:.1f} ms per run ({:.0f}%)'.format(1000 * saved / args.runs,
+		100 * saved / sum(results['per run'])))
+
+if __name__ == '__main__':
+	logging.basicConfig(level=logging.WARN)
+	try:
+		main()
+	finally:
+		shutil.rmtree(STATE_DIR, ignore_errors=True)
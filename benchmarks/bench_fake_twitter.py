@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+# End-to-end throughput of pokedex_bot.run against the local fake Twitter API
+# (fake_twitter.py): replies per second, API calls per reply and tail latency.
+# New tweets arrive between runs, as they would between scheduler ticks.
+#
+#   python benchmarks/bench_fake_twitter.py [--runs 20] [--replies 3] [--latency 0.05]
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+STATE_DIR = tempfile.mkdtemp(prefix='pokedex-bench-')
+os.environ['POKEDEX_STATE_DIR'] = STATE_DIR
+for variable in ('APP_KEY', 'APP_SECRET', 'OAUTH_TOKEN', 'OAUTH_TOKEN_SECRET'):
+	os.environ.setdefault(variable, 'fake')
+
+import pokedex_bot
+from fake_twitter import FakeTwitter, synthetic_corpus
+from metrics import StageTimings, percentile
+from rate_budget import RateBudget, DEFAULT_LIMITS
+from media_cache import MediaCache
+from tweeter import TweetBot, SearchCursors
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--runs', type=int, default=20)
+	parser.add_argument('--replies', type=int, default=3, help='replies per run')
+	parser.add_argument('--latency', type=float, default=0.05, help='seconds per API request')
+	parser.add_argument('--corpus', type=int, default=5000, help='tweets before the first run')
+	parser.add_argument('--arrivals', type=int, default=200, help='new tweets between runs')
+	parser.add_argument('--concurrency', type=int, default=pokedex_bot.SEARCH_CONCURRENCY)
+	args = parser.parse_args()
+
+	fake = FakeTwitter(corpus=synthetic_corpus(args.corpus), latency=args.latency, jitter=0.5,
+		rate_limits=DEFAULT_LIMITS).start()
+	poke_bot = TweetBot('fake', 'fake', 'fake', 'fake', search_concurrency=args.concurrency,
+		budget=RateBudget(), cursors=SearchCursors(), seen=pokedex_bot.seen_store(), media=MediaCache(),
+		sprites=pokedex_bot.sprites(),
+		configure_client=fake.install)
+	timings = StageTimings()
+	run_latencies = []
+	replies = 0
+	next_id = 10 ** 17 + args.corpus
+	start = time.perf_counter()
+	for i in range(args.runs):
+		run_start = time.perf_counter()
+		replies += pokedex_bot.run(max_replies=args.replies, poke_bot=poke_bot, timings=timings).replied
+		run_latencies.append(time.perf_counter() - run_start)
+		fake.add_statuses(synthetic_corpus(args.arrivals, seed=i + 1, first_id=next_id, interval=0.1))
+		next_id += args.arrivals
+	elapsed = time.perf_counter() - start
+	fake.stop()
+
+	calls = sum(fake.calls.values())
+	print('{} runs, {} replies in {:.2f}s: {:.2f} replies/s'.format(args.runs, replies, elapsed, replies / elapsed))
+	print('API calls: {} total, {:.2f} per reply ({})'.format(calls, calls / float(max(replies, 1)),
+		', '.join('{} {}'.format(endpoint, count) for endpoint, count in sorted(fake.calls.items()))))
+	print('Media cache: {} hits, {} misses'.format(poke_bot.media.hits, poke_bot.media.misses))
+	print('Run latency ms: p50 {:.1f}, p95 {:.1f}, p99 {:.1f}, max {:.1f}'.format(
+		*[1000 * percentile(run_latencies, p) for p in (50, 95, 99, 100)]))
+	print('{:<10} {:>6} {:>10} {:>10} {:>10} {:>10}'.format('stage', 'count', 'mean ms', 'p50 ms', 'p95 ms', 'p99 ms'))
+	for s in timings.summary():
+		print('{:<10} {:>6} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+			s['stage'], s['count'], s['mean'] * 1000, s['p50'] * 1000, s['p95'] * 1000, s['p99'] * 1000))
+
+if __name__ == '__main__':
+	logging.basicConfig(level=logging.WARN)
+	try:
+		main()
+	finally:
+		shutil.rmtree(STATE_DIR, ignore_errors=True)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+# fancy_text bold and italic with str.translate tables, and memoized as on
+# the reply path, against the former per-character dict lookups, on every
+# name and genus in the Pokedex. All must give the same text.
+#
+#   python benchmarks/bench_fancy_text.py
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import fancy_text
+from pokedex import Pokedex
+
+# The dicts fancy_text had before the tables, written out so the new code is
+# checked against them. Italic h is the sans-serif one, U+1D455 is reserved.
+BOLD_UNICODE = dict(zip('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz',
+	'𝟎𝟏𝟐𝟑𝟒𝟓𝟔𝟕𝟖𝟗𝐀𝐁𝐂𝐃𝐄𝐅𝐆𝐇𝐈𝐉𝐊𝐋𝐌𝐍𝐎𝐏𝐐𝐑𝐒𝐓𝐔𝐕𝐖𝐗𝐘𝐙𝐚𝐛𝐜𝐝𝐞𝐟𝐠𝐡𝐢𝐣𝐤𝐥𝐦𝐧𝐨𝐩𝐪𝐫𝐬𝐭𝐮𝐯𝐰𝐱𝐲𝐳'))
+ITALIC_UNICODE = dict(zip('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz',
+	'𝐴𝐵𝐶𝐷𝐸𝐹𝐺𝐻𝐼𝐽𝐾𝐿𝑀𝑁𝑂𝑃𝑄𝑅𝑆𝑇𝑈𝑉𝑊𝑋𝑌𝑍𝑎𝑏𝑐𝑑𝑒𝑓𝑔𝘩𝑖𝑗𝑘𝑙𝑚𝑛𝑜𝑝𝑞𝑟𝑠𝑡𝑢𝑣𝑤𝑥𝑦𝑧'))
+
+def dict_bold(s):
+	return ''.join([BOLD_UNICODE.get(c, c) for c in s])
+
+def dict_italic(s):
+	return ''.join([ITALIC_UNICODE.get(c, c) for c in s])
+
+def bench(func):
+	return min(timeit.repeat(func, number=20, repeat=5)) / 20 / len(TEXTS) * 1e9
+
+if __name__ == '__main__':
+	store = Pokedex.store()
+	TEXTS = [store.name(i, lang) for lang in store.languages for i in range(len(store))]
+	TEXTS += [store.species(i, lang)['genus'] for lang in store.languages for i in range(len(store))]
+	assert [dict_bold(t) for t in TEXTS] == [fancy_text.bold(t) for t in TEXTS] == fancy_text.stylize_all(TEXTS, 'bold')
+	assert [dict_italic(t) for t in TEXTS] == [fancy_text.italic(t) for t in TEXTS]
+	print('{} names and genera, ns per string'.format(len(TEXTS)))
+	print('{:<24} {:>10}'.format('', 'ns'))
+	for label, func in [
+			('dict bold', lambda: [dict_bold(t) for t in TEXTS]),
+			('translate bold', lambda: [t.translate(fancy_text.TABLES['bold']) for t in TEXTS]),
+			('memoized bold', lambda: [fancy_text.bold(t) for t in TEXTS]),
+			('stylize_all bold', lambda: fancy_text.stylize_all(TEXTS, 'bold')),
+			('dict italic', lambda: [dict_italic(t) for t in TEXTS]),
+			('translate italic', lambda: [t.translate(fancy_text.TABLES['italic']) for t in TEXTS]),
+			('memoized italic', lambda: [fancy_text.italic(t) for t in TEXTS])]:
+		print('{:<24} {:>10.0f}'.format(label, bench(func)))
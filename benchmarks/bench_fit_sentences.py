@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+# fit_sentences on the flavor texts with the most sentences in POKEDEX_DATA,
+# and on longer texts made of several of them, against the former version
+# that built every combination of sentences up front. Both must return
+# the same reply for every flavor text when lengths are taken with len();
+# 'weighted us' is fit_sentences with Twitter's weighted length.
+#
+#   python benchmarks/bench_fit_sentences.py
+
+import itertools
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from pokedex_data import POKEDEX_DATA
+from tweeter import fit_sentences
+
+FORMAT_STR = '@ash_ketchum_1234 Pikachu{optional}: {text}'
+OPTIONAL = ', Mouse Pokémon'
+LENGTH = 280
+
+# fit_sentences before it generated combinations lazily
+def fit_sentences_exhaustive(format_str, optional, text, length):
+	sentences = text.split('. ')
+	options = []
+	for i in range(len(sentences), 0, -1):
+		for subset in itertools.combinations(sentences, i):
+			options.append(subset)
+	for combination in options:
+		for opt in [optional, '']:
+			fitted = format_str.format(optional=opt, text='. '.join(combination))
+			fitted = fitted + '.' if not fitted.endswith('.') else fitted
+			if len(fitted) <= length:
+				return fitted
+	return None
+
+def flavor_texts():
+	for pokemon in POKEDEX_DATA:
+		for lang, texts in pokemon['flavor_texts'].items():
+			for text in texts:
+				yield text['text']
+
+def fit_sentences_len(format_str, optional, text, length):
+	return fit_sentences(format_str, optional, text, length, measure=len)
+
+def bench(func, text, number):
+	return min(timeit.repeat(lambda: func(FORMAT_STR, OPTIONAL, text, LENGTH), number=number, repeat=3)) / number * 1e6
+
+if __name__ == '__main__':
+	logging.disable(logging.WARN)
+	texts = sorted(set(flavor_texts()), key=lambda t: len(t.split('. ')), reverse=True)
+	# Shorter lengths drop sentences from most texts
+	for length in (LENGTH, 140, 100):
+		for text in texts:
+			assert fit_sentences(FORMAT_STR, OPTIONAL, text, length, measure=len) == \
+				fit_sentences_exhaustive(FORMAT_STR, OPTIONAL, text, length), text
+	print('Same result for all {} flavor texts'.format(len(texts)))
+
+	cases = [(len(t.split('. ')), t) for t in texts[:5]]
+	# Several flavor texts in a row, as a long multi-sentence text
+	for count in (2, 3, 4):
+		long_text = ' '.join(texts[:count])
+		cases.append((len(long_text.split('. ')), long_text))
+	print('{:>9} {:>7} {:>16} {:>12} {:>8} {:>12}'.format(
+		'sentences', 'chars', 'exhaustive us', 'lazy us', 'speedup', 'weighted us'))
+	for sentences, text in cases:
+		number = 3 if sentences > 12 else 100
+		exhaustive = bench(fit_sentences_exhaustive, text, number)
+		lazy = bench(fit_sentences_len, text, number)
+		weighted = bench(fit_sentences, text, number)
+		print('{:>9} {:>7} {:>16.1f} {:>12.1f} {:>8.1f} {:>12.1f}'.format(
+			sentences, len(text), exhaustive, lazy, exhaustive / lazy, weighted))
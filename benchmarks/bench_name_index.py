@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+# Pokedex name lookups: hashed index against the former linear scan.
+# Names are taken from the start, middle and end of the Pokedex
+# to show that indexed lookups do not depend on the position.
+#
+#   python benchmarks/bench_name_index.py
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from pokedex import Pokedex
+
+NUMBER = 20000
+
+# The lookup Pokedex.entry did before the index
+def linear_lookup(name, lang):
+	names = Pokedex.store().names(lang)
+	return next((i for i, n in enumerate(names) if name.lower() == n.lower()), None)
+
+def indexed_lookup(name, lang):
+	return Pokedex._name_index.get((lang, name.casefold()))
+
+def bench(func, *args):
+	return min(timeit.repeat(lambda: func(*args), number=NUMBER, repeat=3)) / NUMBER * 1e6
+
+if __name__ == '__main__':
+	Pokedex.identify('')
+	print('{:<12} {:<4} {:>14} {:>14} {:>14} {:>14}'.format(
+		'name', 'lang', 'linear us', 'index us', 'identify us', 'entry us'))
+	for species in (0, 75, 150):
+		for lang in ('en', 'ko'):
+			name = Pokedex.store().name(species, lang)
+			print('{:<12} {:<4} {:>14.2f} {:>14.3f} {:>14.3f} {:>14.2f}'.format(
+				name, lang,
+				bench(linear_lookup, name, lang),
+				bench(indexed_lookup, name, lang),
+				bench(Pokedex.identify, name),
+				bench(Pokedex.entry, name, lang)))
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+# Sequential pokedex_bot.run against the search/reply pipeline
+# (reply_pipeline.py) on the local fake Twitter API, with media uploads
+# much slower than the other requests. Reports the time to post a number
+# of replies, how long searches waited behind replies and the other way
+# round, the queue depth and the stage timings. Every reply uploads its
+# picture, as with a cold media cache.
+#
+#   python benchmarks/bench_pipeline.py [--replies 30] [--consumers 2] [--upload-latency 0.5]
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+STATE_DIR = tempfile.mkdtemp(prefix='pokedex-bench-')
+os.environ['POKEDEX_STATE_DIR'] = STATE_DIR
+for variable in ('APP_KEY', 'APP_SECRET', 'OAUTH_TOKEN', 'OAUTH_TOKEN_SECRET'):
+	os.environ.setdefault(variable, 'fake')
+
+import bot_state
+import pokedex_bot
+from candidate_pool import STATE_FILE as POOL_FILE
+from fake_twitter import FakeTwitter, synthetic_corpus, ROUTES
+from media_cache import MediaCache
+from metrics import StageTimings, percentile
+from rate_budget import RateBudget
+from tweeter import TweetBot, SearchCursors
+
+# Tweets arriving in the fake corpus per second while the benchmark runs
+ARRIVALS = 200
+
+
+def new_bot(fake, concurrency):
+	# No upload is ever reused
+	return TweetBot('fake', 'fake', 'fake', 'fake', search_concurrency=concurrency, budget=RateBudget(),
+		cursors=SearchCursors(), seen=pokedex_bot.seen_store(), media=MediaCache(margin=float('inf')),
+		sprites=pokedex_bot.sprites(), configure_client=fake.install)
+
+def new_fake(args):
+	latency = {endpoint: args.latency for endpoint, _ in ROUTES.values()}
+	latency['upload_media'] = args.upload_latency
+	return FakeTwitter(corpus=synthetic_corpus(args.corpus), latency=latency, jitter=0.3).start()
+
+# Statuses keep arriving in the fake while fn runs
+def with_arrivals(fake, fn, seed):
+	next_id = [10 ** 17 + 10 ** 6]
+	def arrive():
+		fake.add_statuses(synthetic_corpus(ARRIVALS, seed=seed + next_id[0], first_id=next_id[0], interval=0.005))
+		next_id[0] += ARRIVALS
+	return fn(arrive)
+
+def sequential(args):
+	fake = new_fake(args)
+	poke_bot = new_bot(fake, args.concurrency)
+	timings = StageTimings()
+	def go(arrive):
+		replied = 0
+		start = time.perf_counter()
+		while replied < args.replies:
+			replied += pokedex_bot.run(max_replies=1, poke_bot=poke_bot, timings=timings).replied
+			arrive()
+		return time.perf_counter() - start
+	elapsed = with_arrivals(fake, go, 1)
+	fake.stop()
+	return elapsed, timings, None
+
+def pipelined(args):
+	fake = new_fake(args)
+	poke_bot = new_bot(fake, args.concurrency)
+	replies = pokedex_bot.reply_pipeline(pokedex_bot.BotContext(poke_bot), consumers=args.consumers,
+		search_interval=args.search_interval, reply_interval=0)
+	def go(arrive):
+		start = time.perf_counter()
+		replies.start()
+		while replies.replied < args.replies:
+			arrive()
+			time.sleep(0.05)
+		elapsed = time.perf_counter() - start
+		stop_start = time.perf_counter()
+		queued = replies.stop()
+		print('pipeline stop: {} replies in total, {} queued candidates back in the pool after {:.2f}s'.format(
+			replies.replied, queued, time.perf_counter() - stop_start))
+		return elapsed
+	elapsed = with_arrivals(fake, go, 1)
+	fake.stop()
+	return elapsed, replies.timings, replies
+
+def print_timings(timings):
+	print('  {:<10} {:>6} {:>10} {:>10} {:>10}'.format('stage', 'count', 'mean ms', 'p50 ms', 'p95 ms'))
+	for s in timings.summary():
+		print('  {:<10} {:>6} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+			s['stage'], s['count'], s['mean'] * 1000, s['p50'] * 1000, s['p95'] * 1000))
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--replies', type=int, default=30)
+	parser.add_argument('--consumers', type=int, default=2)
+	parser.add_argument('--latency', type=float, default=0.03, help='seconds per API request')
+	parser.add_argument('--upload-latency', type=float, default=0.5, help='seconds per media upload request')
+	parser.add_argument('--search-interval', type=float, default=0.5, help='seconds between pipeline searches')
+	parser.add_argument('--corpus', type=int, default=2000)
+	parser.add_argument('--concurrency', type=int, default=pokedex_bot.SEARCH_CONCURRENCY)
+	args = parser.parse_args()
+
+	for name, fn in (('sequential', sequential), ('pipeline', pipelined)):
+		bot_state.save_json(POOL_FILE, [])
+		elapsed, timings, replies = fn(args)
+		print('{}: {} replies in {:.2f}s, {:.2f} replies/s'.format(name, args.replies, elapsed, args.replies / elapsed))
+		if replies is not None:
+			depths = list(replies.depths)
+			print('  {} searches, queue depth mean {:.1f}, p95 {}, max {}'.format(
+				replies.searches, sum(depths) / float(max(len(depths), 1)), percentile(depths, 95), max(depths or [0])))
+		print_timings(timings)
+
+if __name__ == '__main__':
+	logging.basicConfig(level=logging.WARN)
+	try:
+		main()
+	finally:
+		shutil.rmtree(STATE_DIR, ignore_errors=True)
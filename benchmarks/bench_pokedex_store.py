@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+# Import time and resident memory of the compiled Pokedex store (pokedex.py)
+# against importing the Python literal (pokedex_data.py, the former pokedex.py).
+# Every sample runs in a fresh interpreter, once with the .pyc files warmed up
+# and once cold, with an empty bytecode cache, as on the first start after
+# a deploy: then the literal has to be compiled.
+#
+#   python benchmarks/bench_pokedex_store.py [runs]
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+PROBE = '''
+import resource, time
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+CASES = [
+	('baseline (python only)', 'pass'),
+	('literal: import pokedex_data', 'import pokedex_data'),
+	('store: import pokedex', 'import pokedex'),
+	('store: import + entry()', "from pokedex import Pokedex; Pokedex.entry('Pikachu', 'de')"),
+	('store: import + all_names_all_lang()', 'from pokedex import Pokedex; Pokedex.all_names_all_lang()'),
+]
+
+# cold: .pyc files are read from and written to a new, empty directory
+def sample(code, cold=False):
+	pycache = tempfile.mkdtemp(prefix='pokedex-bench-') if cold else None
+	try:
+		options = ['-X', 'pycache_prefix=' + pycache] if cold else []
+		out = subprocess.check_output([sys.executable] + options + ['-c', PROBE.format(code=code)], cwd=ROOT)
+	finally:
+		if pycache is not None:
+			shutil.rmtree(pycache)
+	elapsed, rss = out.split()
+	return float(elapsed), int(rss)
+
+if __name__ == '__main__':
+	for _, code in CASES:
+		sample(code)
+	for title, cold in (('warm .pyc', False), ('cold, no .pyc', True)):
+		print('{:<40} {:>12} {:>12} {:>14}'.format(title, 'min ms', 'median ms', 'max RSS KiB'))
+		for label, code in CASES:
+			samples = [sample(code, cold) for _ in range(RUNS)]
+			times = sorted(s[0] * 1000 for s in samples)
+			print('{:<40} {:>12.2f} {:>12.2f} {:>14}'.format(
+				label, times[0], times[len(times) // 2], max(s[1] for s in samples)))
@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+
+# Search requests needed to cover all Pokémon names of each language,
+# packed into as few queries as fit the limits vs. the former 15 names per query.
+#
+#   python benchmarks/bench_query_packing.py
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from pokedex import Pokedex
+from tweeter import pack_queries, query_plan_savings, build_query, query_length
+
+if __name__ == '__main__':
+	print('{:<6} {:>8} {:>8} {:>8} {:>16}'.format('lang', 'fixed', 'packed', 'saved', 'longest query'))
+	for lang in Pokedex.supported_languages:
+		names = Pokedex.all_names(lang)
+		queries = pack_queries(names)
+		savings = query_plan_savings(names, queries)
+		print('{:<6} {:>8} {:>8} {:>8} {:>16}'.format(lang, savings['fixed'], savings['packed'], savings['saved'],
+			max(query_length(build_query(q)) for q in queries)))
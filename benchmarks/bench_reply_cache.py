@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+# Composing replies with poke_reply from the precomputed reply cache
+# (replies.bin, see reply_cache.py) against fitting them at runtime,
+# over random Pokémon, languages and screen name lengths.
+#
+#   python benchmarks/bench_reply_cache.py
+
+import logging
+import os
+import random
+import sys
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+for variable in ('APP_KEY', 'APP_SECRET', 'OAUTH_TOKEN', 'OAUTH_TOKEN_SECRET'):
+	os.environ.setdefault(variable, 'bench')
+
+import pokedex_bot
+from pokedex import Pokedex
+
+SAMPLES = 2000
+
+def samples():
+	rng = random.Random(0)
+	store = Pokedex.store()
+	# Languages with flavor texts
+	languages = [lang for lang in store.languages if lang != 'zh']
+	for _ in range(SAMPLES):
+		lang = rng.choice(languages)
+		yield ('x' * rng.randint(1, 15), store.name(rng.randrange(len(store)), lang), lang)
+
+def compose_all(replies):
+	for screen_name, poke_name, lang in replies:
+		pokedex_bot.poke_reply(screen_name, poke_name, lang)
+
+def bench(replies):
+	return min(timeit.repeat(lambda: compose_all(replies), number=1, repeat=5)) / len(replies) * 1e6
+
+if __name__ == '__main__':
+	logging.disable(logging.WARN)
+	replies = list(samples())
+	start = time.perf_counter()
+	pokedex_bot.warm_start()
+	print('warm_start: {:.1f} ms, {} bytes of cache'.format((time.perf_counter() - start) * 1000, len(pokedex_bot.reply_cache().buf)))
+	cached = bench(replies)
+	pokedex_bot._reply_cache = False
+	fitted = bench(replies)
+	print('{:<10} {:>12}'.format('reply', 'us'))
+	print('{:<10} {:>12.2f}'.format('fitted', fitted))
+	print('{:<10} {:>12.2f}'.format('cached', cached))
+	print('speedup {:.1f}x'.format(fitted / cached))
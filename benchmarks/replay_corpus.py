@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+# Replays a JSONL file of statuses (one status JSON object per line, as
+# returned by the search API or the filter stream) through the name matching
+# and the _should_respond checks, without any network. The file is streamed
+# in chunks to a pool of worker processes. Reports throughput, how many
+# statuses each check rejected and, with --profile, where the CPU time goes.
+#
+#   python benchmarks/replay_corpus.py --generate 1000000 corpus.jsonl
+#   python benchmarks/replay_corpus.py corpus.jsonl [--workers 4] [--profile]
+
+import argparse
+import concurrent.futures
+import cProfile
+import itertools
+import json
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.realpath(__file__)) + '/..'
+sys.path.insert(0, ROOT)
+# Nothing was seen before, and nothing evaluated here is recorded
+STATE_DIR = tempfile.mkdtemp(prefix='pokedex-replay-')
+os.environ['POKEDEX_STATE_DIR'] = STATE_DIR
+for variable in ('APP_KEY', 'APP_SECRET', 'OAUTH_TOKEN', 'OAUTH_TOKEN_SECRET'):
+	os.environ.setdefault(variable, 'replay')
+
+import pokedex_bot
+from name_matcher import name_matcher
+from pokedex import Pokedex
+from seen_store import REJECTED
+from tweeter import identify_mention
+
+CHUNK_LINES = 2000
+# Chunks queued per worker, bounds memory on large files
+CHUNKS_AHEAD = 4
+
+# Per worker process, set by _init_worker
+_query_items = None
+_profiler = None
+_profile_path = None
+
+
+def _init_worker(profile_dir):
+	global _query_items, _profiler, _profile_path
+	# Same query items and matcher as a search pass in pokedex_bot.run
+	_query_items = {name.lower(): name for name in Pokedex.all_names(lang='en')}
+	name_matcher()
+	pokedex_bot.handle_blocklist()
+	if profile_dir is not None:
+		_profiler = cProfile.Profile()
+		_profile_path = os.path.join(profile_dir, '{}.prof'.format(os.getpid()))
+
+# Returns (statuses, bytes, Counter of outcome) for a list of JSONL lines.
+# The outcome is 'replied', the name of the rejecting check or 'malformed'.
+def _replay_chunk(lines):
+	if _profiler is not None:
+		_profiler.enable()
+	outcomes = Counter()
+	size = 0
+	for line in lines:
+		size += len(line)
+		try:
+			status = json.loads(line)
+			rejection = []
+			def predicate(status):
+				rejection.append(pokedex_bot._rejection(status))
+				return rejection[0] is None
+			found, verdict = identify_mention(status, _query_items, name_matcher(), predicate)
+		except (ValueError, KeyError, TypeError):
+			outcomes['malformed'] += 1
+			continue
+		if found is not None:
+			outcomes['replied'] += 1
+		elif rejection:
+			outcomes[rejection[0]] += 1
+		elif verdict == REJECTED:
+			outcomes['query_in_handle'] += 1
+		else:
+			outcomes[verdict] += 1
+	if _profiler is not None:
+		_profiler.disable()
+		_profiler.dump_stats(_profile_path)
+	return (len(lines), size, outcomes)
+
+def _chunks(path):
+	with open(path, 'rb') as f:
+		lines = (line for line in f if line.strip())
+		while True:
+			chunk = list(itertools.islice(lines, CHUNK_LINES))
+			if not chunk:
+				return
+			yield chunk
+
+# Yields the results of _replay_chunk for every chunk of path,
+# in whatever order the workers finish them
+def replay(path, workers, profile_dir=None):
+	if workers == 1:
+		_init_worker(profile_dir)
+		for chunk in _chunks(path):
+			yield _replay_chunk(chunk)
+		return
+	with concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker,
+			initargs=(profile_dir,)) as executor:
+		pending = set()
+		for chunk in _chunks(path):
+			if len(pending) >= workers * CHUNKS_AHEAD:
+				done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+				for future in done:
+					yield future.result()
+			pending.add(executor.submit(_replay_chunk, chunk))
+		for future in concurrent.futures.as_completed(pending):
+			yield future.result()
+
+# Writes size synthetic statuses (see fake_twitter.synthetic_corpus) to path
+def generate(size, path):
+	from fake_twitter import synthetic_corpus
+	with open(path, 'w') as f:
+		for first in range(0, size, 10000):
+			for status in synthetic_corpus(min(10000, size - first), seed=first, first_id=10 ** 17 + first):
+				f.write(json.dumps(status) + '\n')
+
+def main():
+	parser = argparse.ArgumentParser(description='Replay a JSONL status corpus through the reply filter')
+	parser.add_argument('path', help='JSONL file, one status per line')
+	parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+	parser.add_argument('--profile', action='store_true', help='print the functions with the most CPU time')
+	parser.add_argument('--generate', type=int, metavar='N', help='first write N synthetic statuses to path')
+	args = parser.parse_args()
+
+	if args.generate:
+		start = time.perf_counter()
+		generate(args.generate, args.path)
+		print('Wrote {} statuses to {} in {:.1f}s'.format(args.generate, args.path, time.perf_counter() - start))
+
+	profile_dir = tempfile.mkdtemp(dir=STATE_DIR) if args.profile else None
+	outcomes = Counter()
+	statuses = size = 0
+	start = time.perf_counter()
+	for count, chunk_size, chunk_outcomes in replay(args.path, args.workers, profile_dir):
+		statuses += count
+		size += chunk_size
+		outcomes.update(chunk_outcomes)
+	elapsed = time.perf_counter() - start
+
+	print('{} statuses ({:.1f} MB) in {:.2f}s with {} workers: {:.0f} statuses/s, {:.1f} MB/s'.format(
+		statuses, size / 1e6, elapsed, args.workers, statuses / elapsed, size / 1e6 / elapsed))
+	print('{:<16} {:>10} {:>8}'.format('outcome', 'statuses', '%'))
+	for outcome, count in outcomes.most_common():
+		print('{:<16} {:>10} {:>8.2f}'.format(outcome, count, 100.0 * count / max(statuses, 1)))
+	if args.workers == 1:
+		# Rules in the order the chain settled on
+		print('{:<16} {:>10} {:>10} {:>10}'.format('rule', 'calls', 'rejects', 'cost µs'))
+		for s in pokedex_bot.RESPONSE_RULES.stats():
+			print('{:<16} {:>10} {:>10} {:>10.2f}'.format(s['rule'], s['calls'], s['rejects'], (s['cost'] or 0) * 1e6))
+	if profile_dir is not None:
+		profiles = [os.path.join(profile_dir, name) for name in os.listdir(profile_dir)]
+		if profiles:
+			pstats.Stats(*profiles).sort_stats('tottime').print_stats(25)
+
+if __name__ == '__main__':
+	try:
+		main()
+	finally:
+		shutil.rmtree(STATE_DIR, ignore_errors=True)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+# Scheduling policies (adaptive_schedule.py) over a synthetic day, on a
+# simulated clock: a day takes well under a second. Each run follows
+# pokedex_bot.run: search when the candidate pool runs low, then reply to
+# the best candidate, within a RateBudget on the same clock. Qualifying tweets
+# arrive at a rate that follows the time of day. Reports runs, searches
+# (and how many found nothing), replies, how old candidates were when they
+# got their reply and how many expired unanswered.
+#
+#   python benchmarks/simulate_schedule.py [--days 1] [--seed 0]
+
+import argparse
+import calendar
+import logging
+import math
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from adaptive_schedule import AdaptivePolicy, FixedPolicy, RunOutcome, SimulatedClock, simulate, LOW_BUDGET
+from candidate_pool import CandidatePool, created_at
+from fake_twitter import synthetic_status
+from metrics import percentile
+from rate_budget import RateBudget, BudgetExhausted, DEFAULT_LIMITS
+
+START = calendar.timegm((2017, 6, 1, 0, 0, 0))
+DAY = 24 * 60 * 60
+# Requests in one search pass (one per packed query, see tweeter.pack_queries)
+SEARCH_REQUESTS = 8
+# Most new candidates one search pass turns up
+SEARCH_RESULTS = 40
+# Seconds a run takes
+RUN_SECONDS = 5
+POOL_LOW_WATER = 2
+POSTING_ENDPOINTS = ('upload_media', 'update_status', 'create_favorite')
+
+# scenario: (qualifying tweets per hour at the busiest time of day, rate limits)
+SCENARIOS = {
+	'busy': (60, DEFAULT_LIMITS),
+	'quiet': (2, DEFAULT_LIMITS),
+	# The posting limits shared with other apps of the same account
+	'tight': (60, dict(DEFAULT_LIMITS, update_status=(12, 3 * 60 * 60))),
+}
+
+
+# Qualifying tweets arrive as a Poisson process, busiest in the evening (UTC)
+class SyntheticDay:
+	def __init__(self, peak, rng):
+		self.peak = peak
+		self.rng = rng
+		self.next_id = 10 ** 17
+
+	def rate(self, t):
+		hour = (t % DAY) / 3600.0
+		return self.peak * (0.15 + 0.85 * (0.5 + 0.5 * math.cos(2 * math.pi * (hour - 20) / 24)))
+
+	def _poisson(self, mean):
+		# Knuth's method is fine for the small means here
+		limit, k, p = math.exp(-mean), 0, 1.0
+		while True:
+			p *= self.rng.random()
+			if p <= limit:
+				return k
+			k += 1
+
+	# The newest qualifying tweets created between since and now, as (status, poke_name)
+	def search(self, since, now):
+		mean = self.rate((since + now) / 2.0) * (now - since) / 3600.0
+		found = []
+		for created in sorted(self.rng.uniform(since, now) for _ in range(self._poisson(min(mean, 200))))[-SEARCH_RESULTS:]:
+			found.append((synthetic_status(self.next_id, 'I just caught a Pikachu!', created_at=created), 'Pikachu'))
+			self.next_id += 1
+		return found
+
+
+# Simulates the policy over days of scenario.
+# Returns (runs as by adaptive_schedule.simulate, reply ages in seconds, expired candidates)
+def simulate_policy(policy, scenario, days, seed):
+	peak, limits = SCENARIOS[scenario]
+	clock = SimulatedClock(START)
+	budget = RateBudget(limits=limits, clock=clock.time, sleep=clock.sleep)
+	pool = CandidatePool()
+	day = SyntheticDay(peak, random.Random(seed))
+	ages = []
+	state = {'last_search': START - 60 * 60, 'found': 0}
+
+	def job():
+		now = clock.time()
+		searched = False
+		found = 0
+		if len(pool) < POOL_LOW_WATER:
+			try:
+				budget.acquire('search', SEARCH_REQUESTS, max_wait=0)
+				searched = True
+				before = len(pool)
+				pool.add(day.search(state['last_search'], now), now=now)
+				found = max(0, len(pool) - before)
+				state['last_search'] = now
+				state['found'] += found
+			except BudgetExhausted:
+				pass
+		replied = 0
+		if all(budget.shrink(endpoint, 1) for endpoint in POSTING_ENDPOINTS):
+			status, poke_name = pool.pop(now=now)
+			if status is not None:
+				for endpoint in POSTING_ENDPOINTS:
+					budget.acquire(endpoint, max_wait=0)
+				ages.append(now - created_at(status))
+				replied = 1
+		clock.sleep(RUN_SECONDS)
+		return RunOutcome(replied, searched, found, len(pool), budget.headroom(POSTING_ENDPOINTS))
+
+	runs = simulate(job, policy, clock, START + days * DAY)
+	pool.expire(clock.time())
+	return runs, ages, state['found'] - len(ages) - len(pool)
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('--days', type=float, default=1)
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args()
+
+	policies = [
+		('fixed 34m', lambda: FixedPolicy()),
+		('fixed 10m', lambda: FixedPolicy(10 * 60)),
+		('adaptive', lambda: AdaptivePolicy(rng=random.Random(args.seed))),
+	]
+	print('{:<8} {:<10} {:>5} {:>8} {:>6} {:>8} {:>8} {:>8} {:>8} {:>8}'.format('scenario', 'policy', 'runs',
+		'searches', 'empty', 'low bdg', 'replies', 'expired', 'age p50', 'age p95'))
+	for scenario in sorted(SCENARIOS):
+		for name, policy in policies:
+			runs, ages, expired = simulate_policy(policy(), scenario, args.days, args.seed)
+			outcomes = [o for _, o, _ in runs if o is not None]
+			print('{:<8} {:<10} {:>5} {:>8} {:>6} {:>8} {:>8} {:>8} {:>7.0f}m {:>7.0f}m'.format(scenario, name,
+				len(runs), sum(o.searched for o in outcomes), sum(o.searched and not o.found for o in outcomes),
+				sum(o.budget < LOW_BUDGET for o in outcomes), len(ages), expired,
+				(percentile(ages, 50) or 0) / 60.0, (percentile(ages, 95) or 0) / 60.0))
+
+if __name__ == '__main__':
+	logging.basicConfig(level=logging.WARN)
+	main()
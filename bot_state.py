@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+
+# Local state that outlives a single scheduler run (rate limits, cursors, ...)
+# Kept in STATE_DIR, which can be moved with the POKEDEX_STATE_DIR
+# environment variable.
+
+import json
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+STATE_DIR = os.environ.get('POKEDEX_STATE_DIR',
+	os.path.dirname(os.path.realpath(__file__)) + '/state')
+
+def state_path(name):
+	if not os.path.isdir(STATE_DIR):
+		os.makedirs(STATE_DIR)
+	return os.path.join(STATE_DIR, name)
+
+# Returns default if the file does not exist or cannot be read
+def load_json(name, default=None):
+	try:
+		with open(state_path(name)) as f:
+			return json.load(f)
+	except (IOError, OSError, ValueError) as error:
+		if os.path.exists(state_path(name)):
+			log.warn('Ignoring unreadable state file {}: {}'.format(name, error))
+		return default
+
+# Written to a temporary file first, so a crash never leaves half a file
+def save_json(name, data):
+	path = state_path(name)
+	tmp_path = path + '.tmp'
+	with open(tmp_path, 'w') as f:
+		json.dump(data, f)
+	os.replace(tmp_path, path)
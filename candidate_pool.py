@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+# Pool of tweets that qualify for a reply, collected by one search pass
+# and used up over several runs, best candidate first.
+# Persisted between runs in the state directory.
+
+import calendar
+import logging
+import math
+import time
+import bot_state
+
+log = logging.getLogger(__name__)
+
+STATE_FILE = 'candidates.json'
+# Candidates older than this (seconds) are not worth a reply any more
+TTL = 3 * 60 * 60
+MAX_SIZE = 100
+TWITTER_TIME_FORMAT = '%a %b %d %H:%M:%S +0000 %Y'
+
+# Score weights, see score()
+RECENCY_WEIGHT = 2.0
+# Age (seconds) at which a candidate loses half its recency score
+RECENCY_HALF_LIFE = 30 * 60
+POSITION_WEIGHT = 1.0
+LANGUAGE_WEIGHTS = {'en': 1.0, 'de': 0.9, 'fr': 0.9, 'es': 0.9, 'it': 0.9, 'ja': 0.7, 'ko': 0.7, 'zh': 0.5}
+# Tweets that already got attention are less likely to notice the reply
+ENGAGEMENT_PENALTY = 0.25
+
+
+# Seconds since the epoch the status was created, now if unknown
+def created_at(status, now=None):
+	try:
+		return calendar.timegm(time.strptime(status['created_at'], TWITTER_TIME_FORMAT))
+	except (KeyError, ValueError):
+		return time.time() if now is None else now
+
+# Higher is better. Combines how recent the status is,
+# how early in the text poke_name is mentioned, the language
+# and how much attention the status already got.
+def score(status, poke_name, now=None):
+	now = time.time() if now is None else now
+	age = max(0, now - created_at(status, now))
+	recency = math.pow(0.5, age / float(RECENCY_HALF_LIFE))
+	text = status['text'].lower()
+	mention = text.find(poke_name.lower())
+	position = 1 - mention / float(len(text)) if mention > -1 else 0
+	language = LANGUAGE_WEIGHTS.get(status['lang'], 0)
+	engagement = int(status.get('favorite_count', 0)) + int(status.get('retweet_count', 0))
+	return (RECENCY_WEIGHT * recency + POSITION_WEIGHT * position + language
+		- ENGAGEMENT_PENALTY * engagement)
+
+# The parts of a status needed to reply to it later
+def _trim(status):
+	return {
+		'id': status['id'],
+		'text': status['text'],
+		'lang': status['lang'],
+		'created_at': status.get('created_at'),
+		'favorite_count': status.get('favorite_count', 0),
+		'retweet_count': status.get('retweet_count', 0),
+		'user': {'screen_name': status['user']['screen_name']},
+	}
+
+
+class CandidatePool:
+	def __init__(self, candidates=None, ttl=TTL, max_size=MAX_SIZE):
+		# list of {'status': dict, 'poke_name': str, 'added': timestamp}
+		self.candidates = candidates or []
+		self.ttl = ttl
+		self.max_size = max_size
+
+	@classmethod
+	def load(cls, **kwargs):
+		return cls(bot_state.load_json(STATE_FILE, []), **kwargs)
+
+	def save(self):
+		self.expire()
+		bot_state.save_json(STATE_FILE, self.candidates)
+
+	def __len__(self):
+		return len(self.candidates)
+
+	# Drop candidates older than the TTL. Returns how many were dropped.
+	def expire(self, now=None):
+		now = time.time() if now is None else now
+		before = len(self.candidates)
+		self.candidates = [c for c in self.candidates if now - created_at(c['status'], c['added']) < self.ttl]
+		return before - len(self.candidates)
+
+	# Add (status, poke_name) tuples, as found by TweetBot.find_all_tweets.
+	# Statuses already in the pool are skipped. If the pool overflows,
+	# the lowest scoring candidates are dropped.
+	def add(self, found, now=None):
+		now = time.time() if now is None else now
+		known = set(c['status']['id'] for c in self.candidates)
+		for status, poke_name in found:
+			if status['id'] in known:
+				continue
+			known.add(status['id'])
+			self.candidates.append({'status': _trim(status), 'poke_name': poke_name, 'added': now})
+		self.expire(now)
+		if len(self.candidates) > self.max_size:
+			self._rank(now)
+			del self.candidates[self.max_size:]
+
+	def _rank(self, now):
+		self.candidates.sort(key=lambda c: score(c['status'], c['poke_name'], now), reverse=True)
+
+	# Remove and return the best candidate as a tuple (status, poke_name)
+	# for which accept(status, poke_name) is truthy; candidates rejected
+	# on the way are dropped. Returns (None, None) if there is none.
+	def pop(self, accept=None, now=None):
+		now = time.time() if now is None else now
+		self.expire(now)
+		self._rank(now)
+		while self.candidates:
+			candidate = self.candidates.pop(0)
+			if accept is None or accept(candidate['status'], candidate['poke_name']):
+				return (candidate['status'], candidate['poke_name'])
+			log.debug('Dropped candidate {}'.format(candidate['status']['id']))
+		return (None, None)
+
+
+if __name__ == '__main__':
+	pool = CandidatePool.load()
+	now = time.time()
+	pool._rank(now)
+	print('{} candidates'.format(len(pool)))
+	for c in pool.candidates:
+		print('{:>8.3f} {:>22} {:<4} {:<12} {}'.format(score(c['status'], c['poke_name'], now),
+			c['status']['id'], c['status']['lang'], c['poke_name'], c['status']['text'].replace('\n', ' ')[:60]))
@@ -6,17 +6,25 @@ import sys
 import logging
 import datetime
 from apscheduler.schedulers.blocking import BlockingScheduler
-from pokedex_bot import run
-
-INTERVAL = 34
+from adaptive_schedule import AdaptivePolicy, BASE_INTERVAL
+from pokedex_bot import BotContext, run, warm_start
 
 log = logging.getLogger('clock')
 
 sched = BlockingScheduler()
+# The time until the next run depends on how the last one went, see adaptive_schedule.py
+policy = AdaptivePolicy()
+# Created once at start and used by every run, see pokedex_bot.BotContext
+context = None
 
-@sched.scheduled_job('interval', minutes=INTERVAL, next_run_time=datetime.datetime.now())
 def timed_job():
-	run()
+	outcome = None
+	try:
+		outcome = run(context=context)
+	finally:
+		wait = policy.next_interval(outcome)
+		log.info('Next run in {:.1f} minutes'.format(wait / 60.0))
+		sched.add_job(timed_job, 'date', run_date=datetime.datetime.now() + datetime.timedelta(seconds=wait))
 
 if __name__ == '__main__':
 	logging.basicConfig(level=logging.DEBUG)
@@ -26,8 +34,14 @@ if __name__ == '__main__':
 
 	try:
 		log.info('{name} running.'.format(name=sys.argv[0]))
-		log.info('Will tweet every {min} minutes and reply to tweets. Stop with Ctrl+c'.format(min=INTERVAL))
+		log.info('Will tweet about every {min} minutes and reply to tweets. Stop with Ctrl+c'.format(min=BASE_INTERVAL // 60))
+		warm_start()
+		context = BotContext()
+		sched.add_job(timed_job, 'date', run_date=datetime.datetime.now())
 		sched.start()
 	# a KeyboardInterrupt exception is generated when the user presses Ctrl+c
 	except KeyboardInterrupt:
 		print('\nShutting down. Bye!')
+	finally:
+		if context is not None:
+			context.close()
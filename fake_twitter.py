@@ -0,0 +1,457 @@
+#!/usr/bin/env python
+
+# Local stand-in for the Twitter API, to exercise the bot without credentials.
+# Serves the REST endpoints tweeter.py uses (search, update_status,
+# upload_media, create_favorite, verify_credentials) over a synthetic
+# corpus of tweets, with configurable latency and rate limits,
+# and the filter stream.
+#
+#   fake = FakeTwitter(corpus=synthetic_corpus(1000)).start()
+#   bot = TweetBot(*credentials, configure_client=fake.install)
+#   stream = FilterStream(None, ['Pikachu'], url=fake.stream_url)
+#   ...
+#   fake.stop()
+
+import email.parser
+import email.policy
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qs
+from requests.adapters import HTTPAdapter
+
+log = logging.getLogger(__name__)
+
+STREAM_PATH = '/1.1/statuses/filter.json'
+# Path: (endpoint name as in rate_budget.py, method)
+ROUTES = {
+	'/1.1/search/tweets.json': ('search', 'GET'),
+	'/1.1/statuses/update.json': ('update_status', 'POST'),
+	'/1.1/media/upload.json': ('upload_media', 'POST'),
+	'/1.1/favorites/create.json': ('create_favorite', 'POST'),
+	'/1.1/account/verify_credentials.json': ('verify_credentials', 'GET'),
+}
+# Hosts the Twython client talks to, redirected by FakeTwitter.install
+TWITTER_HOSTS = ('https://api.twitter.com', 'https://upload.twitter.com')
+TWITTER_TIME_FORMAT = '%a %b %d %H:%M:%S +0000 %Y'
+
+
+# A status with every field the bot reads, see
+# https://developer.twitter.com/en/docs/tweets/data-dictionary/overview/tweet-object
+def synthetic_status(status_id, text, screen_name='ash_ketchum', lang='en', mentions=(), created_at=None, **fields):
+	status = {
+		'id': status_id,
+		'id_str': str(status_id),
+		'text': text,
+		'lang': lang,
+		'favorited': False,
+		'retweet_count': 0,
+		'favorite_count': 0,
+		'in_reply_to_screen_name': None,
+		'user': {'screen_name': screen_name},
+		'entities': {'user_mentions': [{'screen_name': m} for m in mentions]},
+		'created_at': time.strftime(TWITTER_TIME_FORMAT, time.gmtime(created_at)),
+	}
+	status.update(fields)
+	return status
+
+# size statuses, newest last, mostly mentioning a Pokémon.
+# Roughly a third are of the kinds _should_respond rejects
+# (retweets, bots, Pokémon handles, Pokémon GO alerts, ...)
+def synthetic_corpus(size, seed=0, first_id=10 ** 17, interval=10.0):
+	from pokedex import Pokedex
+	rng = random.Random(seed)
+	names = Pokedex.all_names('en')
+	german = Pokedex.all_names('de')
+	now = time.time()
+	corpus = []
+	for i in range(size):
+		species = rng.randrange(len(names))
+		name = names[species]
+		kind = rng.random()
+		fields = {}
+		lang = 'en'
+		screen_name = '{}{}'.format(rng.choice(['ash', 'misty', 'brock', 'gary']), rng.randrange(10 ** 6))
+		mentions = ()
+		if kind < 0.55:
+			text = rng.choice(['I just caught a {}!', 'My {} is so cute', 'Who else loves {}?',
+				'Finally evolved my {} today', 'Is {} any good in the new game?']).format(name)
+		elif kind < 0.65:
+			lang = 'de'
+			text = 'Ich habe ein {} gefangen!'.format(german[species])
+		elif kind < 0.72:
+			text = 'RT @friend: look at this {}'.format(name)
+		elif kind < 0.78:
+			text = 'A wild {} appeared until 13:37:00PM'.format(name)
+			screen_name = 'PokeAlertBot'
+		elif kind < 0.83:
+			text = 'Hey @{}fan what about {}?'.format(names[rng.randrange(len(names))].lower(), name)
+			mentions = (names[rng.randrange(len(names))].lower() + 'fan',)
+		elif kind < 0.88:
+			text = 'Look at my {}'.format(name)
+			fields['retweet_count'] = rng.randrange(1, 20)
+		elif kind < 0.93:
+			text = 'Best {} fan art https://t.co/x'.format(name)
+			fields['possibly_sensitive'] = True
+		else:
+			text = 'Pokémon is great, no names here'
+		corpus.append(synthetic_status(first_id + i, text, screen_name=screen_name, lang=lang,
+			mentions=mentions, created_at=now - (size - i) * interval, **fields))
+	return corpus
+
+
+# Search terms of a query built by tweeter.build_query
+def _query_terms(q):
+	return [term.strip('"').lower() for term in q.split(' OR ')]
+
+
+# Form fields of a multipart body as {name: [value]}, like parse_qs,
+# and the content of the 'media' part (b'' if there is none)
+def _multipart(content_type, body):
+	message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+		b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+	params = {}
+	media = b''
+	for part in message.iter_parts():
+		name = part.get_param('name', header='content-disposition')
+		payload = part.get_payload(decode=True)
+		if name == 'media':
+			media = payload
+		else:
+			params[name] = [payload.decode('utf-8')]
+	return params, media
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+
+	def log_message(self, format, *args):
+		log.debug(format % args)
+
+	def setup(self):
+		fake = self.server.fake
+		with fake._lock:
+			fake.connections += 1
+		if fake.handshake:
+			time.sleep(fake.handshake)
+		BaseHTTPRequestHandler.setup(self)
+
+	def do_GET(self):
+		self._dispatch('GET', {})
+
+	def do_POST(self):
+		length = int(self.headers.get('Content-Length') or 0)
+		body = self.rfile.read(length)
+		params = {}
+		content_type = self.headers.get('Content-Type', '')
+		if content_type.startswith('application/x-www-form-urlencoded'):
+			params = parse_qs(body.decode('utf-8'))
+		elif content_type.startswith('multipart/form-data'):
+			params, body = _multipart(content_type, body)
+		self._dispatch('POST', params, body)
+
+	def _dispatch(self, method, params, body=b''):
+		parts = urlsplit(self.path)
+		params.update(parse_qs(parts.query))
+		params = {key: values[-1] for key, values in params.items()}
+		if parts.path == STREAM_PATH and method == 'POST':
+			self.server.fake.serve_stream(self)
+			return
+		route = ROUTES.get(parts.path)
+		if route is None or route[1] != method:
+			self.respond(404, {'errors': [{'code': 34, 'message': 'Sorry, that page does not exist.'}]})
+			return
+		self.server.fake.serve_api(self, route[0], params, body)
+
+	def respond(self, code, payload, headers=None):
+		data = json.dumps(payload).encode('utf-8') if payload is not None else b''
+		self.send_response(code)
+		self.send_header('Content-Type', 'application/json;charset=utf-8')
+		self.send_header('Content-Length', str(len(data)))
+		for name, value in (headers or {}).items():
+			self.send_header(name, str(value))
+		self.end_headers()
+		self.wfile.write(data)
+
+
+# Sends requests for the Twitter hosts to the fake server instead
+class _RedirectAdapter(HTTPAdapter):
+	def __init__(self, base_url):
+		super(_RedirectAdapter, self).__init__()
+		self.base_url = base_url
+
+	def send(self, request, **kwargs):
+		parts = urlsplit(request.url)
+		request.url = self.base_url + parts.path + ('?' + parts.query if parts.query else '')
+		return super(_RedirectAdapter, self).send(request, **kwargs)
+
+
+class FakeTwitter:
+	# corpus: statuses the search endpoint searches, newest last
+	# latency: seconds every API request takes, a float for all endpoints
+	#   or a dict by endpoint name (see ROUTES), varied by +-jitter (a fraction)
+	# rate_limits: {endpoint name: (requests, window seconds)}, endpoints
+	#   not listed are unlimited and send no rate limit headers
+	# statuses: served on the filter stream, in order, across connections
+	# stream_interval: seconds between two streamed statuses
+	# fail_connections: number of stream connections refused with fail_status first
+	# disconnect_after: statuses per stream connection before the server drops it
+	# media_expiry: seconds an uploaded media_id can be attached to statuses
+	# handshake: seconds every new connection waits before its first request
+	#   is read, like the TCP and TLS handshakes with the real API
+	def __init__(self, corpus=(), latency=0.0, jitter=0.0, rate_limits=None, statuses=(),
+			host='127.0.0.1', port=0, stream_interval=0.0, fail_connections=0, fail_status=503,
+			disconnect_after=None, media_expiry=86400, handshake=0.0, seed=0):
+		self.corpus = list(corpus)
+		self.handshake = handshake
+		self.connections = 0
+		self._by_id = dict((s['id'], s) for s in self.corpus)
+		self.latency = latency
+		self.jitter = jitter
+		self.rate_limits = rate_limits or {}
+		self._windows = {}
+		self.calls = Counter()
+		self.posted = []
+		# media_id: (size, expiry timestamp)
+		self.media = {}
+		self.media_expiry = media_expiry
+		# media_id: (total bytes, {segment index: bytes}) of chunked uploads in progress
+		self.uploads = {}
+		self._ids = itertools.count(2 * 10 ** 18)
+		self._rng = random.Random(seed)
+		self.statuses = list(statuses)
+		self.stream_interval = stream_interval
+		self.fail_connections = fail_connections
+		self.fail_status = fail_status
+		self.disconnect_after = disconnect_after
+		self.stream_connections = 0
+		self._stream_position = 0
+		self._lock = threading.Lock()
+		self._stopped = threading.Event()
+		self.server = _Server((host, port), _Handler)
+		self.server.fake = self
+		self._thread = None
+
+	@property
+	def url(self):
+		return 'http://{}:{}'.format(*self.server.server_address[:2])
+
+	@property
+	def stream_url(self):
+		return self.url + STREAM_PATH
+
+	def start(self):
+		self._thread = threading.Thread(target=self.server.serve_forever)
+		self._thread.daemon = True
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self._stopped.set()
+		self.server.shutdown()
+		self.server.server_close()
+
+	# Point a Twython client at this server
+	def install(self, client):
+		adapter = _RedirectAdapter(self.url)
+		for host in TWITTER_HOSTS:
+			client.client.mount(host, adapter)
+
+	def add_statuses(self, statuses):
+		with self._lock:
+			for status in statuses:
+				self.corpus.append(status)
+				self._by_id[status['id']] = status
+
+	def _delay(self, endpoint):
+		latency = self.latency.get(endpoint, 0.0) if isinstance(self.latency, dict) else self.latency
+		if latency:
+			with self._lock:
+				variation = self._rng.uniform(-self.jitter, self.jitter)
+			time.sleep(max(0.0, latency * (1 + variation)))
+
+	# Count a request against the rate limit of endpoint.
+	# Returns the rate limit headers and whether the request is allowed.
+	def _rate_limit(self, endpoint):
+		limit = self.rate_limits.get(endpoint)
+		if limit is None:
+			return {}, True
+		requests, window = limit
+		now = time.time()
+		with self._lock:
+			used, reset = self._windows.get(endpoint, (0, 0))
+			if now >= reset:
+				used, reset = 0, int(now + window)
+			allowed = used < requests
+			if allowed:
+				used += 1
+			self._windows[endpoint] = (used, reset)
+		return {
+			'x-rate-limit-limit': requests,
+			'x-rate-limit-remaining': requests - used,
+			'x-rate-limit-reset': reset,
+		}, allowed
+
+	def serve_api(self, handler, endpoint, params, body):
+		with self._lock:
+			self.calls[endpoint] += 1
+		self._delay(endpoint)
+		headers, allowed = self._rate_limit(endpoint)
+		if not allowed:
+			handler.respond(429, {'errors': [{'code': 88, 'message': 'Rate limit exceeded'}]}, headers)
+			return
+		code, payload = getattr(self, '_' + endpoint)(params, body)
+		handler.respond(code, payload, headers)
+
+	def _search(self, params, body):
+		terms = _query_terms(params.get('q', ''))
+		since_id = int(params.get('since_id', 0))
+		count = int(params.get('count', 15))
+		found = []
+		with self._lock:
+			for status in reversed(self.corpus):
+				if status['id'] <= since_id or len(found) >= count:
+					break
+				text = status['text'].lower()
+				if any(term in text for term in terms):
+					found.append(dict(status))
+		return 200, {'statuses': found, 'search_metadata': {
+			'count': count, 'since_id': since_id, 'max_id': found[0]['id'] if found else since_id}}
+
+	# Simple uploads, or chunked ones with the INIT, APPEND and FINALIZE commands
+	# https://developer.twitter.com/en/docs/media/upload-media/uploading-media/chunked-media-upload
+	def _upload_media(self, params, body):
+		command = params.get('command')
+		if command is None:
+			return 200, self._add_media(next(self._ids), len(body))
+		if command == 'INIT':
+			media_id = next(self._ids)
+			with self._lock:
+				self.uploads[media_id] = (int(params['total_bytes']), {})
+			return 202, {'media_id': media_id, 'media_id_string': str(media_id),
+				'expires_after_secs': self.media_expiry}
+		media_id = int(params.get('media_id', 0))
+		with self._lock:
+			upload = self.uploads.get(media_id)
+		if upload is None:
+			return 400, {'errors': [{'code': 324, 'message': 'Invalid mediaId.'}]}
+		total_bytes, segments = upload
+		if command == 'APPEND':
+			segments[int(params['segment_index'])] = len(body)
+			return 204, None
+		if command == 'FINALIZE':
+			with self._lock:
+				del self.uploads[media_id]
+			if sum(segments.values()) != total_bytes or sorted(segments) != list(range(len(segments))):
+				return 400, {'errors': [{'code': 324, 'message': 'Segments do not add up to provided total file size.'}]}
+			return 201, self._add_media(media_id, total_bytes)
+		return 400, {'errors': [{'code': 38, 'message': 'command parameter is missing.'}]}
+
+	def _add_media(self, media_id, size):
+		with self._lock:
+			self.media[media_id] = (size, time.time() + self.media_expiry)
+		return {'media_id': media_id, 'media_id_string': str(media_id),
+			'size': size, 'expires_after_secs': self.media_expiry}
+
+	def _update_status(self, params, body):
+		media_ids = [int(m) for m in params.get('media_ids', '').split(',') if m]
+		now = time.time()
+		if any(m not in self.media or self.media[m][1] < now for m in media_ids):
+			return 400, {'errors': [{'code': 324, 'message': 'The validation of media ids failed.'}]}
+		status = synthetic_status(next(self._ids), params.get('status', ''), screen_name='yourpokedex',
+			in_reply_to_status_id=int(params['in_reply_to_status_id']) if params.get('in_reply_to_status_id') else None)
+		with self._lock:
+			self.posted.append(status)
+		return 200, status
+
+	def _create_favorite(self, params, body):
+		with self._lock:
+			status = self._by_id.get(int(params.get('id', 0)))
+			if status is None:
+				return 404, {'errors': [{'code': 144, 'message': 'No status found with that ID.'}]}
+			status['favorited'] = True
+			status['favorite_count'] += 1
+			return 200, dict(status)
+
+	def _verify_credentials(self, params, body):
+		return 200, {'name': 'Your Pokédex', 'screen_name': 'yourpokedex',
+			'statuses_count': len(self.posted), 'followers_count': 0}
+
+	def serve_stream(self, handler):
+		with self._lock:
+			self.stream_connections += 1
+			refuse = self.stream_connections <= self.fail_connections
+		if refuse:
+			handler.respond(self.fail_status, {'errors': [{'message': 'Service Unavailable'}]})
+			return
+		# No length, the response ends when the connection closes
+		handler.close_connection = True
+		handler.send_response(200)
+		handler.send_header('Content-Type', 'application/json')
+		handler.send_header('Connection', 'close')
+		handler.end_headers()
+		try:
+			for sent in itertools.count():
+				if self._stopped.is_set():
+					return
+				if self.disconnect_after is not None and sent >= self.disconnect_after:
+					return
+				with self._lock:
+					status = None
+					if self._stream_position < len(self.statuses):
+						status = self.statuses[self._stream_position]
+						self._stream_position += 1
+				if status is None:
+					# Nothing left, keep the connection alive like Twitter does
+					handler.wfile.write(b'\r\n')
+					handler.wfile.flush()
+					self._stopped.wait(0.5)
+					continue
+				handler.wfile.write(json.dumps(status).encode('utf-8') + b'\r\n')
+				handler.wfile.flush()
+				if self.stream_interval:
+					time.sleep(self.stream_interval)
+		except (IOError, OSError):
+			# Client went away
+			pass
+
+
+if __name__ == '__main__':
+	# Stream through the fake server into a reply queue,
+	# with refused and dropped connections along the way
+	from tweet_stream import FilterStream, ReplyQueue, ingest
+	from name_matcher import name_matcher
+	from pokedex import Pokedex
+	logging.basicConfig(level=logging.INFO)
+	statuses = [
+		synthetic_status(1, 'Just caught a Pikachu!'),
+		synthetic_status(2, 'RT look at this Bulbasaur'),
+		synthetic_status(3, 'Charmander is the best starter', lang='en'),
+		synthetic_status(4, 'nothing to see here'),
+		synthetic_status(5, 'Mewtwo strikes back', screen_name='PokeBot'),
+		synthetic_status(6, 'Wer mag Glumanda? Mew!', lang='de'),
+	]
+	fake = FakeTwitter(statuses=statuses, fail_connections=1, disconnect_after=2).start()
+	names = Pokedex.all_names('en')
+	stream = FilterStream(None, names, url=fake.stream_url)
+	stream.backoff.http_error = lambda status_code: 0.1
+	replies = ReplyQueue(maxsize=10)
+	worker = threading.Thread(target=ingest, args=(stream.statuses(), names, name_matcher(), lambda s: True, replies))
+	worker.daemon = True
+	worker.start()
+	for _ in range(4):
+		status, found = replies.get(timeout=30)
+		print('{} {!r}: {}'.format(status['id'], found, status['text']))
+	stream.stop()
+	fake.stop()
+	print('{} stream connections'.format(fake.stream_connections))
@@ -2,132 +2,87 @@
 
 #http://www.fileformat.info/info/unicode/block/mathematical_alphanumeric_symbols/list.htm
 
-bold_unicode = {
- '0': u'\U0001d7ce',
- '1': u'\U0001d7cf',
- '2': u'\U0001d7d0',
- '3': u'\U0001d7d1',
- '4': u'\U0001d7d2',
- '5': u'\U0001d7d3',
- '6': u'\U0001d7d4',
- '7': u'\U0001d7d5',
- '8': u'\U0001d7d6',
- '9': u'\U0001d7d7',
- 'A': u'\U0001d400',
- 'B': u'\U0001d401',
- 'C': u'\U0001d402',
- 'D': u'\U0001d403',
- 'E': u'\U0001d404',
- 'F': u'\U0001d405',
- 'G': u'\U0001d406',
- 'H': u'\U0001d407',
- 'I': u'\U0001d408',
- 'J': u'\U0001d409',
- 'K': u'\U0001d40a',
- 'L': u'\U0001d40b',
- 'M': u'\U0001d40c',
- 'N': u'\U0001d40d',
- 'O': u'\U0001d40e',
- 'P': u'\U0001d40f',
- 'Q': u'\U0001d410',
- 'R': u'\U0001d411',
- 'S': u'\U0001d412',
- 'T': u'\U0001d413',
- 'U': u'\U0001d414',
- 'V': u'\U0001d415',
- 'W': u'\U0001d416',
- 'X': u'\U0001d417',
- 'Y': u'\U0001d418',
- 'Z': u'\U0001d419',
- 'a': u'\U0001d41a',
- 'b': u'\U0001d41b',
- 'c': u'\U0001d41c',
- 'd': u'\U0001d41d',
- 'e': u'\U0001d41e',
- 'f': u'\U0001d41f',
- 'g': u'\U0001d420',
- 'h': u'\U0001d421',
- 'i': u'\U0001d422',
- 'j': u'\U0001d423',
- 'k': u'\U0001d424',
- 'l': u'\U0001d425',
- 'm': u'\U0001d426',
- 'n': u'\U0001d427',
- 'o': u'\U0001d428',
- 'p': u'\U0001d429',
- 'q': u'\U0001d42a',
- 'r': u'\U0001d42b',
- 's': u'\U0001d42c',
- 't': u'\U0001d42d',
- 'u': u'\U0001d42e',
- 'v': u'\U0001d42f',
- 'w': u'\U0001d430',
- 'x': u'\U0001d431',
- 'y': u'\U0001d432',
- 'z': u'\U0001d433'}
+import functools
 
-italic_unicode = {
- 'A': u'\U0001d434',
- 'B': u'\U0001d435',
- 'C': u'\U0001d436',
- 'D': u'\U0001d437',
- 'E': u'\U0001d438',
- 'F': u'\U0001d439',
- 'G': u'\U0001d43a',
- 'H': u'\U0001d43b',
- 'I': u'\U0001d43c',
- 'J': u'\U0001d43d',
- 'K': u'\U0001d43e',
- 'L': u'\U0001d43f',
- 'M': u'\U0001d440',
- 'N': u'\U0001d441',
- 'O': u'\U0001d442',
- 'P': u'\U0001d443',
- 'Q': u'\U0001d444',
- 'R': u'\U0001d445',
- 'S': u'\U0001d446',
- 'T': u'\U0001d447',
- 'U': u'\U0001d448',
- 'V': u'\U0001d449',
- 'W': u'\U0001d44a',
- 'X': u'\U0001d44b',
- 'Y': u'\U0001d44c',
- 'Z': u'\U0001d44d',
- 'a': u'\U0001d44e',
- 'b': u'\U0001d44f',
- 'c': u'\U0001d450',
- 'd': u'\U0001d451',
- 'e': u'\U0001d452',
- 'f': u'\U0001d453',
- 'g': u'\U0001d454',
- 'h': u'\U0001d629', #\U0001d455 is reserved
- 'i': u'\U0001d456',
- 'j': u'\U0001d457',
- 'k': u'\U0001d458',
- 'l': u'\U0001d459',
- 'm': u'\U0001d45a',
- 'n': u'\U0001d45b',
- 'o': u'\U0001d45c',
- 'p': u'\U0001d45d',
- 'q': u'\U0001d45e',
- 'r': u'\U0001d45f',
- 's': u'\U0001d460',
- 't': u'\U0001d461',
- 'u': u'\U0001d462',
- 'v': u'\U0001d463',
- 'w': u'\U0001d464',
- 'x': u'\U0001d465',
- 'y': u'\U0001d466',
- 'z': u'\U0001d467'}
+# Every style maps A-Z, a-z and, where the style has them, 0-9 to consecutive
+# code points, starting at these. A few letters already had a code point in
+# Letterlike Symbols when the block was added; their places in the block are
+# reserved and the exceptions map them to the older characters instead.
+# style: (first capital, first small letter, first digit or None, exceptions)
+STYLES = {
+	'bold': (0x1D400, 0x1D41A, 0x1D7CE, {}),
+	# Like before, italic small h (reserved, U+210E) is taken from sans-serif
+	# italic, it matches the other italic letters in more fonts
+	'italic': (0x1D434, 0x1D44E, None, {'h': 0x1D629}),
+	'bold_italic': (0x1D468, 0x1D482, None, {}),
+	'script': (0x1D49C, 0x1D4B6, None, {
+		'B': 0x212C, 'E': 0x2130, 'F': 0x2131, 'H': 0x210B, 'I': 0x2110, 'L': 0x2112,
+		'M': 0x2133, 'R': 0x211B, 'e': 0x212F, 'g': 0x210A, 'o': 0x2134}),
+	'bold_script': (0x1D4D0, 0x1D4EA, None, {}),
+	'fraktur': (0x1D504, 0x1D51E, None, {'C': 0x212D, 'H': 0x210C, 'I': 0x2111, 'R': 0x211C, 'Z': 0x2128}),
+	'double_struck': (0x1D538, 0x1D552, 0x1D7D8, {
+		'C': 0x2102, 'H': 0x210D, 'N': 0x2115, 'P': 0x2119, 'Q': 0x211A, 'R': 0x211D, 'Z': 0x2124}),
+	'bold_fraktur': (0x1D56C, 0x1D586, None, {}),
+	'sans_serif': (0x1D5A0, 0x1D5BA, 0x1D7E2, {}),
+	'sans_serif_bold': (0x1D5D4, 0x1D5EE, 0x1D7EC, {}),
+	'sans_serif_italic': (0x1D608, 0x1D622, None, {}),
+	'sans_serif_bold_italic': (0x1D63C, 0x1D656, None, {}),
+	'monospace': (0x1D670, 0x1D68A, 0x1D7F6, {}),
+}
 
-def italic(s):
-	return ''.join([italic_unicode.get(c, c) for c in s])
+CAPITALS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+SMALL_LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+DIGITS = '0123456789'
 
-def bold(s):
-	return ''.join([bold_unicode.get(c, c) for c in s])
+def _table(capital, small, digit, exceptions):
+	mapping = {}
+	for first, chars in ((capital, CAPITALS), (small, SMALL_LETTERS), (digit, DIGITS)):
+		if first is not None:
+			mapping.update((c, chr(first + i)) for i, c in enumerate(chars))
+	mapping.update((c, chr(code_point)) for c, code_point in exceptions.items())
+	return str.maketrans(mapping)
+
+# style: str.translate table
+TABLES = {name: _table(*style) for name, style in STYLES.items()}
+
+
+# The reply path styles the same few thousand names and genera over and
+# over, so each style function keeps its most recent results
+MEMO_SIZE = 4096
+
+def _styler(style):
+	table = TABLES[style]
+	@functools.lru_cache(maxsize=MEMO_SIZE)
+	def styled(s):
+		return s.translate(table)
+	styled.__name__ = style
+	return styled
+
+# style: function styling a string
+STYLERS = {name: _styler(name) for name in STYLES}
+
+def stylize(s, style):
+	return STYLERS[style](s)
+
+# stylize every string of strings, as a list
+def stylize_all(strings, style):
+	return list(map(STYLERS[style], strings))
+
+italic = STYLERS['italic']
+bold = STYLERS['bold']
+bold_italic = STYLERS['bold_italic']
+script = STYLERS['script']
+double_struck = STYLERS['double_struck']
+monospace = STYLERS['monospace']
+sans_serif = STYLERS['sans_serif']
 
 if __name__ == '__main__':
-	test = 'This is a TEST string 1234' 
+	import unicodedata
+	# Every character a style maps to is assigned, i.e. no reserved code point is used
+	for name, table in TABLES.items():
+		for c in table.values():
+			unicodedata.name(c)
+	test = 'This is a TEST string 1234'
 	print(test)
-	print(italic(test))
-	print(bold(test))
+	for name in STYLES:
+		print(stylize(test, name))
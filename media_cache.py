@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+# media_ids of uploaded pictures, keyed by the hash of the file content,
+# so a picture is uploaded once and attached to every reply until the
+# upload expires, instead of being uploaded again for every reply.
+# Persisted between runs in the state directory.
+# https://developer.twitter.com/en/docs/media/upload-media/api-reference/post-media-upload
+
+import hashlib
+import logging
+import os
+import threading
+import time
+import bot_state
+
+log = logging.getLogger(__name__)
+
+STATE_FILE = 'media_cache.json'
+# Seconds an upload stays valid if the response doesn't say
+DEFAULT_EXPIRY = 24 * 60 * 60
+# Uploads are not reused in the last seconds before they expire,
+# a reply might take that long to be posted
+EXPIRY_MARGIN = 10 * 60
+
+
+class MediaCache:
+	def __init__(self, entries=None, margin=EXPIRY_MARGIN, clock=time.time):
+		# content digest: {'media_id': int, 'expires': timestamp}
+		self.entries = entries or {}
+		self.margin = margin
+		self.clock = clock
+		self.hits = 0
+		self.misses = 0
+		self._lock = threading.Lock()
+		# (path, size, mtime) -> digest, so unchanged files are not hashed again
+		self._digests = {}
+
+	@classmethod
+	def load(cls, **kwargs):
+		return cls(bot_state.load_json(STATE_FILE, {}), **kwargs)
+
+	def save(self):
+		now = self.clock()
+		with self._lock:
+			self.entries = {digest: e for digest, e in self.entries.items() if e['expires'] > now}
+			bot_state.save_json(STATE_FILE, self.entries)
+
+	def __len__(self):
+		return len(self.entries)
+
+	@staticmethod
+	def digest(data):
+		return hashlib.sha1(data).hexdigest()
+
+	# Digest of the file at path, hashed again only if it changed
+	def file_digest(self, path):
+		stat = os.stat(path)
+		key = (path, stat.st_size, stat.st_mtime_ns)
+		digest = self._digests.get(key)
+		if digest is None:
+			with open(path, 'rb') as f:
+				digest = self._digests[key] = self.digest(f.read())
+		return digest
+
+	# media_id uploaded for digest that is still valid, None if there is none
+	def get(self, digest):
+		with self._lock:
+			entry = self.entries.get(digest)
+			if entry is not None and entry['expires'] - self.margin > self.clock():
+				self.hits += 1
+				return entry['media_id']
+			self.misses += 1
+			return None
+
+	def put(self, digest, media_id, expires_after=None):
+		with self._lock:
+			self.entries[digest] = {
+				'media_id': media_id,
+				'expires': self.clock() + (expires_after or DEFAULT_EXPIRY)}
+
+	# e.g. when Twitter rejected the media_id
+	def forget(self, digest):
+		with self._lock:
+			self.entries.pop(digest, None)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+# Timings of the stages a reply goes through (compose, upload, post, ...)
+
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+# Most recent samples kept per stage for percentiles
+MAX_SAMPLES = 10000
+
+
+def percentile(samples, p):
+	if not samples:
+		return None
+	ordered = sorted(samples)
+	return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+class StageTimings:
+	def __init__(self):
+		# stage name: {'count', 'total', 'max', 'samples'}
+		self.stages = OrderedDict()
+		self._lock = threading.Lock()
+
+	# Time the block as one run of stage, whether it raises or not
+	@contextmanager
+	def stage(self, name):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.record(name, time.perf_counter() - start)
+
+	def record(self, name, seconds):
+		with self._lock:
+			stage = self.stages.get(name)
+			if stage is None:
+				stage = self.stages[name] = {'count': 0, 'total': 0.0, 'max': 0.0,
+					'samples': deque(maxlen=MAX_SAMPLES)}
+			stage['count'] += 1
+			stage['total'] += seconds
+			stage['max'] = max(stage['max'], seconds)
+			stage['samples'].append(seconds)
+
+	# Add all samples of other (a StageTimings)
+	def merge(self, other):
+		with other._lock:
+			stages = [(name, list(s['samples'])) for name, s in other.stages.items()]
+		for name, samples in stages:
+			for seconds in samples:
+				self.record(name, seconds)
+
+	# One dict per stage with count and seconds total, mean, p50, p95, p99 and max
+	def summary(self):
+		with self._lock:
+			stages = [(name, dict(s, samples=list(s['samples']))) for name, s in self.stages.items()]
+		return [{
+			'stage': name,
+			'count': s['count'],
+			'total': s['total'],
+			'mean': s['total'] / s['count'],
+			'p50': percentile(s['samples'], 50),
+			'p95': percentile(s['samples'], 95),
+			'p99': percentile(s['samples'], 99),
+			'max': s['max'],
+		} for name, s in stages]
+
+	def report(self, logger, title='Stage timings'):
+		logger.info('{}: {:<10} {:>6} {:>10} {:>10} {:>10} {:>10}'.format(
+			title, 'stage', 'count', 'total ms', 'mean ms', 'p95 ms', 'max ms'))
+		for s in self.summary():
+			logger.info('{}: {:<10} {:>6} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+				title, s['stage'], s['count'], s['total'] * 1000, s['mean'] * 1000, s['p95'] * 1000, s['max'] * 1000))
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+# Find Pokémon names in text in a single pass with an Aho-Corasick automaton
+# https://en.wikipedia.org/wiki/Aho%E2%80%93Corasick_algorithm
+
+from collections import deque, namedtuple
+from pokedex import Pokedex
+
+# start and end are positions in the searched text, text[start:end] is the mention.
+# name is the pattern as given, langs the languages it was given for,
+# id the id of the Pokémon species (or None).
+Match = namedtuple('Match', ['start', 'end', 'name', 'langs', 'id'])
+
+# Names made of CJK ideographs, kana or hangul are matched as plain substrings,
+# everything below this code point needs word boundaries.
+CJK_START = 0x2E80
+
+
+def _is_word_char(c):
+	return ord(c) < CJK_START and (c.isalnum() or c == '_')
+
+
+class AhoCorasick:
+	# patterns: iterable of (string, payload) tuples.
+	# Matching is case-insensitive, patterns are lowercased.
+	def __init__(self, patterns):
+		self.goto = [{}]
+		self.fail = [0]
+		# payloads of patterns ending in a state, with the pattern length
+		self.out = [[]]
+		# next state on the fail chain that has output
+		self.out_link = [None]
+		for pattern, payload in patterns:
+			key = pattern.lower()
+			if not key:
+				continue
+			state = 0
+			for c in key:
+				nxt = self.goto[state].get(c)
+				if nxt is None:
+					nxt = len(self.goto)
+					self.goto[state][c] = nxt
+					self.goto.append({})
+					self.fail.append(0)
+					self.out.append([])
+					self.out_link.append(None)
+				state = nxt
+			self.out[state].append((len(key), payload))
+		self._link()
+
+	def _link(self):
+		queue = deque(self.goto[0].values())
+		while queue:
+			state = queue.popleft()
+			for c, nxt in self.goto[state].items():
+				queue.append(nxt)
+				f = self.fail[state]
+				while f and c not in self.goto[f]:
+					f = self.fail[f]
+				target = self.goto[f].get(c, 0)
+				self.fail[nxt] = target if target != nxt else 0
+				self.out_link[nxt] = self.fail[nxt] if self.out[self.fail[nxt]] else self.out_link[self.fail[nxt]]
+
+	# Yield (start, end, payload) for every occurrence of every pattern,
+	# ordered by end position. start and end index into text.
+	def iter(self, text):
+		goto, fail, out, out_link = self.goto, self.fail, self.out, self.out_link
+		state = 0
+		# Lowercasing can change the length of a string, so fold
+		# character by character to keep positions aligned with text
+		for end, ch in enumerate(text, 1):
+			for c in ch.lower():
+				while state and c not in goto[state]:
+					state = fail[state]
+				state = goto[state].get(c, 0)
+			s = state if out[state] else out_link[state]
+			while s:
+				for length, payload in out[s]:
+					yield (end - length, end, payload)
+				s = out_link[s]
+
+
+class NameMatcher:
+	# names: iterable of (name, lang, id) tuples
+	def __init__(self, names):
+		merged = {}
+		for name, lang, poke_id in names:
+			entry = merged.setdefault(name.lower(), [name, [], poke_id])
+			if lang is not None and lang not in entry[1]:
+				entry[1].append(lang)
+		self.automaton = AhoCorasick(
+			(key, (name, tuple(langs), poke_id)) for key, (name, langs, poke_id) in merged.items())
+
+	# Matcher for a plain list of names without language or species
+	@classmethod
+	def for_names(cls, names):
+		return cls((name, None, None) for name in names)
+
+	# All mentions of names in text, ordered by position.
+	# With boundaries, names in Latin (and other alphabetic) scripts
+	# only match as whole words, CJK names always match as substrings.
+	def find_all(self, text, boundaries=True):
+		matches = []
+		for start, end, (name, langs, poke_id) in self.automaton.iter(text):
+			if boundaries and not self._on_boundaries(text, start, end):
+				continue
+			matches.append(Match(start, end, name, langs, poke_id))
+		matches.sort(key=lambda m: (m.start, -m.end))
+		return matches
+
+	@staticmethod
+	def _on_boundaries(text, start, end):
+		if _is_word_char(text[start]) and start > 0 and _is_word_char(text[start - 1]):
+			return False
+		if _is_word_char(text[end - 1]) and end < len(text) and _is_word_char(text[end]):
+			return False
+		return True
+
+
+# Substring matcher for Twitter handles over groups of blocked tokens,
+# e.g. {'banned': ['Bot', 'Pkmn'], 'pokemon': ['Pikachu', ...]}
+class HandleBlocklist:
+	def __init__(self, token_groups):
+		self.automaton = AhoCorasick(
+			(token, (token, kind)) for kind, tokens in token_groups.items() for token in tokens)
+
+	# First blocked token contained in screen_name, as a tuple (token, kind),
+	# only considering tokens of the given kinds (all by default).
+	# Returns None if the handle contains no blocked token.
+	def blocked(self, screen_name, kinds=None):
+		for _, _, (token, kind) in self.automaton.iter(screen_name):
+			if kinds is None or kind in kinds:
+				return (token, kind)
+		return None
+
+
+_shared = None
+
+# The matcher over all Pokémon names in all supported languages,
+# built once per process
+def name_matcher():
+	global _shared
+	if _shared is None:
+		store = Pokedex.store()
+		_shared = NameMatcher(
+			(store.name(species, lang), lang, store.species_id(species))
+			for lang in Pokedex.supported_languages
+			for species in range(len(store)))
+	return _shared
+
+
+if __name__ == '__main__':
+	text = 'Caught a PIKACHU and a Mewtwo! #Glumanda 피카츄 妙蛙種子 Pikachus'
+	print(text)
+	for match in name_matcher().find_all(text):
+		print(match, repr(text[match.start:match.end]))
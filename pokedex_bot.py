@@ -1,20 +1,53 @@
 #!/usr/bin/env python
 
-from tweeter import TweetBot, fit_sentences
+from tweeter import TweetBot, SearchCursors
+from rate_budget import RateBudget, BudgetExhausted
+from seen_store import SeenStore, REPLIED, REJECTED
+from metrics import StageTimings
+from rule_chain import Rule, RuleChain
+from twython import TwythonError
+from candidate_pool import CandidatePool
+from media_cache import MediaCache
+from sprite_pack import sprite_pack
+from sprite_optimizer import OPTIMIZED_DIR, SOURCE_DIR
+from tweet_stream import FilterStream, ReplyQueue, ingest, STREAM_URL
+from reply_pipeline import ReplyPipeline, SEARCH_INTERVAL, REPLY_INTERVAL
 from pokedex import Pokedex
-from fancy_text import italic, bold
+from name_matcher import name_matcher, HandleBlocklist
+from reply_cache import ReplyCache, compose_body, handle_length
+from tweet_length import MAX_WEIGHTED_LENGTH
+from adaptive_schedule import RunOutcome
 import random
 import logging
 import sys
 import os
 import argparse
 import re
+import queue
+import threading
+import signal
 
 log = logging.getLogger('poke_bot')
 
-TWEET_LENGTH = 280
+TWEET_LENGTH = MAX_WEIGHTED_LENGTH
 TWITTER_ACCOUNT_NAME = 'yourpokedex'
-PICTURE_PATH_TEMPLATE = os.path.dirname(os.path.realpath(__file__)) + '/pokemon-sugimori/{id}.png'
+# Number of search requests sent in parallel
+SEARCH_CONCURRENCY = 4
+# Most replies posted by one run
+REPLIES_PER_RUN = 1
+# Search again once fewer candidates than this are left in the pool
+POOL_LOW_WATER = 2
+# Most tweets from the filter stream waiting for a reply
+STREAM_QUEUE_SIZE = 50
+# Seconds between checks that the filter stream is still being read
+STREAM_CHECK_INTERVAL = 5
+# Seconds between reports of the pipeline's queue depth and stage timings
+PIPELINE_REPORT_INTERVAL = 15 * 60
+# Every reply takes a request to each of these
+POSTING_ENDPOINTS = ('upload_media', 'update_status', 'create_favorite')
+PICTURE_PATH_TEMPLATE = SOURCE_DIR + '/{id}.png'
+# Pictures recompressed by sprite_optimizer.py, see picture_path()
+OPTIMIZED_PICTURE_PATH_TEMPLATE = OPTIMIZED_DIR + '/{id}.png'
 
 # Try to import the variables defined in credentials.py
 # If that does not exist (e.g. on Heroku), fall back to environment variables
@@ -38,115 +71,392 @@ except ImportError as error:
 # POKEDEX
 #
 
+# Handles containing these are likely Pokémon accounts or bots
+BANNED_HANDLE_WORDS = ['Pokemon', 'Pokémon', 'Poke', 'Poké', 'Pkmn', 'Bot', 'Trainer']
+
+_handle_blocklist = None
+
+# Blocklist over the banned handle words and all Pokémon names,
+# built once per process
+def handle_blocklist():
+	global _handle_blocklist
+	if _handle_blocklist is None:
+		_handle_blocklist = HandleBlocklist({
+			'banned': BANNED_HANDLE_WORDS,
+			'pokemon': Pokedex.all_names_all_lang()})
+	return _handle_blocklist
+
+_seen_store = None
+
+# Statuses evaluated before, opened once per process
+def seen_store():
+	global _seen_store
+	if _seen_store is None:
+		_seen_store = SeenStore()
+	return _seen_store
+
 # predicate function, returns whether a found pokemon
 # tweet should be responded to
 def _should_respond(tweet):
-	# https://dev.twitter.com/overview/api/tweets
+	return _rejection(tweet) is None
+
+# Name of the first check tweet fails, None if it should be responded to
+def _rejection(tweet):
+	return RESPONSE_RULES.check(tweet)
+
+# Should not mention user with pokémon name as Twitter handle
+def _mentions_pokemon_handle(tweet):
+	for mention in tweet['entities']['user_mentions']:
+		if handle_blocklist().blocked(mention['screen_name'], kinds=('pokemon',)):
+			log.debug("Skipping Pokémon Twitter handle mention: \"{}\"".format(mention['screen_name']))
+			return True
+	return False
+
+# Should not be a Pokemon GO alert bot, that automatically
+# posts expiry times in the format 'until 13:00:00AM'
+def _is_go_bot(tweet):
+	if GO_BOT_PATTERN.search(tweet['text']):
+		log.debug("Skipped Pokemon GO bot: \"{}\"".format(tweet['text'].replace('\n', ' ')))
+		return True
+	return False
+
+GO_BOT_PATTERN = re.compile(r'\d+:\d+:\d+')
+
+# The checks a tweet has to pass to be responded to, each rejecting when true.
+# The chain reorders itself by how much each check rejects per unit of time,
+# RESPONSE_RULES.report(log) shows what each check does.
+# https://dev.twitter.com/overview/api/tweets
+RESPONSE_RULES = RuleChain([
 	# Shouldn't have interacted with tweet previously
-	if tweet['favorited']:
-		return False
+	Rule('favorited', lambda tweet: tweet['favorited']),
+	# Shouldn't have been evaluated in an earlier run
+	Rule('seen', lambda tweet: seen_store().get(tweet['id']) is not None),
 	# Shouldn't be a retweet
-	if tweet.get('retweeted_status') is not None:
-		return False
+	Rule('retweet', lambda tweet: tweet.get('retweeted_status') is not None),
 	# Should not be a manual retweet, "RT ..."
-	if tweet['text'].lower().startswith("rt "):
-		return False
+	Rule('manual_retweet', lambda tweet: tweet['text'].lower().startswith("rt ")),
 	# Should be in supported language, can be 'und' if unknown
-	if tweet['lang'] not in Pokedex.supported_languages:
-		return False
+	Rule('language', lambda tweet: tweet['lang'] not in Pokedex.supported_languages),
 	# Should not be a quote of another tweet
-	if tweet.get('quoted_status_id', False):
-		return False
+	Rule('quote', lambda tweet: tweet.get('quoted_status_id', False)),
 	# Should not have been retweeted yet
-	if int(tweet['retweet_count']) > 0:
-		return False
+	Rule('retweeted', lambda tweet: int(tweet['retweet_count']) > 0),
 	# Should not have too many favorites yet
-	if int(tweet['favorite_count']) > 1:
-		return False
+	Rule('favorites', lambda tweet: int(tweet['favorite_count']) > 1),
 	# Should not include possibly sensitive URLs
-	if tweet.get('possibly_sensitive'):
-		return False
+	Rule('sensitive', lambda tweet: tweet.get('possibly_sensitive')),
 	# Should not contain "pokemon" in Twitter handle, i.e. be a Pokémon account
-	banned_handles = ['Pokemon', 'Pokémon', 'Poke', 'Poké', 'Pkmn', 'Bot', 'Trainer']
-	for word in banned_handles:
-		if word.lower() in tweet['user']['screen_name'].lower():
-			return False
-	# Should not mention user with pokémon name as Twitter handle
-	for mention in tweet['entities']['user_mentions']:
-		for poke_name in [name.lower() for name in Pokedex.all_names_all_lang()]:
-			if poke_name in mention['screen_name'].lower():
-				log.debug("Skipping Pokémon Twitter handle mention: \"{}\"".format(mention['screen_name']))
-				return False
-	# Should not be a Pokemon GO alert bot, that automatically
-	# posts expiry times in the format 'until 13:00:00AM'
-	if re.search(r'\d+:\d+:\d+', tweet['text'].lower()):
-		log.debug("Skipped Pokemon GO bot: \"{}\"".format(tweet['text'].replace('\n', ' ')))
-		return False
-	return True
+	Rule('banned_handle', lambda tweet: handle_blocklist().blocked(tweet['user']['screen_name'], kinds=('banned',))),
+	Rule('pokemon_mention', _mentions_pokemon_handle),
+	Rule('go_bot', _is_go_bot),
+])
 
 def poke_reply(screen_name, poke_name, lang="en"):
 	log.debug("@{user} ({lang}) Pokemon: '{poke}'".format(
 		user=screen_name,
 		lang=lang,
 		poke=poke_name))
-	pokemon = Pokedex.entry(poke_name, lang)
-	if pokemon is None:
+	species = Pokedex.position(poke_name, lang)
+	if species is None:
 		log.debug('No Pokedex entry in {} found for "{}"'.format(lang, poke_name))
 		return (None, None)
-	genus = ', ' + italic(pokemon['genus'])
-	flavor_text = random.choice(pokemon['flavor_texts'])['text']
-	reply_start = '@' + screen_name + ' ' + bold(pokemon['names'])
-	format_str = reply_start + '{optional}' + ': ' + '{text}'
-	text = fit_sentences(format_str, genus, flavor_text, TWEET_LENGTH)
+	cache = reply_cache()
+	if cache and screen_name.isascii() and len(screen_name) <= cache.max_handle_length:
+		n_flavors = cache.n_flavors(species, lang)
+		body = n_flavors and cache.body(species, lang, random.randrange(n_flavors), len(screen_name))
+	else:
+		pokemon = Pokedex.store().species(species, lang)
+		n_flavors = len(pokemon['flavor_texts'])
+		body = n_flavors and compose_body(pokemon['names'], pokemon['genus'],
+			random.choice(pokemon['flavor_texts'])['text'], TWEET_LENGTH - handle_length(screen_name))
+	# e.g. there are no Chinese flavor texts
+	if not n_flavors:
+		log.debug('No flavor text in {} for "{}"'.format(lang, poke_name))
+		return (None, None)
+	text = None if body is None else '@' + screen_name + ' ' + body
 	log.debug(text)
-	picture_path = PICTURE_PATH_TEMPLATE.format(id=pokemon['id'])
-	return (text, picture_path)
+	return (text, picture_path(Pokedex.store().species_id(species)))
+
+# The recompressed picture of the Pokémon with species_id if there is one,
+# e.g. sprite_optimizer.py was interrupted or failed for some pictures,
+# the original otherwise
+def picture_path(species_id):
+	optimized = OPTIMIZED_PICTURE_PATH_TEMPLATE.format(id=species_id)
+	return optimized if os.path.exists(optimized) else PICTURE_PATH_TEMPLATE.format(id=species_id)
+
+_reply_cache = None
+
+# Precomputed reply bodies (see reply_cache.py), opened once per process.
+# False if there is no up to date cache, replies are then fitted as they are composed.
+def reply_cache():
+	global _reply_cache
+	if _reply_cache is None:
+		_reply_cache = ReplyCache.open(Pokedex.store().languages) or False
+	return _reply_cache
+
+# The pictures packed into one memory-mapped file, see sprite_pack.py.
+# The recompressed ones if there are any; pictures not in the pack are read from their files.
+def sprites():
+	return sprite_pack(OPTIMIZED_DIR if os.path.isdir(OPTIMIZED_DIR) else SOURCE_DIR)
+
+# Load everything a reply needs up front: the Pokédex indices, the name
+# matcher, the handle blocklist, the sprite pack and the reply cache.
+# Otherwise the first run pays for it.
+def warm_start():
+	Pokedex.position('')
+	name_matcher()
+	handle_blocklist()
+	sprites()
+	cache = reply_cache()
+	if cache:
+		cache.warm()
+
+# What a run needs that can be kept from one run to the next: the TweetBot
+# with its clients and their open connections, rate budget, search cursors
+# and media cache, the names to search for and the name matcher.
+# Used by run, stream and pipeline.
+class BotContext:
+	def __init__(self, poke_bot=None):
+		if poke_bot is None:
+			poke_bot = TweetBot(APP_KEY, APP_SECRET, OAUTH_TOKEN, OAUTH_TOKEN_SECRET,
+				search_concurrency=SEARCH_CONCURRENCY, budget=RateBudget.load(), cursors=SearchCursors.load(),
+				seen=seen_store(), media=MediaCache.load(), sprites=sprites())
+		self.poke_bot = poke_bot
+		self.poke_names = Pokedex.all_names(lang='en')
+		self.matcher = name_matcher()
 
+	# Search for every name, in a new random order each time so the
+	# searches that run out of budget are not always the same
+	def find_all_tweets(self):
+		names = random.sample(self.poke_names, len(self.poke_names))
+		return self.poke_bot.find_all_tweets(names, _should_respond, self.matcher)
 
-def run(manual_info=None, dry_run=False):
-	tweet = None
+	# Carry the rate limit budget, search cursors, uploads and seen statuses over
+	# to the next run, or the next start
+	def save(self):
+		self.poke_bot.budget.save()
+		self.poke_bot.cursors.save()
+		self.poke_bot.media.save()
+		seen_store().flush()
+
+	def close(self):
+		self.poke_bot.close()
+
+# Find tweets and reply to up to max_replies of them, best candidates first.
+# Each reply goes through compose, upload, post and favorite; the time
+# spent in each stage is logged for the whole batch and added to timings,
+# if given. context is the BotContext to reuse, by default a new one
+# (around poke_bot, if given).
+# Returns a RunOutcome, which clock.py schedules the next run by.
+def run(manual_info=None, dry_run=False, max_replies=REPLIES_PER_RUN, poke_bot=None, timings=None, context=None):
 	if manual_info:
 		text, pic_path = poke_reply(manual_info[0], manual_info[1], manual_info[2])
 		print(text)
 		print(pic_path)
-	else:
-		poke_names = Pokedex.all_names(lang='en', random_order=True)
-		poke_bot = TweetBot(APP_KEY, APP_SECRET, OAUTH_TOKEN, OAUTH_TOKEN_SECRET)
-		tweet, poke_name = poke_bot.find_single_tweet(poke_names, _should_respond)
+		return
+
+	context = context or BotContext(poke_bot)
+	poke_bot = context.poke_bot
+	pool = CandidatePool.load()
+	run_timings = StageTimings()
+	replied = failed = found = 0
+	searched = False
+	try:
+		# One search pass fills the pool for several runs
+		if len(pool) < max(POOL_LOW_WATER, max_replies):
+			searched = True
+			before = len(pool)
+			with run_timings.stage('search'):
+				pool.add(context.find_all_tweets())
+			found = max(0, len(pool) - before)
+		# Don't take more candidates out of the pool than can be posted
+		for endpoint in POSTING_ENDPOINTS:
+			max_replies = poke_bot.budget.shrink(endpoint, max_replies)
+		for _ in range(max_replies):
+			tweet, poke_name = pool.pop(accept=_still_repliable)
+			if tweet is None:
+				log.info('No candidates to reply to')
+				break
+			try:
+				with run_timings.stage('reply'):
+					posted = reply_to(poke_bot, tweet, poke_name, dry_run, run_timings)
+				if posted:
+					replied += 1
+			except BudgetExhausted as error:
+				# Nothing was posted yet, keep the tweet for a later run
+				log.warn('Deferring reply to {}: {}'.format(tweet['id'], error))
+				pool.add([(tweet, poke_name)])
+				break
+			except TwythonError as error:
+				# e.g. the tweet was deleted, don't let it stop the batch
+				log.error('Reply to {} failed: {}'.format(tweet['id'], error))
+				seen_store().record(tweet['id'], REJECTED)
+				failed += 1
+	finally:
+		context.save()
+		pool.save()
+	log.info('Replied to {} tweets, {} failed, {} candidates left'.format(replied, failed, len(pool)))
+	run_timings.report(log)
+	RESPONSE_RULES.report(log)
+	if timings is not None:
+		timings.merge(run_timings)
+	return RunOutcome(replied, searched, found, len(pool), poke_bot.budget.headroom(POSTING_ENDPOINTS))
+
+# Whether a pooled candidate can still be replied to: nobody replied to it
+# in the meantime and the Pokédex has flavor texts for the Pokémon in its language
+def _still_repliable(tweet, poke_name):
+	if seen_store().get(tweet['id']) is not None:
+		return False
+	entry = Pokedex.entry(poke_name, tweet['lang'])
+	return entry is not None and bool(entry['flavor_texts'])
 
-	text = None
-	if tweet is not None:
+# Compose and post the reply to tweet, which mentions poke_name.
+# Returns whether a reply was posted (or printed, if dry_run).
+# Raises BudgetExhausted if the reply has to be deferred, only ever
+# before it is posted.
+# The stages are timed in timings (a StageTimings), if given.
+def reply_to(poke_bot, tweet, poke_name, dry_run=False, timings=None):
+	timings = timings if timings is not None else StageTimings()
+	with timings.stage('compose'):
 		text, pic_path = poke_reply(
 			screen_name = tweet['user']['screen_name'],
 			poke_name = poke_name,
 			lang = tweet['lang'])
-	
-	if text is not None:
-		if dry_run or manual_info:
-			log.info('DRY RUN! Not posting anything.')
-			print(text)
-			print(pic_path)
-		else:
-			tweet_id = tweet['id']
-			poke_bot.reply_media_tweet(text, tweet_id, pic_path)
-			# Tweets that are favorited are not replied to again
+	if text is None:
+		return False
+	if dry_run:
+		log.info('DRY RUN! Not posting anything.')
+		print(text)
+		print(pic_path)
+		return True
+	tweet_id = tweet['id']
+	poke_bot.reply_media_tweet(text, tweet_id, pic_path, timings)
+	# Recorded right away, so the tweet is not replied to again
+	# even if favoriting it fails
+	seen_store().record(tweet_id, REPLIED)
+	with timings.stage('favorite'):
+		try:
 			poke_bot.favorite(tweet_id)
+		except (BudgetExhausted, TwythonError) as error:
+			log.warn('Could not favorite {}: {}'.format(tweet_id, error))
+	return True
 
+# Reply to tweets from the filter stream as they come in, instead of
+# searching periodically. Runs until interrupted, raises RuntimeError
+# if reading the stream stopped.
+# context is the BotContext to use, by default a new one.
+def stream(dry_run=False, stream_url=STREAM_URL, context=None):
+	warm_start()
+	own_context = context is None
+	context = context or BotContext()
+	poke_bot = context.poke_bot
+	filter_stream = FilterStream(poke_bot.credentials, context.poke_names, url=stream_url)
+	replies = ReplyQueue(maxsize=STREAM_QUEUE_SIZE)
+	ingestion = threading.Thread(target=ingest, name='ingest',
+		args=(filter_stream.statuses(), context.poke_names, context.matcher, _should_respond, replies, seen_store()))
+	ingestion.daemon = True
+	ingestion.start()
+	try:
+		while True:
+			try:
+				tweet, poke_name = replies.get(timeout=STREAM_CHECK_INTERVAL)
+			except queue.Empty:
+				if not ingestion.is_alive():
+					raise RuntimeError('Filter stream ingestion stopped')
+				continue
+			try:
+				reply_to(poke_bot, tweet, poke_name, dry_run)
+			except BudgetExhausted as error:
+				log.warn('Skipping reply to {}: {}'.format(tweet['id'], error))
+			except TwythonError as error:
+				# e.g. the tweet was deleted, don't let it stop the stream
+				log.error('Reply to {} failed: {}'.format(tweet['id'], error))
+				seen_store().record(tweet['id'], REJECTED)
+			context.save()
+	finally:
+		filter_stream.stop()
+		context.save()
+		if own_context:
+			context.close()
+
+# ReplyPipeline (see reply_pipeline.py) searching and replying with the
+# BotContext context, saving the state after every search and reply.
+# Not started yet. consumers is the number of reply threads.
+def reply_pipeline(context, dry_run=False, consumers=1, search_interval=SEARCH_INTERVAL, reply_interval=REPLY_INTERVAL):
+	def reply(tweet, poke_name, timings):
+		try:
+			return reply_to(context.poke_bot, tweet, poke_name, dry_run, timings)
+		except TwythonError as error:
+			# e.g. the tweet was deleted
+			log.error('Reply to {} failed: {}'.format(tweet['id'], error))
+			seen_store().record(tweet['id'], REJECTED)
+			return False
+
+	def save():
+		context.save()
+		replies.save_pool()
+
+	replies = ReplyPipeline(context.find_all_tweets, reply, CandidatePool.load(), accept=_still_repliable,
+		consumers=consumers, search_interval=search_interval, reply_interval=reply_interval,
+		after_search=save, after_reply=save)
+	return replies
+
+# Search and reply on separate threads until interrupted or sent SIGTERM,
+# then put the queued candidates back in the pool and save the state.
+# context is the BotContext to use, by default a new one.
+def pipeline(dry_run=False, consumers=1, search_interval=SEARCH_INTERVAL, reply_interval=REPLY_INTERVAL, context=None):
+	warm_start()
+	own_context = context is None
+	context = context or BotContext()
+	replies = reply_pipeline(context, dry_run, consumers, search_interval, reply_interval)
+	stopped = threading.Event()
+	# Heroku sends SIGTERM before it restarts a dyno
+	signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+	replies.start()
+	try:
+		while not stopped.wait(PIPELINE_REPORT_INTERVAL):
+			replies.report(log)
+	except KeyboardInterrupt:
+		pass
+	finally:
+		replies.stop()
+		context.save()
+		replies.save_pool()
+		if own_context:
+			context.close()
+		replies.report(log)
+		RESPONSE_RULES.report(log)
 
 if __name__ == '__main__':
 	logging.getLogger('requests').setLevel(logging.WARN)
 	logging.getLogger('requests_oauthlib').setLevel(logging.WARN)
 	logging.getLogger('oauthlib').setLevel(logging.WARN)
-	log.basicConfig(level=logging.DEBUG)
+	logging.basicConfig(level=logging.DEBUG)
 	log.debug('Started!')
 
 	parser = argparse.ArgumentParser(description='Twitter bot that replies with Pokemon info to users who mention Pokemon.')
 	parser.add_argument('-d', '--dry-run', action='store_true', help="print tweet without actually posting it.")
 	parser.add_argument('-m', nargs=3, metavar=('n', 'p', 'l'),
 		help="pass info '<screen_name> <poke_name> <lang>' manually. Implies '-d'")
+	parser.add_argument('-n', '--replies', type=int, default=REPLIES_PER_RUN,
+		help="reply to up to this many tweets in one run (default: %(default)s).")
+	parser.add_argument('-s', '--stream', action='store_true',
+		help="reply to tweets from the filter stream as they come in, instead of searching once.")
+	parser.add_argument('-p', '--pipeline', action='store_true',
+		help="search and reply on separate threads until interrupted, instead of searching once.")
+	parser.add_argument('-c', '--consumers', type=int, default=1,
+		help="reply threads of the pipeline (default: %(default)s).")
 	args = parser.parse_args()
 
-	run(manual_info=args.m, dry_run=args.dry_run)
+	if args.pipeline:
+		pipeline(dry_run=args.dry_run, consumers=args.consumers)
+	elif args.stream:
+		try:
+			stream(dry_run=args.dry_run)
+		except KeyboardInterrupt:
+			print('\nShutting down. Bye!')
+	else:
+		run(manual_info=args.m, dry_run=args.dry_run, max_replies=args.replies)
 
 	# https://dev.twitter.com/rest/reference/get/statuses/retweets_of_me
 	# https://dev.twitter.com/rest/reference/get/statuses/mentions_timeline
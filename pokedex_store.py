@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+# Compiled, memory-mapped Pokedex store.
+#
+# Importing the Python literal in pokedex_data.py builds ~1.6 MB of nested
+# dicts and lists on every start. The store keeps the same data in a flat
+# binary file that is mmap'ed once and decoded lazily, entry by entry.
+#
+# Layout (all integers little-endian):
+#
+#   header          HEADER struct, see below
+#   language table  n_langs * u32 string ids
+#   string index    (n_strings + 1) * u32 offsets into the string data
+#   string data     UTF-8 blob, deduplicated
+#   name table      n_species * n_langs * u32 string ids
+#   species index   n_species * u32 absolute offsets of the species records
+#   species records id u16, height u16, weight u16, then per language:
+#                   genus u32, n_flavors u16,
+#                   n_flavors * (text u32, n_versions u8, n_versions * u8)
+#
+# Rebuild pokedex.bin from pokedex_data.py with `python pokedex_store.py`.
+
+import mmap
+import os
+import struct
+
+STORE_PATH = os.path.dirname(os.path.realpath(__file__)) + '/pokedex.bin'
+
+MAGIC = b'PKDX'
+VERSION = 1
+# magic, version, n_langs, n_species, n_strings,
+# offsets of: language table, string index, string data, name table, species index
+HEADER = struct.Struct('<4sHHHIIIIII')
+U32 = struct.Struct('<I')
+RECORD_HEAD = struct.Struct('<HHH')
+LANG_HEAD = struct.Struct('<IH')
+FLAVOR_HEAD = struct.Struct('<IB')
+
+
+class StringTable:
+	def __init__(self):
+		self.ids = {}
+		self.strings = []
+
+	def add(self, s):
+		if s not in self.ids:
+			self.ids[s] = len(self.strings)
+			self.strings.append(s)
+		return self.ids[s]
+
+
+# Serialize a list of Pokedex dicts (as in pokedex_data.POKEDEX_DATA)
+# to the binary store format. Returns bytes.
+def compile_store(pokemons, languages):
+	strings = StringTable()
+	lang_ids = [strings.add(lang) for lang in languages]
+	name_ids = []
+	records = []
+	for p in pokemons:
+		name_ids += [strings.add(p['names'].get(lang, '')) for lang in languages]
+		record = [RECORD_HEAD.pack(int(p['id']), int(p['height']), int(p['weight']))]
+		for lang in languages:
+			flavors = p['flavor_texts'].get(lang, [])
+			record.append(LANG_HEAD.pack(strings.add(p['genus'].get(lang, '')), len(flavors)))
+			for flavor in flavors:
+				versions = [int(v) for v in flavor['version_ids']]
+				record.append(FLAVOR_HEAD.pack(strings.add(flavor['text']), len(versions)))
+				record.append(bytes(bytearray(versions)))
+		records.append(b''.join(record))
+
+	encoded = [s.encode('utf-8') for s in strings.strings]
+	string_offsets = [0]
+	for e in encoded:
+		string_offsets.append(string_offsets[-1] + len(e))
+
+	langs_off = HEADER.size
+	string_index_off = langs_off + 4 * len(lang_ids)
+	string_data_off = string_index_off + 4 * len(string_offsets)
+	names_off = string_data_off + string_offsets[-1]
+	species_index_off = names_off + 4 * len(name_ids)
+	record_off = species_index_off + 4 * len(records)
+	record_offsets = []
+	for r in records:
+		record_offsets.append(record_off)
+		record_off += len(r)
+
+	def u32s(values):
+		return struct.pack('<{}I'.format(len(values)), *values)
+
+	return b''.join([
+		HEADER.pack(MAGIC, VERSION, len(languages), len(pokemons), len(encoded),
+			langs_off, string_index_off, string_data_off, names_off, species_index_off),
+		u32s(lang_ids),
+		u32s(string_offsets),
+		b''.join(encoded),
+		u32s(name_ids),
+		u32s(record_offsets),
+		b''.join(records)])
+
+def write_store(pokemons, languages, path=STORE_PATH):
+	data = compile_store(pokemons, languages)
+	tmp_path = path + '.tmp'
+	with open(tmp_path, 'wb') as f:
+		f.write(data)
+	os.rename(tmp_path, path)
+	return len(data)
+
+
+# Read-only view of a compiled store. Nothing is decoded up front,
+# strings and species records are read from the mapping on access.
+class PokedexStore:
+	def __init__(self, buf):
+		self.buf = buf
+		(magic, version, self.n_langs, self.n_species, self.n_strings,
+			self._langs_off, self._string_index_off, self._string_data_off,
+			self._names_off, self._species_index_off) = HEADER.unpack_from(buf, 0)
+		if magic != MAGIC or version != VERSION:
+			raise ValueError('Not a Pokedex store (version {}): {!r} {}'.format(VERSION, magic, version))
+		self.languages = [self.string(self._u32(self._langs_off, i)) for i in range(self.n_langs)]
+		self._lang_index = {lang: i for i, lang in enumerate(self.languages)}
+
+	@classmethod
+	def open(cls, path=STORE_PATH):
+		with open(path, 'rb') as f:
+			# the mapping stays valid after the file is closed
+			return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+	def __len__(self):
+		return self.n_species
+
+	def _u32(self, offset, index):
+		return U32.unpack_from(self.buf, offset + 4 * index)[0]
+
+	def string(self, string_id):
+		start, end = struct.unpack_from('<II', self.buf, self._string_index_off + 4 * string_id)
+		base = self._string_data_off
+		return self.buf[base + start:base + end].decode('utf-8')
+
+	def lang_index(self, lang):
+		return self._lang_index[lang]
+
+	def name(self, species, lang):
+		return self.string(self._u32(self._names_off, species * self.n_langs + self.lang_index(lang)))
+
+	def species_id(self, species):
+		return str(RECORD_HEAD.unpack_from(self.buf, self._u32(self._species_index_off, species))[0])
+
+	def names(self, lang):
+		return [self.name(species, lang) for species in range(self.n_species)]
+
+	# Decode the record of the species at position `species` (0-based, not its id).
+	# With lang set, only that language is decoded, in the shape of Pokedex.entry.
+	# Otherwise all languages are decoded, in the shape of pokedex_data.POKEDEX_DATA.
+	def species(self, species, lang=None):
+		offset = self._u32(self._species_index_off, species)
+		poke_id, height, weight = RECORD_HEAD.unpack_from(self.buf, offset)
+		offset += RECORD_HEAD.size
+		wanted = self.languages if lang is None else [lang]
+		genus = {}
+		flavor_texts = {}
+		for language in self.languages:
+			genus_id, n_flavors = LANG_HEAD.unpack_from(self.buf, offset)
+			offset += LANG_HEAD.size
+			flavors = []
+			for _ in range(n_flavors):
+				text_id, n_versions = FLAVOR_HEAD.unpack_from(self.buf, offset)
+				offset += FLAVOR_HEAD.size
+				if language in wanted:
+					versions = self.buf[offset:offset + n_versions]
+					flavors.append({
+						'text': self.string(text_id),
+						'version_ids': [str(v) for v in bytearray(versions)]})
+				offset += n_versions
+			if language in wanted:
+				genus[language] = self.string(genus_id)
+				if n_flavors:
+					flavor_texts[language] = flavors
+			if language == lang:
+				return {
+					'flavor_texts': flavors,
+					'genus': genus[lang],
+					'names': self.name(species, lang),
+					'id': str(poke_id)}
+		return {
+			'flavor_texts': flavor_texts,
+			'genus': genus,
+			'height': str(height),
+			'id': str(poke_id),
+			'names': {language: self.name(species, language) for language in self.languages},
+			'weight': str(weight)}
+
+
+if __name__ == '__main__':
+	from pokedex_data import POKEDEX_DATA
+	languages = sorted(set(lang for p in POKEDEX_DATA for lang in p['names']))
+	size = write_store(POKEDEX_DATA, languages)
+	store = PokedexStore.open()
+	assert [store.species(i) for i in range(len(store))] == POKEDEX_DATA
+	print('Wrote {} bytes, {} species, languages: {}'.format(size, len(store), ', '.join(languages)))
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+# Rate limit budget for Twitter API endpoints.
+#
+# Every endpoint gets a token bucket. Buckets are synced from the
+# x-rate-limit-* response headers after each call where Twitter sends them,
+# otherwise they refill continuously over their window.
+# The budget is persisted between scheduler runs in the state directory.
+# https://developer.twitter.com/en/docs/basics/rate-limits
+
+import logging
+import threading
+import time
+import bot_state
+
+log = logging.getLogger(__name__)
+
+STATE_FILE = 'rate_budget.json'
+
+# endpoint: (requests, window in seconds)
+DEFAULT_LIMITS = {
+	'search': (180, 15 * 60),
+	'update_status': (300, 3 * 60 * 60),
+	# Not documented per window, stay well below update_status
+	'upload_media': (300, 3 * 60 * 60),
+	'create_favorite': (1000, 24 * 60 * 60),
+}
+
+# Longest time (seconds) acquire() sleeps for a token before deferring
+MAX_WAIT = 60
+
+
+class BudgetExhausted(Exception):
+	def __init__(self, endpoint, wait):
+		super(BudgetExhausted, self).__init__(
+			"Rate limit budget for '{}' exhausted for {:.0f}s".format(endpoint, wait))
+		self.endpoint = endpoint
+		self.wait = wait
+
+
+class Bucket:
+	def __init__(self, limit, window, tokens=None, updated=None, reset=None):
+		self.limit = limit
+		self.window = window
+		self.tokens = limit if tokens is None else tokens
+		self.updated = updated
+		# End of the current rate limit window as reported by Twitter.
+		# While it is known, tokens only come back when it has passed.
+		self.reset = reset
+
+	def refresh(self, now):
+		if self.reset is not None:
+			if now >= self.reset:
+				self.tokens = self.limit
+				self.reset = None
+		elif self.updated is not None:
+			self.tokens = min(self.limit, self.tokens + (now - self.updated) * self.limit / float(self.window))
+		self.updated = now
+
+	# Seconds until n tokens are available, after refresh()
+	def wait_time(self, now, n=1):
+		if self.tokens >= n:
+			return 0
+		if self.reset is not None:
+			return max(0, self.reset - now)
+		return (n - self.tokens) * self.window / float(self.limit)
+
+	def sync(self, now, remaining, reset=None, limit=None):
+		if limit is not None:
+			self.limit = limit
+		if reset is not None and self.reset is not None and reset < self.reset:
+			# Response from an earlier window that completed late
+			return
+		if reset is not None and reset == self.reset:
+			# Same window, requests may complete out of order
+			remaining = min(remaining, self.tokens)
+		self.tokens = remaining
+		self.reset = reset
+		self.updated = now
+
+	def to_dict(self):
+		return {'limit': self.limit, 'window': self.window, 'tokens': self.tokens,
+			'updated': self.updated, 'reset': self.reset}
+
+
+class RateBudget:
+	def __init__(self, limits=None, buckets=None, clock=time.time, sleep=time.sleep):
+		limits = DEFAULT_LIMITS if limits is None else limits
+		self.buckets = {endpoint: Bucket(*limit) for endpoint, limit in limits.items()}
+		self.buckets.update(buckets or {})
+		self.clock = clock
+		self.sleep = sleep
+		self._lock = threading.Lock()
+
+	# Budget as saved by the previous run, or a fresh one
+	@classmethod
+	def load(cls, **kwargs):
+		saved = bot_state.load_json(STATE_FILE, {})
+		buckets = {endpoint: Bucket(**b) for endpoint, b in saved.items()}
+		return cls(buckets=buckets, **kwargs)
+
+	def save(self):
+		with self._lock:
+			bot_state.save_json(STATE_FILE, {e: b.to_dict() for e, b in self.buckets.items()})
+
+	# Number of whole requests currently left for endpoint, None if unlimited
+	def available(self, endpoint):
+		with self._lock:
+			bucket = self.buckets.get(endpoint)
+			if bucket is None:
+				return None
+			bucket.refresh(self.clock())
+			return int(bucket.tokens)
+
+	# Shrink a number of planned requests to what the budget allows
+	def shrink(self, endpoint, wanted):
+		available = self.available(endpoint)
+		return wanted if available is None else max(0, min(wanted, available))
+
+	# Smallest fraction of its limit left for any of endpoints, 1 if none is limited
+	def headroom(self, endpoints):
+		fractions = []
+		for endpoint in endpoints:
+			available = self.available(endpoint)
+			if available is not None:
+				fractions.append(available / float(self.buckets[endpoint].limit))
+		return min(fractions or [1.0])
+
+	# Take n tokens for endpoint. If they are not available but will be
+	# within max_wait seconds, sleep until then. Otherwise raise BudgetExhausted,
+	# so the caller can defer the work to a later run.
+	def acquire(self, endpoint, n=1, max_wait=MAX_WAIT):
+		with self._lock:
+			bucket = self.buckets.get(endpoint)
+			if bucket is None:
+				return
+			bucket.refresh(self.clock())
+			wait = bucket.wait_time(self.clock(), n)
+			if wait == 0:
+				bucket.tokens -= n
+				return
+		if wait > max_wait:
+			raise BudgetExhausted(endpoint, wait)
+		log.info("Rate limit budget for '{}' exhausted, waiting {:.0f}s".format(endpoint, wait))
+		self.sleep(wait)
+		self.acquire(endpoint, n, max_wait=0)
+
+	# Sync endpoint from the rate limit headers of the last response.
+	# get_header(name) returns a header value or None (see Twython.get_lastfunction_header)
+	def update(self, endpoint, get_header):
+		remaining = get_header('x-rate-limit-remaining')
+		if remaining is None:
+			return
+		reset = get_header('x-rate-limit-reset')
+		limit = get_header('x-rate-limit-limit')
+		with self._lock:
+			bucket = self.buckets.get(endpoint)
+			if bucket is None:
+				bucket = self.buckets[endpoint] = Bucket(int(limit or remaining), 15 * 60)
+			bucket.sync(self.clock(), int(remaining),
+				reset=None if reset is None else int(reset),
+				limit=None if limit is None else int(limit))
+		log.debug("Rate limit remaining for '{}': {}".format(endpoint, remaining))
+
+	# The endpoint answered 429, nothing is left until reset
+	def exhausted(self, endpoint, reset=None):
+		with self._lock:
+			bucket = self.buckets.get(endpoint)
+			if bucket is None:
+				return
+			now = self.clock()
+			bucket.sync(now, 0, reset=int(reset) if reset else int(now + bucket.window))
+
+
+if __name__ == '__main__':
+	budget = RateBudget.load()
+	for endpoint in sorted(budget.buckets):
+		bucket = budget.buckets[endpoint]
+		print('{:<20} {:>6} / {:<6} {}'.format(endpoint, budget.available(endpoint), bucket.limit,
+			'reset in {:.0f}s'.format(bucket.reset - time.time()) if bucket.reset else ''))
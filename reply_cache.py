@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+# Precomputed reply bodies, stored next to pokedex.bin.
+#
+# A reply is '@' + screen_name + ' ' + body, where the body is the bold name,
+# the italic genus if there is room, and as many sentences of the flavor text
+# as fit. Only the screen name length changes between replies to the same
+# flavor text, and Twitter handles are at most 15 ASCII characters, so the
+# body is fitted ahead of time for every (species, language, flavor text)
+# and every handle length. Composing a reply is then a lookup and a concatenation.
+#
+# Layout (all integers little-endian):
+#
+#   header          HEADER struct, see below
+#   string index    (n_strings + 1) * u32 offsets into the string data
+#   string data     UTF-8 blob, deduplicated
+#   flavor index    n_species * n_langs * u32 absolute offsets of the flavor blocks
+#   flavor blocks   n_flavors u16, then n_flavors * MAX_HANDLE_LENGTH * u32 body string ids,
+#                   the body for handle length h at position h - 1
+#
+# The cache records the size and CRC-32 of the pokedex.bin it was built from
+# and the BODIES_VERSION it was built with, and is ignored if either changed.
+# Rebuild replies.bin with `python reply_cache.py`; tests/test_reply_cache.py
+# fails while it is out of date.
+
+import logging
+import mmap
+import os
+import struct
+import zlib
+from fancy_text import bold, italic
+from pokedex_store import StringTable, STORE_PATH
+from tweet_length import MAX_WEIGHTED_LENGTH, weighted_length
+from tweeter import fit_sentences
+
+log = logging.getLogger(__name__)
+
+CACHE_PATH = os.path.dirname(os.path.realpath(__file__)) + '/replies.bin'
+
+MAGIC = b'PKRP'
+VERSION = 2
+# Bump whenever the bodies come out differently: a change to the styles in
+# fancy_text, the weights in tweet_length, fit_sentences or compose_body
+BODIES_VERSION = 1
+MAX_HANDLE_LENGTH = 15
+# magic, version, n_langs, n_species, max handle length, n_strings,
+# size and CRC-32 of the source store, bodies version,
+# offsets of: string index, string data, flavor index
+HEADER = struct.Struct('<4sHHHHIIIIIII')
+U16 = struct.Struct('<H')
+U32 = struct.Struct('<I')
+
+
+# Reply without the '@screen_name ' it starts with, fitted to length
+def compose_body(name, genus, flavor_text, length):
+	return fit_sentences(bold(name) + '{optional}: {text}', ', ' + italic(genus), flavor_text, length)
+
+# Weighted length of the start of a reply to screen_name
+def handle_length(screen_name):
+	return weighted_length('@' + screen_name + ' ')
+
+def _store_fingerprint(path):
+	with open(path, 'rb') as f:
+		data = f.read()
+	return len(data), zlib.crc32(data) & 0xffffffff
+
+# Fit every flavor text of the store (a PokedexStore) for every handle length.
+# Returns bytes.
+def compile_cache(store, store_path=STORE_PATH):
+	strings = StringTable()
+	blocks = []
+	for species in range(len(store)):
+		for lang in store.languages:
+			entry = store.species(species, lang)
+			flavors = entry['flavor_texts']
+			block = [U16.pack(len(flavors))]
+			for flavor in flavors:
+				bodies = [compose_body(entry['names'], entry['genus'], flavor['text'],
+					MAX_WEIGHTED_LENGTH - handle_length('x' * h)) for h in range(1, MAX_HANDLE_LENGTH + 1)]
+				block.append(struct.pack('<{}I'.format(MAX_HANDLE_LENGTH), *[strings.add(b or '') for b in bodies]))
+			blocks.append(b''.join(block))
+
+	encoded = [s.encode('utf-8') for s in strings.strings]
+	string_offsets = [0]
+	for e in encoded:
+		string_offsets.append(string_offsets[-1] + len(e))
+
+	string_index_off = HEADER.size
+	string_data_off = string_index_off + 4 * len(string_offsets)
+	flavor_index_off = string_data_off + string_offsets[-1]
+	block_off = flavor_index_off + 4 * len(blocks)
+	block_offsets = []
+	for b in blocks:
+		block_offsets.append(block_off)
+		block_off += len(b)
+
+	def u32s(values):
+		return struct.pack('<{}I'.format(len(values)), *values)
+
+	store_size, store_crc = _store_fingerprint(store_path)
+	return b''.join([
+		HEADER.pack(MAGIC, VERSION, len(store.languages), len(store), MAX_HANDLE_LENGTH, len(encoded),
+			store_size, store_crc, BODIES_VERSION, string_index_off, string_data_off, flavor_index_off),
+		u32s(string_offsets),
+		b''.join(encoded),
+		u32s(block_offsets),
+		b''.join(blocks)])
+
+def write_cache(store, path=CACHE_PATH, store_path=STORE_PATH):
+	data = compile_cache(store, store_path)
+	tmp_path = path + '.tmp'
+	with open(tmp_path, 'wb') as f:
+		f.write(data)
+	os.rename(tmp_path, path)
+	return len(data)
+
+
+# Read-only view of a compiled reply cache, like PokedexStore
+class ReplyCache:
+	def __init__(self, buf, languages):
+		self.buf = buf
+		(magic, version, self.n_langs, self.n_species, self.max_handle_length, self.n_strings,
+			self.store_size, self.store_crc, self.bodies_version, self._string_index_off, self._string_data_off,
+			self._flavor_index_off) = HEADER.unpack_from(buf, 0)
+		if magic != MAGIC or version != VERSION:
+			raise ValueError('Not a reply cache (version {}): {!r} {}'.format(VERSION, magic, version))
+		self._lang_index = {lang: i for i, lang in enumerate(languages)}
+
+	# The cache at path, None if it is missing or was built from another store
+	# or with another BODIES_VERSION
+	@classmethod
+	def open(cls, languages, path=CACHE_PATH, store_path=STORE_PATH):
+		try:
+			with open(path, 'rb') as f:
+				cache = cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), languages)
+		except (IOError, ValueError) as error:
+			log.warn('No reply cache: {}'.format(error))
+			return None
+		if ((cache.store_size, cache.store_crc) != _store_fingerprint(store_path)
+				or cache.bodies_version != BODIES_VERSION):
+			log.warn('Reply cache {} is out of date, run reply_cache.py'.format(path))
+			return None
+		return cache
+
+	# Read through the whole mapping once, so replies don't wait for page faults
+	def warm(self):
+		for offset in range(0, len(self.buf), mmap.PAGESIZE):
+			self.buf[offset]
+		return len(self.buf)
+
+	def _block(self, species, lang):
+		return U32.unpack_from(self.buf, self._flavor_index_off + 4 * (species * self.n_langs + self._lang_index[lang]))[0]
+
+	def n_flavors(self, species, lang):
+		return U16.unpack_from(self.buf, self._block(species, lang))[0]
+
+	# Body of the reply to a handle of handle_length with the flavor-th flavor text
+	# of the species (its position in the store) in lang. None if nothing fits,
+	# or handle_length is over the longest length that was precomputed.
+	def body(self, species, lang, flavor, handle_length):
+		if not 0 < handle_length <= self.max_handle_length:
+			return None
+		offset = self._block(species, lang) + U16.size + 4 * (flavor * self.max_handle_length + handle_length - 1)
+		start, end = struct.unpack_from('<II', self.buf, self._string_index_off + 4 * U32.unpack_from(self.buf, offset)[0])
+		base = self._string_data_off
+		return self.buf[base + start:base + end].decode('utf-8') or None
+
+
+if __name__ == '__main__':
+	import random
+	from pokedex import Pokedex
+	logging.disable(logging.WARN)
+	store = Pokedex.store()
+	size = write_cache(store)
+	cache = ReplyCache.open(store.languages)
+	# Spot check against fitting at runtime
+	rng = random.Random(0)
+	for _ in range(2000):
+		species, lang = rng.randrange(len(store)), rng.choice(store.languages)
+		entry = store.species(species, lang)
+		if not entry['flavor_texts']:
+			assert cache.n_flavors(species, lang) == 0
+			continue
+		flavor = rng.randrange(len(entry['flavor_texts']))
+		screen_name = 'x' * rng.randint(1, MAX_HANDLE_LENGTH)
+		expected = fit_sentences('@' + screen_name + ' ' + bold(entry['names']) + '{optional}: {text}',
+			', ' + italic(entry['genus']), entry['flavor_texts'][flavor]['text'], MAX_WEIGHTED_LENGTH)
+		body = cache.body(species, lang, flavor, len(screen_name))
+		assert (None if body is None else '@' + screen_name + ' ' + body) == expected
+	print('Wrote {} bytes, {} bodies'.format(size, cache.n_strings))
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+# Searching and replying on their own threads, so a slow upload never holds
+# up the next search and a slow search never holds up a reply.
+#
+# The search thread fills a CandidatePool and moves the best candidates from
+# it into a bounded queue, searching again at most every search_interval
+# when both run low. Each of the reply threads takes the next candidate
+# from the queue and replies to it, then waits reply_interval.
+# Candidates that can't be replied to yet because the rate limit budget is
+# exhausted go back into the pool.
+#
+# stop() lets the search thread and the replies in progress finish, and
+# puts the queued candidates back into the pool, which outlives the
+# pipeline. Replying to them right away would post a burst of replies on
+# every restart.
+
+import logging
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+from metrics import StageTimings, percentile
+from rate_budget import BudgetExhausted
+
+log = logging.getLogger(__name__)
+
+QUEUE_SIZE = 10
+# Seconds
+SEARCH_INTERVAL = 15 * 60
+REPLY_INTERVAL = 10 * 60
+# How long an idle reply thread waits for the queue before it checks for stop()
+POLL_INTERVAL = 1.0
+# Queue depth samples kept for report()
+DEPTH_SAMPLES = 10000
+
+
+class ReplyPipeline:
+	# search(): list of (status, poke_name) tuples found, as TweetBot.find_all_tweets
+	# reply(status, poke_name, timings): reply to status, may raise BudgetExhausted
+	#   to defer it. Other errors are logged and the candidate dropped.
+	# pool: CandidatePool the candidates wait in before they are queued
+	# accept(status, poke_name): whether a candidate can still be replied to, as in CandidatePool.pop
+	# after_search(), after_reply(): e.g. persist state, called on the thread that searched or replied
+	def __init__(self, search, reply, pool, accept=None, consumers=1, queue_size=QUEUE_SIZE,
+			search_interval=SEARCH_INTERVAL, reply_interval=REPLY_INTERVAL,
+			after_search=None, after_reply=None, clock=time.time):
+		self.search = search
+		self.reply = reply
+		self.pool = pool
+		self.accept = accept
+		self.consumers = consumers
+		self.queue = queue.Queue(maxsize=queue_size)
+		self.search_interval = search_interval
+		self.reply_interval = reply_interval
+		self.after_search = after_search or (lambda: None)
+		self.after_reply = after_reply or (lambda: None)
+		self.clock = clock
+		# Search again when fewer candidates than this are pooled and queued
+		self.low_water = max(2, consumers)
+		self.timings = StageTimings()
+		self.depths = deque(maxlen=DEPTH_SAMPLES)
+		self.searches = self.found = self.replied = self.deferred = self.failed = 0
+		# Guards pool and the counters
+		self._lock = threading.Lock()
+		self._stopping = threading.Event()
+		# Set by the reply threads when the queue runs low
+		self._wake = threading.Event()
+		self._last_search = None
+		self._threads = []
+
+	def start(self):
+		self._threads = [threading.Thread(target=self._produce, name='search')]
+		self._threads += [threading.Thread(target=self._consume, name='reply-{}'.format(i)) for i in range(self.consumers)]
+		for thread in self._threads:
+			thread.daemon = True
+			thread.start()
+		return self
+
+	# Stop searching, wait for the replies in progress and put the
+	# queued candidates back into the pool. Returns how many were queued.
+	def stop(self):
+		self._stopping.set()
+		self._wake.set()
+		for thread in self._threads:
+			thread.join()
+		queued = self._requeue_all()
+		log.info('Stopped, {} queued candidates back in the pool'.format(queued))
+		return queued
+
+	def _requeue_all(self):
+		for requeued in itertools.count():
+			try:
+				status, poke_name, _ = self.queue.get_nowait()
+			except queue.Empty:
+				return requeued
+			with self._lock:
+				self.pool.add([(status, poke_name)])
+
+	def _sample_depth(self):
+		self.depths.append(self.queue.qsize())
+
+	def _produce(self):
+		while not self._stopping.is_set():
+			self._wake.clear()
+			with self._lock:
+				low = len(self.pool) + self.queue.qsize() < self.low_water
+			now = self.clock()
+			due = self._last_search is None or now - self._last_search >= self.search_interval
+			if low and due:
+				self._last_search = now
+				try:
+					with self.timings.stage('search'):
+						found = self.search()
+					with self._lock:
+						before = len(self.pool)
+						self.pool.add(found)
+						self.searches += 1
+						self.found += max(0, len(self.pool) - before)
+					self.after_search()
+				except Exception:
+					log.exception('Search failed')
+			self._fill()
+			# Until the reply threads need more or the next search is due
+			if self._last_search is None:
+				self._wake.wait(self.search_interval)
+			else:
+				self._wake.wait(max(0.0, self._last_search + self.search_interval - self.clock()))
+
+	# Move the best pooled candidates into the free places of the queue
+	def _fill(self):
+		with self._lock:
+			while not self.queue.full():
+				status, poke_name = self.pool.pop(accept=self.accept)
+				if status is None:
+					break
+				self.queue.put_nowait((status, poke_name, self.clock()))
+				self._sample_depth()
+
+	def _consume(self):
+		while not self._stopping.is_set():
+			try:
+				status, poke_name, queued = self.queue.get(timeout=POLL_INTERVAL)
+			except queue.Empty:
+				self._wake.set()
+				continue
+			self._sample_depth()
+			if self.queue.qsize() < self.low_water:
+				self._wake.set()
+			if self._stopping.is_set():
+				# Stopped while waiting for the queue
+				with self._lock:
+					self.pool.add([(status, poke_name)])
+				return
+			self.timings.record('queue', self.clock() - queued)
+			try:
+				with self.timings.stage('reply'):
+					posted = self.reply(status, poke_name, self.timings)
+				with self._lock:
+					self.replied += 1 if posted else 0
+			except BudgetExhausted as error:
+				log.warn('Deferring reply to {}: {}'.format(status['id'], error))
+				with self._lock:
+					self.pool.add([(status, poke_name)])
+					self.deferred += 1
+				self.after_reply()
+				# Nothing can be posted until then
+				self._stopping.wait(error.wait)
+				continue
+			except Exception:
+				log.exception('Reply to {} failed'.format(status['id']))
+				with self._lock:
+					self.failed += 1
+			self.after_reply()
+			self._stopping.wait(self.reply_interval)
+
+	# Save the pool, safe while the pipeline runs
+	def save_pool(self):
+		with self._lock:
+			self.pool.save()
+
+	def report(self, logger):
+		depths = list(self.depths)
+		logger.info('{} searches found {} candidates; {} replied, {} deferred, {} failed; {} queued, {} pooled'.format(
+			self.searches, self.found, self.replied, self.deferred, self.failed, self.queue.qsize(), len(self.pool)))
+		if depths:
+			logger.info('Queue depth: mean {:.1f}, p50 {}, p95 {}, max {} (of {})'.format(
+				sum(depths) / float(len(depths)), percentile(depths, 50), percentile(depths, 95), max(depths),
+				self.queue.maxsize))
+		self.timings.report(logger, title='Pipeline stage timings')
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+# Record of every status that was already evaluated, and the verdict.
+#
+# Status ids are kept in SQLite in the state directory. An in-memory
+# Bloom filter sits in front of it, so the common case, a status that
+# was never seen, is answered without touching the database.
+# https://en.wikipedia.org/wiki/Bloom_filter
+
+import hashlib
+import logging
+import math
+import sqlite3
+import threading
+import time
+import bot_state
+
+log = logging.getLogger(__name__)
+
+STATE_FILE = 'seen.sqlite3'
+# Statuses are forgotten after this many seconds ...
+MAX_AGE = 30 * 24 * 60 * 60
+# ... or when the store grows past this many, oldest first
+MAX_ENTRIES = 200000
+# flush() evicts again after this many seconds or recorded statuses
+EVICT_INTERVAL = 60 * 60
+EVICT_RECORDS = 10000
+
+# Verdicts
+REPLIED = 'replied'
+REJECTED = 'rejected'
+UNMATCHED = 'unmatched'
+
+
+class BloomFilter:
+	def __init__(self, capacity, error_rate=0.01):
+		self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+		self.hashes = max(1, int(round(self.size / float(capacity) * math.log(2))))
+		self.bits = bytearray((self.size + 7) // 8)
+
+	# Double hashing, positions are h1 + i * h2
+	def _positions(self, key):
+		digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=16).digest()
+		h1 = int.from_bytes(digest[:8], 'little')
+		h2 = int.from_bytes(digest[8:], 'little') | 1
+		return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+	def add(self, key):
+		for p in self._positions(key):
+			self.bits[p >> 3] |= 1 << (p & 7)
+
+	def __contains__(self, key):
+		return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+
+class SeenStore:
+	def __init__(self, path=None, max_age=MAX_AGE, max_entries=MAX_ENTRIES,
+			evict_interval=EVICT_INTERVAL, evict_records=EVICT_RECORDS):
+		self.path = path or bot_state.state_path(STATE_FILE)
+		self.max_age = max_age
+		self.max_entries = max_entries
+		self.evict_interval = evict_interval
+		self.evict_records = evict_records
+		self._lock = threading.Lock()
+		self.db = sqlite3.connect(self.path, check_same_thread=False)
+		self.db.execute('CREATE TABLE IF NOT EXISTS seen ('
+			'id INTEGER PRIMARY KEY, verdict TEXT NOT NULL, seen_at REAL NOT NULL)')
+		self.db.execute('CREATE INDEX IF NOT EXISTS seen_at ON seen (seen_at)')
+		self.evict()
+
+	# Drop statuses older than max_age and the oldest beyond max_entries,
+	# then rebuild the Bloom filter from what is left.
+	# Returns the number of evicted statuses.
+	def evict(self):
+		with self._lock:
+			cursor = self.db.execute('DELETE FROM seen WHERE seen_at < ?', (time.time() - self.max_age,))
+			evicted = cursor.rowcount
+			cursor = self.db.execute('DELETE FROM seen WHERE id IN '
+				'(SELECT id FROM seen ORDER BY seen_at DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+			evicted += cursor.rowcount
+			self.db.commit()
+			self.bloom = BloomFilter(self.max_entries)
+			for (status_id,) in self.db.execute('SELECT id FROM seen'):
+				self.bloom.add(status_id)
+			self._evicted_at = time.time()
+			self._recorded = 0
+		if evicted:
+			log.debug('Evicted {} seen statuses'.format(evicted))
+		return evicted
+
+	# Verdict recorded for status_id, None if it was not seen before
+	def get(self, status_id):
+		if status_id not in self.bloom:
+			return None
+		with self._lock:
+			row = self.db.execute('SELECT verdict FROM seen WHERE id = ?', (status_id,)).fetchone()
+		return None if row is None else row[0]
+
+	def __contains__(self, status_id):
+		return self.get(status_id) is not None
+
+	# Not written to disk before flush()
+	def record(self, status_id, verdict):
+		with self._lock:
+			self.db.execute('INSERT OR REPLACE INTO seen (id, verdict, seen_at) VALUES (?, ?, ?)',
+				(status_id, verdict, time.time()))
+			self.bloom.add(status_id)
+			self._recorded += 1
+
+	# Also evicts when the last eviction is evict_interval seconds or
+	# evict_records statuses ago, the bot runs for weeks without restarting
+	def flush(self):
+		with self._lock:
+			self.db.commit()
+			due = (self._recorded >= self.evict_records
+				or time.time() - self._evicted_at >= self.evict_interval)
+		if due:
+			self.evict()
+
+	def close(self):
+		with self._lock:
+			self.db.commit()
+			self.db.close()
+
+	def __len__(self):
+		with self._lock:
+			return self.db.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+
+
+if __name__ == '__main__':
+	store = SeenStore()
+	with store._lock:
+		counts = store.db.execute('SELECT verdict, COUNT(*) FROM seen GROUP BY verdict').fetchall()
+	print('{} seen statuses in {}'.format(len(store), store.path))
+	for verdict, count in counts:
+		print('{:<12} {:>8}'.format(verdict, count))
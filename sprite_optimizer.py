@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+
+# Recompresses the Pokémon pictures losslessly into OPTIMIZED_DIR.
+# pokedex_bot.py uploads a picture from there if it is there, from
+# SOURCE_DIR otherwise.
+#
+# Every picture is decoded to RGBA and encoded again in the smallest of:
+# the reductions that are exact for it (RGB if fully opaque, grey if all
+# grey, a palette of 1, 2, 4 or 8 bits if it has at most 256 colours),
+# each PNG filter for all rows and the adaptive per-row choice, and zlib's
+# default and filtered strategies. Chunks that don't affect the pixels
+# (text, offsets, background, ...) are dropped. The result is decoded
+# again and compared with the source before it is written; if nothing
+# beats the source it is copied as it is.
+#
+# With --max-bytes, pictures still larger than that are scaled down
+# by halves until they fit. That is not lossless, so those pictures go
+# into CAPPED_DIR instead, which the bot doesn't upload from.
+#
+# manifest.json in the target directory lists the sizes and choices for
+# every picture, unchanged pictures are skipped on the next run. A picture
+# that fails to optimize is logged and left out.
+#
+# OPTIMIZED_DIR is checked in, like pokedex.bin, so nothing has to run on
+# deploy. Run this again after changing the pictures in SOURCE_DIR;
+# tests/test_sprite_optimizer.py fails until then.
+# https://www.w3.org/TR/PNG/
+#
+#   python sprite_optimizer.py [--max-bytes N] [--workers N] [--force]
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import struct
+import zlib
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.realpath(__file__))
+SOURCE_DIR = ROOT + '/pokemon-sugimori'
+OPTIMIZED_DIR = ROOT + '/pokemon-sugimori-optimized'
+CAPPED_DIR = ROOT + '/pokemon-sugimori-capped'
+MANIFEST = 'manifest.json'
+
+SIGNATURE = b'\x89PNG\r\n\x1a\n'
+IHDR = struct.Struct('>IIBBBBB')
+# Chunks that change how the pixels look, kept as they are
+KEEP_CHUNKS = (b'gAMA', b'cHRM', b'sRGB', b'iCCP')
+# Colour types
+GREY, RGB, PALETTE, GREY_ALPHA, RGBA = 0, 2, 3, 4, 6
+CHANNELS = {GREY: 1, RGB: 3, PALETTE: 1, GREY_ALPHA: 2, RGBA: 4}
+FILTER_NAMES = ['none', 'sub', 'up', 'average', 'paeth', 'adaptive']
+STRATEGIES = [('default', zlib.Z_DEFAULT_STRATEGY), ('filtered', zlib.Z_FILTERED)]
+# Distance of a filtered byte from 0, for the adaptive filter choice
+_DISTANCE = bytes(min(b, 256 - b) for b in range(256))
+
+# rows: one bytes object of width * 4 RGBA samples per row
+# chunks: (type, data) of the KEEP_CHUNKS in the picture
+Picture = namedtuple('Picture', ['width', 'height', 'rows', 'chunks'])
+
+
+def read_chunks(data):
+	if data[:8] != SIGNATURE:
+		raise ValueError('Not a PNG file')
+	chunks = []
+	offset = 8
+	while offset < len(data):
+		length, chunk_type = struct.unpack_from('>I4s', data, offset)
+		chunks.append((chunk_type, data[offset + 8:offset + 8 + length]))
+		offset += 12 + length
+	return chunks
+
+def _chunk(chunk_type, data):
+	return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff)
+
+def _paeth(a, b, c):
+	p = a + b - c
+	pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+	if pa <= pb and pa <= pc:
+		return a
+	return b if pb <= pc else c
+
+# Reverse the filter of every row, returns the list of rows
+def _unfilter(raw, height, stride, bpp):
+	rows = []
+	previous = bytearray(stride)
+	offset = 0
+	for _ in range(height):
+		filter_type = raw[offset]
+		row = bytearray(raw[offset + 1:offset + 1 + stride])
+		offset += 1 + stride
+		if filter_type == 1:
+			for i in range(bpp, stride):
+				row[i] = (row[i] + row[i - bpp]) & 0xff
+		elif filter_type == 2:
+			row = bytearray(bytes((x + y) & 0xff for x, y in zip(row, previous)))
+		elif filter_type == 3:
+			for i in range(stride):
+				row[i] = (row[i] + ((row[i - bpp] if i >= bpp else 0) + previous[i]) // 2) & 0xff
+		elif filter_type == 4:
+			for i in range(stride):
+				left = row[i - bpp] if i >= bpp else 0
+				upper_left = previous[i - bpp] if i >= bpp else 0
+				row[i] = (row[i] + _paeth(left, previous[i], upper_left)) & 0xff
+		elif filter_type != 0:
+			raise ValueError('Unknown filter type {}'.format(filter_type))
+		rows.append(bytes(row))
+		previous = row
+	return rows
+
+# Samples of a row of depth bits each, as a list of ints
+def _unpack(row, depth, count):
+	if depth == 8:
+		return list(row[:count])
+	per_byte = 8 // depth
+	mask = (1 << depth) - 1
+	return [(row[i // per_byte] >> (8 - depth * (i % per_byte + 1))) & mask for i in range(count)]
+
+# Decode a non-interlaced PNG with 8 bit samples (or palette/grey of 1-8 bits) to RGBA
+def decode(data):
+	chunks = read_chunks(data)
+	width, height, depth, color_type, compression, filter_method, interlace = IHDR.unpack(chunks[0][1])
+	if interlace or depth > 8 or (depth < 8 and color_type not in (GREY, PALETTE)):
+		raise ValueError('Unsupported PNG: depth {}, colour type {}, interlace {}'.format(depth, color_type, interlace))
+	palette = transparency = None
+	for chunk_type, chunk_data in chunks:
+		if chunk_type == b'PLTE':
+			palette = [chunk_data[i:i + 3] for i in range(0, len(chunk_data), 3)]
+		elif chunk_type == b'tRNS':
+			transparency = chunk_data
+	raw = zlib.decompress(b''.join(d for t, d in chunks if t == b'IDAT'))
+	bits = CHANNELS[color_type] * depth
+	rows = _unfilter(raw, height, (width * bits + 7) // 8, max(1, bits // 8))
+	rgba = []
+	for row in rows:
+		if color_type == RGBA:
+			rgba.append(row)
+		elif color_type == RGB:
+			out = bytearray(width * 4)
+			out[0::4], out[1::4], out[2::4] = row[0::3], row[1::3], row[2::3]
+			out[3::4] = b'\xff' * width
+			rgba.append(bytes(out))
+		elif color_type == GREY_ALPHA:
+			out = bytearray(width * 4)
+			out[0::4] = out[1::4] = out[2::4] = row[0::2]
+			out[3::4] = row[1::2]
+			rgba.append(bytes(out))
+		elif color_type == GREY:
+			scale = 255 // ((1 << depth) - 1)
+			rgba.append(b''.join(bytes((v * scale,) * 3) + b'\xff' for v in _unpack(row, depth, width)))
+		else:
+			alphas = transparency or b''
+			rgba.append(b''.join(palette[v] + (alphas[v:v + 1] or b'\xff') for v in _unpack(row, depth, width)))
+	return Picture(width, height, rgba, [(t, d) for t, d in chunks if t in KEEP_CHUNKS])
+
+
+# Bytewise subtraction and average of rows packed into integers (SWAR),
+# so the sub, up and average filters take a few operations per row
+def _sub(x, y, high):
+	return ((x | high) - (y & ~high)) ^ ((x ^ ~y) & high)
+
+def _average(x, y, low7):
+	return (x & y) + (((x ^ y) >> 1) & low7)
+
+# Rows filtered with each of the five filter types: a list of five lists of
+# rows, every row starting with its filter type byte
+def _filter_all(rows, bpp):
+	stride = len(rows[0])
+	high = int.from_bytes(b'\x80' * stride, 'big')
+	low7 = int.from_bytes(b'\x7f' * stride, 'big')
+	mask = (1 << (8 * stride)) - 1
+	filtered = [[], [], [], [], []]
+	previous = bytes(stride)
+	for row in rows:
+		x = int.from_bytes(row, 'big')
+		left = int.from_bytes(row[:-bpp], 'big') if stride > bpp else 0
+		up = int.from_bytes(previous, 'big')
+		filtered[0].append(b'\0' + row)
+		filtered[1].append(b'\1' + (_sub(x, left, high) & mask).to_bytes(stride, 'big'))
+		filtered[2].append(b'\2' + (_sub(x, up, high) & mask).to_bytes(stride, 'big'))
+		filtered[3].append(b'\3' + (_sub(x, _average(left, up, low7), high) & mask).to_bytes(stride, 'big'))
+		paeth = bytearray(stride)
+		for i in range(stride):
+			a = row[i - bpp] if i >= bpp else 0
+			c = previous[i - bpp] if i >= bpp else 0
+			paeth[i] = (row[i] - _paeth(a, previous[i], c)) & 0xff
+		filtered[4].append(b'\4' + bytes(paeth))
+		previous = row
+	return filtered
+
+# The exact reductions of picture, as (colour type, depth, rows, PLTE, tRNS) tuples
+def _encodings(picture):
+	rows = picture.rows
+	yield (RGBA, 8, rows, None, None)
+	opaque = all(row[3::4] == b'\xff' * picture.width for row in rows)
+	grey = all(row[0::4] == row[1::4] == row[2::4] for row in rows)
+	if opaque:
+		yield (RGB, 8, [bytes(b for i, b in enumerate(row) if i % 4 != 3) for row in rows], None, None)
+	if grey:
+		yield (GREY_ALPHA, 8, [bytes(b for i, b in enumerate(row) if i % 4 in (0, 3)) for row in rows], None, None)
+	if grey and opaque:
+		yield (GREY, 8, [row[0::4] for row in rows], None, None)
+	colors = set()
+	for row in rows:
+		colors.update(row[i:i + 4] for i in range(0, len(row), 4))
+		if len(colors) > 256:
+			return
+	# Translucent colours first, so tRNS can stop after the last of them
+	palette = sorted(colors, key=lambda c: c[3] == 255)
+	index = {color: i for i, color in enumerate(palette)}
+	depth = next(d for d in (1, 2, 4, 8) if len(palette) <= 1 << d)
+	per_byte = 8 // depth
+	packed = []
+	for row in rows:
+		indices = [index[row[i:i + 4]] for i in range(0, len(row), 4)]
+		indices += [0] * (-len(indices) % per_byte)
+		packed.append(bytes(sum(indices[i + j] << (8 - depth * (j + 1)) for j in range(per_byte))
+			for i in range(0, len(indices), per_byte)))
+	translucent = [c[3] for c in palette if c[3] != 255]
+	yield (PALETTE, depth, packed, b''.join(c[:3] for c in palette), bytes(translucent) or None)
+
+# Smallest PNG of picture. Returns (bytes, colour type, depth, filter name, strategy name).
+def encode(picture):
+	best = None
+	for color_type, depth, rows, plte, trns in _encodings(picture):
+		bpp = max(1, CHANNELS[color_type] * depth // 8)
+		filtered = _filter_all(rows, bpp)
+		adaptive = [min(candidates, key=lambda r: sum(r[1:].translate(_DISTANCE))) for candidates in zip(*filtered)]
+		# Palette pictures usually compress best unfiltered
+		streams = [filtered[0], adaptive] if color_type == PALETTE else filtered + [adaptive]
+		for stream in streams:
+			raw = b''.join(stream)
+			filter_name = FILTER_NAMES[5] if stream is adaptive else FILTER_NAMES[stream[0][0]]
+			for strategy_name, strategy in STRATEGIES:
+				compressor = zlib.compressobj(9, zlib.DEFLATED, 15, 9, strategy)
+				idat = compressor.compress(raw) + compressor.flush()
+				if best is None or len(idat) < len(best[0]):
+					best = (idat, color_type, depth, plte, trns, filter_name, strategy_name)
+	idat, color_type, depth, plte, trns, filter_name, strategy_name = best
+	chunks = [_chunk(b'IHDR', IHDR.pack(picture.width, picture.height, depth, color_type, 0, 0, 0))]
+	chunks += [_chunk(t, d) for t, d in picture.chunks]
+	if plte is not None:
+		chunks.append(_chunk(b'PLTE', plte))
+	if trns is not None:
+		chunks.append(_chunk(b'tRNS', trns))
+	chunks += [_chunk(b'IDAT', idat), _chunk(b'IEND', b'')]
+	return (SIGNATURE + b''.join(chunks), color_type, depth, filter_name, strategy_name)
+
+# picture at half the size, every pixel the alpha-weighted average of 2x2 pixels
+def halve(picture):
+	width, height = max(1, picture.width // 2), max(1, picture.height // 2)
+	rows = []
+	for y in range(height):
+		sources = picture.rows[2 * y:2 * y + 2]
+		out = bytearray(width * 4)
+		for x in range(width):
+			pixels = [row[8 * x + dx:8 * x + dx + 4] for row in sources for dx in (0, 4) if 8 * x + dx < len(row)]
+			alpha = sum(p[3] for p in pixels)
+			for c in range(3):
+				out[4 * x + c] = (sum(p[c] * p[3] for p in pixels) + alpha // 2) // alpha if alpha else 0
+			out[4 * x + 3] = (alpha + len(pixels) // 2) // len(pixels)
+		rows.append(bytes(out))
+	return Picture(width, height, rows, picture.chunks)
+
+# Optimize one picture. Returns (optimized bytes, manifest entry).
+def optimize(data, max_bytes=None):
+	picture = decode(data)
+	optimized, color_type, depth, filter_name, strategy_name = encode(picture)
+	if decode(optimized).rows != picture.rows:
+		raise ValueError('Optimized picture differs from the source')
+	entry = {'color_type': color_type, 'depth': depth, 'filter': filter_name, 'strategy': strategy_name, 'scale': 1}
+	if len(optimized) >= len(data):
+		optimized = data
+		entry.update(color_type=None, depth=None, filter=None, strategy=None)
+	scale = 1
+	while max_bytes is not None and len(optimized) > max_bytes and min(picture.width, picture.height) > 1:
+		picture = halve(picture)
+		scale /= 2.0
+		optimized, color_type, depth, filter_name, strategy_name = encode(picture)
+		entry.update(color_type=color_type, depth=depth, filter=filter_name, strategy=strategy_name, scale=scale)
+	entry.update(source_bytes=len(data), bytes=len(optimized), saved=len(data) - len(optimized),
+		source_sha1=hashlib.sha1(data).hexdigest())
+	return optimized, entry
+
+def _optimize_file(name, source_dir, target_dir, max_bytes):
+	with open(os.path.join(source_dir, name), 'rb') as f:
+		data = f.read()
+	optimized, entry = optimize(data, max_bytes)
+	tmp_path = os.path.join(target_dir, name + '.tmp')
+	with open(tmp_path, 'wb') as f:
+		f.write(optimized)
+	os.rename(tmp_path, os.path.join(target_dir, name))
+	return name, entry
+
+# Optimize every picture in source_dir that changed since the last run
+# into target_dir (OPTIMIZED_DIR, or CAPPED_DIR with max_bytes), in parallel.
+# Returns the manifest.
+def optimize_dir(source_dir=SOURCE_DIR, target_dir=None, max_bytes=None, workers=None, force=False):
+	if target_dir is None:
+		target_dir = OPTIMIZED_DIR if max_bytes is None else CAPPED_DIR
+	if not os.path.isdir(target_dir):
+		os.makedirs(target_dir)
+	manifest_path = os.path.join(target_dir, MANIFEST)
+	manifest = {'max_bytes': None, 'pictures': {}}
+	if os.path.exists(manifest_path) and not force:
+		with open(manifest_path) as f:
+			manifest = json.load(f)
+	pictures = manifest['pictures'] if manifest.get('max_bytes') == max_bytes else {}
+	names = sorted(name for name in os.listdir(source_dir) if name.endswith('.png'))
+	todo = []
+	for name in names:
+		with open(os.path.join(source_dir, name), 'rb') as f:
+			digest = hashlib.sha1(f.read()).hexdigest()
+		if pictures.get(name, {}).get('source_sha1') != digest or not os.path.exists(os.path.join(target_dir, name)):
+			todo.append(name)
+	with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+		futures = {executor.submit(_optimize_file, name, source_dir, target_dir, max_bytes): name for name in todo}
+		for future in concurrent.futures.as_completed(futures):
+			name = futures[future]
+			try:
+				entry = future.result()[1]
+			except Exception:
+				log.exception('{}: not optimized'.format(name))
+				# Don't leave the output of an older version of the picture
+				pictures.pop(name, None)
+				if os.path.exists(os.path.join(target_dir, name)):
+					os.remove(os.path.join(target_dir, name))
+				continue
+			pictures[name] = entry
+			log.info('{}: {} -> {} bytes'.format(name, entry['source_bytes'], entry['bytes']))
+	# Pictures removed from source_dir
+	for name in set(pictures) - set(names):
+		del pictures[name]
+		if os.path.exists(os.path.join(target_dir, name)):
+			os.remove(os.path.join(target_dir, name))
+	source_bytes = sum(p['source_bytes'] for p in pictures.values())
+	optimized_bytes = sum(p['bytes'] for p in pictures.values())
+	manifest = {
+		'max_bytes': max_bytes,
+		'source_bytes': source_bytes,
+		'bytes': optimized_bytes,
+		'saved': source_bytes - optimized_bytes,
+		'largest': max([p['bytes'] for p in pictures.values()] or [0]),
+		'pictures': dict(sorted(pictures.items())),
+	}
+	tmp_path = manifest_path + '.tmp'
+	with open(tmp_path, 'w') as f:
+		json.dump(manifest, f, indent=1, sort_keys=True)
+	os.replace(tmp_path, manifest_path)
+	return manifest
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Recompress the Pokémon pictures losslessly.')
+	parser.add_argument('--max-bytes', type=int,
+		help='scale down pictures larger than this (lossy), into {}'.format(os.path.basename(CAPPED_DIR)))
+	parser.add_argument('--workers', type=int, help='processes to use (default: one per CPU)')
+	parser.add_argument('--force', action='store_true', help='optimize all pictures, even unchanged ones')
+	args = parser.parse_args()
+	logging.basicConfig(level=logging.INFO, format='%(message)s')
+	manifest = optimize_dir(max_bytes=args.max_bytes, workers=args.workers, force=args.force)
+	print('{} pictures: {} -> {} bytes, saved {} ({:.1f}%), largest {} bytes'.format(
+		len(manifest['pictures']), manifest['source_bytes'], manifest['bytes'], manifest['saved'],
+		100.0 * manifest['saved'] / max(manifest['source_bytes'], 1), manifest['largest']))
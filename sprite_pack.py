@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+# The Pokémon pictures packed into one indexed file, memory-mapped once per
+# process. Pictures are served as memoryview slices of the mapping, so
+# uploading one opens no file and copies no bytes before the request body.
+#
+# Layout (all integers little-endian):
+#
+#   header          HEADER struct, see below
+#   index           n_sprites * ENTRY structs: file name (NUL padded),
+#                   offset and length of the picture, SHA-1 of its content
+#   data            the pictures, back to back
+#
+# The header records the number, total size and latest modification time of
+# the source pictures; sprite_pack() packs them again when that changes.
+# sprites.bin is not checked in, it is built on first use
+# or with `python sprite_pack.py`.
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.realpath(__file__))
+PACK_PATH = ROOT + '/sprites.bin'
+SOURCE_DIR = ROOT + '/pokemon-sugimori'
+
+MAGIC = b'PKSP'
+VERSION = 1
+# magic, version, n_sprites, n source files, total source bytes, latest source mtime (ns)
+HEADER = struct.Struct('<4sHIIQQ')
+ENTRY = struct.Struct('<16sII20s')
+
+# data: memoryview of the picture, digest: hex SHA-1 of it (as MediaCache.digest)
+Sprite = namedtuple('Sprite', ['data', 'digest'])
+
+
+def _sources(source_dir):
+	return sorted(name for name in os.listdir(source_dir) if name.endswith('.png'))
+
+# (number of files, total bytes, latest mtime) of the pictures in source_dir
+def source_fingerprint(source_dir=SOURCE_DIR):
+	stats = [os.stat(os.path.join(source_dir, name)) for name in _sources(source_dir)]
+	return (len(stats), sum(s.st_size for s in stats), max([s.st_mtime_ns for s in stats] or [0]))
+
+# Pack the pictures in source_dir. Returns bytes.
+def compile_pack(source_dir=SOURCE_DIR):
+	names = _sources(source_dir)
+	pictures = []
+	for name in names:
+		with open(os.path.join(source_dir, name), 'rb') as f:
+			pictures.append(f.read())
+	offset = HEADER.size + ENTRY.size * len(names)
+	index = []
+	for name, picture in zip(names, pictures):
+		index.append(ENTRY.pack(name.encode('utf-8'), offset, len(picture), hashlib.sha1(picture).digest()))
+		offset += len(picture)
+	return b''.join([HEADER.pack(MAGIC, VERSION, len(names), *source_fingerprint(source_dir))] + index + pictures)
+
+def write_pack(source_dir=SOURCE_DIR, path=PACK_PATH):
+	data = compile_pack(source_dir)
+	tmp_path = path + '.tmp'
+	with open(tmp_path, 'wb') as f:
+		f.write(data)
+	os.rename(tmp_path, path)
+	return len(data)
+
+
+# Read-only view of a sprite pack of the pictures in source_dir
+class SpritePack:
+	def __init__(self, buf, source_dir=SOURCE_DIR):
+		self.buf = buf
+		self.view = memoryview(buf)
+		self.source_dir = os.path.realpath(source_dir)
+		magic, version, n_sprites, *self.fingerprint = HEADER.unpack_from(buf, 0)
+		if magic != MAGIC or version != VERSION:
+			raise ValueError('Not a sprite pack (version {}): {!r} {}'.format(VERSION, magic, version))
+		self.fingerprint = tuple(self.fingerprint)
+		# file name: (offset, length, digest)
+		self.index = {}
+		for i in range(n_sprites):
+			name, offset, length, digest = ENTRY.unpack_from(buf, HEADER.size + i * ENTRY.size)
+			self.index[name.rstrip(b'\0').decode('utf-8')] = (offset, length, digest.hex())
+
+	@classmethod
+	def open(cls, path=PACK_PATH, source_dir=SOURCE_DIR):
+		with open(path, 'rb') as f:
+			return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), source_dir)
+
+	def __len__(self):
+		return len(self.index)
+
+	# Sprite for the picture at path, None if it is not in the pack
+	def get(self, path):
+		if os.path.dirname(os.path.realpath(path)) != self.source_dir:
+			return None
+		entry = self.index.get(os.path.basename(path))
+		if entry is None:
+			return None
+		offset, length, digest = entry
+		return Sprite(self.view[offset:offset + length], digest)
+
+_shared = {}
+
+# Pack of the pictures in source_dir, opened once per process.
+# Packed first if there is no pack yet or the pictures changed.
+def sprite_pack(source_dir=SOURCE_DIR, path=PACK_PATH):
+	pack = _shared.get(path)
+	if pack is None:
+		try:
+			pack = SpritePack.open(path, source_dir)
+			if pack.fingerprint != source_fingerprint(source_dir):
+				pack = None
+		except (IOError, ValueError) as error:
+			log.debug('No sprite pack: {}'.format(error))
+		if pack is None:
+			log.info('Packing {} into {}'.format(source_dir, path))
+			write_pack(source_dir, path)
+			pack = SpritePack.open(path, source_dir)
+		pack = _shared[path] = pack
+	return pack
+
+
+if __name__ == '__main__':
+	size = write_pack()
+	pack = SpritePack.open()
+	for name in _sources(SOURCE_DIR):
+		with open(os.path.join(SOURCE_DIR, name), 'rb') as f:
+			assert pack.get(os.path.join(SOURCE_DIR, name)).data == f.read()
+	print('Wrote {} bytes, {} sprites'.format(size, len(pack)))
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+# pokedex_bot reads its credentials and state directory on import
+os.environ.setdefault('POKEDEX_STATE_DIR', tempfile.mkdtemp(prefix='pokedex-test-'))
+for variable in ('APP_KEY', 'APP_SECRET', 'OAUTH_TOKEN', 'OAUTH_TOKEN_SECRET'):
+	os.environ.setdefault(variable, 'test')
@@ -0,0 +1,13 @@
+from pokedex import Pokedex
+from reply_cache import CACHE_PATH, ReplyCache, compile_cache
+
+
+# Fails when fancy_text, tweet_length, fit_sentences or compose_body changed the
+# bodies: bump BODIES_VERSION and rebuild replies.bin with `python reply_cache.py`
+def test_committed_cache_is_up_to_date():
+	with open(CACHE_PATH, 'rb') as f:
+		committed = f.read()
+	assert compile_cache(Pokedex.store()) == committed, 'replies.bin is out of date'
+
+def test_cache_opens():
+	assert ReplyCache.open(Pokedex.store().languages) is not None
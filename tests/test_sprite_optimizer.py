@@ -0,0 +1,17 @@
+import hashlib
+import json
+import os
+from sprite_optimizer import MANIFEST, OPTIMIZED_DIR, SOURCE_DIR
+
+
+# Fails when a picture in SOURCE_DIR changed: run `python sprite_optimizer.py`
+def test_optimized_pictures_are_up_to_date():
+	with open(os.path.join(OPTIMIZED_DIR, MANIFEST)) as f:
+		manifest = json.load(f)
+	assert manifest['max_bytes'] is None
+	names = sorted(name for name in os.listdir(SOURCE_DIR) if name.endswith('.png'))
+	assert sorted(manifest['pictures']) == names
+	for name in names:
+		with open(os.path.join(SOURCE_DIR, name), 'rb') as f:
+			assert hashlib.sha1(f.read()).hexdigest() == manifest['pictures'][name]['source_sha1'], name
+		assert os.path.getsize(os.path.join(OPTIMIZED_DIR, name)) == manifest['pictures'][name]['bytes'], name
@@ -0,0 +1,59 @@
+import random
+import unicodedata
+import pytest
+import pokedex_bot
+from fancy_text import bold, italic
+from pokedex import Pokedex
+from tweet_length import MAX_WEIGHTED_LENGTH, fits, weighted_length
+
+# Lengths counted by hand as Twitter does: 1 for Latin, Greek, Cyrillic, ...,
+# general punctuation and primes, 2 for everything else, after NFC
+# https://developer.twitter.com/en/docs/counting-characters
+EXPECTED = {
+	'de': [('Bisasam', 7), ('Größe', 5), ('Maus', 4)],
+	'en': [('Pikachu', 7), ('POKéMON', 7), ('“Pokémon” – ′', 13)],
+	'es': [('Ratón', 5), ('Ratón', 5)],
+	'fr': [('Évoli', 5), ('Évoli', 5), ("d'aplomb", 8)],
+	'it': [('Topo', 4), ("l'ambiente circostante.", 23)],
+	# Kana and the ideographic space count 2, half-width kana too
+	'ja': [('ピカチュウ', 10), ('しっぽを　たてて', 16), ('ﾋﾟｶﾁｭｳ', 12)],
+	# Hangul syllables count 2, decomposed ones after composing them
+	'ko': [('피카츄', 6), (unicodedata.normalize('NFD', '피카츄'), 6), ('이상해씨', 8)],
+	'zh': [('皮卡丘', 6), ('妙蛙種子', 8), ('伊布', 4)],
+}
+
+
+@pytest.mark.parametrize('lang', Pokedex.supported_languages)
+def test_expected_lengths(lang):
+	for text, length in EXPECTED[lang]:
+		assert weighted_length(text) == length, text
+
+def test_fancy_text_counts_twice():
+	# The bold and italic letters are astral code points
+	assert weighted_length(bold('Pikachu')) == 14
+	assert weighted_length(bold('No. 25')) == 10
+	assert weighted_length(italic('Mouse')) == 10
+	assert weighted_length(italic('h')) == 2
+
+def test_limit():
+	assert fits('a' * MAX_WEIGHTED_LENGTH)
+	assert not fits('a' * (MAX_WEIGHTED_LENGTH + 1))
+	assert fits('丘' * (MAX_WEIGHTED_LENGTH // 2))
+	assert not fits('丘' * (MAX_WEIGHTED_LENGTH // 2 + 1))
+
+# Every name in every language, with the longest handle, from the reply
+# cache and fitted at runtime
+@pytest.mark.parametrize('cached', [True, False])
+@pytest.mark.parametrize('lang', Pokedex.supported_languages)
+def test_replies_fit(lang, cached, monkeypatch):
+	if not cached:
+		monkeypatch.setattr(pokedex_bot, '_reply_cache', False)
+	random.seed(0)
+	replies = 0
+	for name in Pokedex.store().names(lang):
+		text, _ = pokedex_bot.poke_reply('a_fifteen_chars', name, lang)
+		if text is not None:
+			assert fits(text), text
+			replies += 1
+	# There are no Chinese flavor texts
+	assert replies or lang == 'zh'
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+# Tweet length as Twitter counts it, which is not len():
+# code points in the ranges below count as 1, everything else
+# (CJK, Hangul, emoji, the astral bold and italic letters from
+# fancy_text, ...) counts as 2, after NFC normalization.
+# https://developer.twitter.com/en/docs/counting-characters
+# https://github.com/twitter/twitter-text/blob/master/config/v3.json
+#
+# URLs (always 23) and emoji sequences (2 for the whole sequence)
+# are not special-cased, replies contain neither.
+
+import bisect
+import re
+import unicodedata
+
+MAX_WEIGHTED_LENGTH = 280
+SCALE = 100
+DEFAULT_WEIGHT = 200
+# (first code point, last code point, weight), sorted
+WEIGHTED_RANGES = [
+	(0x0000, 0x10FF, 100),  # Latin, Greek, Cyrillic, Hebrew, Arabic, ...
+	(0x2000, 0x200D, 100),  # spaces
+	(0x2010, 0x201F, 100),  # dashes and quotes
+	(0x2032, 0x2037, 100),  # primes
+]
+
+_RANGE_STARTS = [start for start, end, weight in WEIGHTED_RANGES]
+
+# One character class per weight other than the default,
+# matching runs of code points with that weight
+_WEIGHT_PATTERNS = [(weight, re.compile('[{}]+'.format(''.join(
+	'{}-{}'.format(re.escape(chr(start)), re.escape(chr(end)))
+	for start, end, w in WEIGHTED_RANGES if w == weight))))
+	for weight in sorted(set(w for start, end, w in WEIGHTED_RANGES) - {DEFAULT_WEIGHT})]
+
+
+# Weight of a single character, in 1/SCALE
+def char_weight(char):
+	code_point = ord(char)
+	i = bisect.bisect_right(_RANGE_STARTS, code_point) - 1
+	if i >= 0 and code_point <= WEIGHTED_RANGES[i][1]:
+		return WEIGHTED_RANGES[i][2]
+	return DEFAULT_WEIGHT
+
+# Length of text as counted by Twitter
+def weighted_length(text):
+	text = unicodedata.normalize('NFC', text)
+	weight = DEFAULT_WEIGHT * len(text)
+	for range_weight, pattern in _WEIGHT_PATTERNS:
+		weight += (range_weight - DEFAULT_WEIGHT) * sum(map(len, pattern.findall(text)))
+	return weight // SCALE
+
+def fits(text, length=MAX_WEIGHTED_LENGTH):
+	return weighted_length(text) <= length
+
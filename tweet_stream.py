@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+# Near-real-time ingestion from the Twitter filter stream,
+# as an alternative to polling the search API.
+# https://developer.twitter.com/en/docs/tweets/filter-realtime/api-reference/post-statuses-filter
+
+import json
+import logging
+import queue
+import socket
+import threading
+import requests
+from requests_oauthlib import OAuth1
+from tweeter import identify_mention
+
+log = logging.getLogger(__name__)
+
+STREAM_URL = 'https://stream.twitter.com/1.1/statuses/filter.json'
+# Twitter sends keep-alive newlines every 30 seconds,
+# no data for this long means the connection stalled
+READ_TIMEOUT = 90
+CONNECT_TIMEOUT = 10
+
+
+# Reconnect delays as recommended by Twitter
+# https://developer.twitter.com/en/docs/tweets/filter-realtime/guides/connecting
+class Backoff:
+	def __init__(self):
+		self.delay = 0
+
+	# TCP/IP level errors: back off linearly by 250ms, up to 16s
+	def network_error(self):
+		self.delay = min(self.delay + 0.25, 16)
+		return self.delay
+
+	# HTTP errors: back off exponentially from 5s, up to 320s.
+	# When rate limited, start at one minute.
+	def http_error(self, status_code):
+		start = 60 if status_code in (420, 429) else 5
+		self.delay = min(max(start, self.delay * 2), 320)
+		return self.delay
+
+	def reset(self):
+		self.delay = 0
+
+
+class FilterStream:
+	def __init__(self, credentials, track, url=STREAM_URL, read_timeout=READ_TIMEOUT):
+		self.session = requests.Session()
+		if credentials is not None:
+			self.session.auth = OAuth1(*credentials)
+		self.track = track
+		self.url = url
+		self.read_timeout = read_timeout
+		self.backoff = Backoff()
+		self.connections = 0
+		self._stopped = threading.Event()
+		self._response = None
+
+	# Yield statuses mentioning any of track, forever.
+	# Reconnects with backoff whenever the connection fails,
+	# stalls or is closed, until stop() is called.
+	def statuses(self):
+		self._stopped.clear()
+		while not self._stopped.is_set():
+			try:
+				response = self.session.post(self.url, stream=True,
+					data={'track': ','.join(self.track), 'stall_warnings': 'true'},
+					timeout=(CONNECT_TIMEOUT, self.read_timeout))
+			except requests.RequestException as error:
+				self._wait(self.backoff.network_error(), error)
+				continue
+			if response.status_code != 200:
+				response.close()
+				self._wait(self.backoff.http_error(response.status_code), 'HTTP {}'.format(response.status_code))
+				continue
+			self.connections += 1
+			self.backoff.reset()
+			self._response = response
+			log.info('Connected to filter stream, tracking {} terms'.format(len(self.track)))
+			try:
+				for status in self._messages(response):
+					yield status
+			except (requests.RequestException, ValueError) as error:
+				if not self._stopped.is_set():
+					self._wait(self.backoff.network_error(), error)
+				continue
+			finally:
+				self._response = None
+				response.close()
+			if not self._stopped.is_set():
+				self._wait(self.backoff.network_error(), 'stream closed')
+
+	def _messages(self, response):
+		for line in response.iter_lines():
+			if self._stopped.is_set():
+				return
+			# Blank lines keep the connection alive
+			if not line:
+				continue
+			message = json.loads(line.decode('utf-8'))
+			if 'text' in message and 'user' in message:
+				yield message
+			elif 'disconnect' in message:
+				log.warn('Disconnected by Twitter: {}'.format(message['disconnect'].get('reason')))
+				return
+			elif 'limit' in message:
+				log.info('Stream limited, {} statuses undelivered'.format(message['limit'].get('track')))
+			elif 'warning' in message:
+				log.warn('Stream warning: {}'.format(message['warning'].get('message')))
+
+	def _wait(self, delay, reason):
+		log.warn('Filter stream: {}, reconnecting in {:.2f}s'.format(reason, delay))
+		self._stopped.wait(delay)
+
+	# Safe to call from another thread. Closing the response here would wait
+	# for the read it is blocked in, so its socket is shut down instead (through
+	# a duplicate of the descriptor): the read returns, and statuses() closes
+	# the response on its own thread.
+	def stop(self):
+		self._stopped.set()
+		response = self._response
+		if response is None:
+			return
+		try:
+			sock = socket.fromfd(response.raw.fileno(), socket.AF_INET, socket.SOCK_STREAM)
+		except (IOError, OSError):
+			# Already closed
+			return
+		try:
+			sock.shutdown(socket.SHUT_RDWR)
+		except OSError:
+			pass
+		finally:
+			sock.close()
+
+
+# Bounded queue of (status, query item) tuples waiting for a reply.
+# When it is full, the oldest entry is dropped: fresh tweets are
+# better to reply to than stale ones.
+class ReplyQueue(queue.Queue):
+	def offer(self, item):
+		while True:
+			try:
+				self.put_nowait(item)
+				return
+			except queue.Full:
+				try:
+					dropped = self.get_nowait()
+					log.debug('Reply queue full, dropped {}'.format(dropped[0]['id']))
+				except queue.Empty:
+					pass
+
+
+# Run statuses through the same identification and predicate_func
+# as searched statuses, and offer every qualifying one to replies.
+# seen, if given, is a SeenStore recording rejections.
+# A status that can't be handled is logged and skipped.
+def ingest(statuses, query_list_OR, matcher, predicate_func, replies, seen=None):
+	query_items = {item.lower(): item for item in query_list_OR}
+	for status in statuses:
+		try:
+			if seen is not None and status['id'] in seen:
+				continue
+			found, verdict = identify_mention(status, query_items, matcher, predicate_func)
+			if found is None:
+				if seen is not None:
+					seen.record(status['id'], verdict)
+				continue
+			log.info('Queueing reply to {} ({})'.format(status['id'], found))
+			replies.offer((status, found))
+		except Exception:
+			# e.g. a status with unexpected fields or a database error, the stream goes on
+			log.exception('Could not ingest status {}'.format(status.get('id')))
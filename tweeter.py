@@ -1,21 +1,73 @@
 #!/usr/bin/env python
 
-from twython import Twython
-import itertools
+from twython import Twython, TwythonError, TwythonRateLimitError
+from name_matcher import NameMatcher
+from rate_budget import RateBudget, BudgetExhausted
+from seen_store import REJECTED, UNMATCHED
+from metrics import StageTimings
+from media_cache import MediaCache
+from tweet_length import weighted_length
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from urllib.parse import quote_plus
+import bot_state
+import hashlib
 import logging
+import threading
+import time
 
 log = logging.getLogger(__name__)
 
 TWITTER_STATUS_URL_TEMPLATE = 'https://twitter.com/i/web/status/{id}'
+# https://developer.twitter.com/en/docs/tweets/search/api-reference/get-search-tweets
+# Search queries are limited to 500 URL-encoded characters, including operators.
+# They can additionally be rejected as too complex, so the number
+# of OR'ed terms is capped as well.
+MAX_QUERY_LENGTH = 500
+MAX_QUERY_TERMS = 40
+QUERY_OPERATOR = ' OR '
+# Items per search before queries were packed
+FIXED_QUERY_STEP = 15
+# Most statuses a single search request can return
+SEARCH_COUNT = 100
+UPLOAD_URL = 'https://upload.twitter.com/1.1/media/upload.json'
+# APPEND segments can be up to 5 MB, sprites fit in one
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+PNG_MEDIA_TYPE = 'image/png'
 
 class TweetBot:
-	def __init__(self, app_key, app_secret, oauth_token, oauth_token_secret):
-		self.account = Twython(app_key, app_secret, oauth_token, oauth_token_secret)
-		self.step = 15 
+	def __init__(self, app_key, app_secret, oauth_token, oauth_token_secret,
+			search_concurrency=1, budget=None, cursors=None, seen=None, media=None, sprites=None,
+			configure_client=None):
+		self.credentials = (app_key, app_secret, oauth_token, oauth_token_secret)
+		# Called with every new Twython client, e.g. FakeTwitter.install
+		self.configure_client = configure_client
+		# Every Twython client made, see close()
+		self._clients = []
+		self._clients_lock = threading.Lock()
+		self.account = self._new_client()
+		self.max_query_length = MAX_QUERY_LENGTH
+		self.max_query_terms = MAX_QUERY_TERMS
+		# Number of search requests in flight at once
+		self.search_concurrency = search_concurrency
+		# Rate limit budget of all endpoints, see rate_budget.py
+		self.budget = budget if budget is not None else RateBudget()
+		# since_id per search batch, see SearchCursors
+		self.cursors = cursors if cursors is not None else SearchCursors()
+		# Statuses evaluated before, see seen_store.py. Not tracked if None.
+		self.seen = seen
+		# media_ids of uploaded pictures, see media_cache.py
+		self.media = media if media is not None else MediaCache()
+		# Pictures to upload from memory, see sprite_pack.py. Read from their files if None.
+		self.sprites = sprites
+		self._local = threading.local()
+		# (concurrency, ThreadPoolExecutor) the searches are sent from, see _search_pool
+		self._search_workers = None
 
 	def verify_credentials(self):
 		# https://dev.twitter.com/rest/reference/get/account/verify_credentials
-		info = self.account.verify_credentials(include_entities=False, skip_status=True, include_email=False)
+		info = self._call('verify_credentials', 'verify_credentials',
+			include_entities=False, skip_status=True, include_email=False)
 		name = info.get('name', None)
 		if name is None:
 			log.error('Could not verify credentials')
@@ -26,19 +78,74 @@ class TweetBot:
 				followers = info['followers_count']))
 		return info
 
+	# Pictures in the sprite pack are uploaded from the mapping, others from their file
 	def upload_twitter_picture(self, picture_path):
-		photo = open(picture_path, 'rb')
 		log.debug("Uploading '{}'".format(picture_path))
-		response = self.account.upload_media(media=photo)
+		sprite, digest = self._picture(picture_path)
+		if sprite is not None:
+			response = self.upload_chunked(sprite.data, PNG_MEDIA_TYPE)
+		else:
+			with open(picture_path, 'rb') as photo:
+				response = self._call('upload_media', 'upload_media', media=photo)
+		self.media.put(digest, response['media_id'], response.get('expires_after_secs'))
 		return response['media_id']
 
-	def reply_media_tweet(self, status, reply_id, media_path):
-		media_id = self.upload_twitter_picture(media_path)
-		tweet = self.account.update_status(status=status, media_ids=[media_id], in_reply_to_status_id=reply_id)
+	# (Sprite or None if the picture is not in the sprite pack, digest of its content)
+	def _picture(self, picture_path):
+		sprite = self.sprites.get(picture_path) if self.sprites is not None else None
+		return (sprite, sprite.digest if sprite is not None else self.media.file_digest(picture_path))
+
+	# Upload data (bytes or a memoryview) in UPLOAD_CHUNK_SIZE segments
+	# with INIT, APPEND and FINALIZE commands. The segments are slices
+	# of data, not copies. Takes one upload_media token from the budget.
+	# https://developer.twitter.com/en/docs/media/upload-media/uploading-media/chunked-media-upload
+	def upload_chunked(self, data, media_type):
+		self.budget.acquire('upload_media')
+		init = self._call('upload_media', 'post', reserved=True, endpoint=UPLOAD_URL,
+			params={'command': 'INIT', 'total_bytes': len(data), 'media_type': media_type})
+		media_id = init['media_id']
+		for index, start in enumerate(range(0, len(data), UPLOAD_CHUNK_SIZE)):
+			self._call('upload_media', 'post', reserved=True, endpoint=UPLOAD_URL,
+				params={'command': 'APPEND', 'media_id': media_id, 'segment_index': index,
+					'media': _Segment(data[start:start + UPLOAD_CHUNK_SIZE])})
+		return self._call('upload_media', 'post', reserved=True, endpoint=UPLOAD_URL,
+			params={'command': 'FINALIZE', 'media_id': media_id})
+
+	# media_id of the picture at picture_path: from an earlier upload
+	# of the same content while that is valid, otherwise a new upload.
+	# Returns a tuple (media_id, whether it was uploaded before).
+	def picture_media_id(self, picture_path):
+		media_id = self.media.get(self._picture(picture_path)[1])
+		if media_id is not None:
+			log.debug("Reusing upload of '{}'".format(picture_path))
+			return (media_id, True)
+		return (self.upload_twitter_picture(picture_path), False)
+
+	# Raises BudgetExhausted before uploading anything
+	# if the reply could not be posted within the rate limits.
+	# The upload and post stages are timed in timings (a StageTimings), if given.
+	def reply_media_tweet(self, status, reply_id, media_path, timings=None):
+		timings = timings if timings is not None else StageTimings()
+		self.budget.acquire('update_status')
+		with timings.stage('upload'):
+			media_id, reused = self.picture_media_id(media_path)
+		with timings.stage('post'):
+			try:
+				tweet = self._call('update_status', 'update_status', reserved=True,
+					status=status, media_ids=[media_id], in_reply_to_status_id=reply_id)
+			except TwythonError as error:
+				# An earlier upload may have expired or been removed on Twitter's
+				# side; upload it again, once. The retry needs a new update_status token.
+				if not reused or error.error_code != 400:
+					raise
+				log.warn("Upload of '{}' was rejected, uploading again: {}".format(media_path, error))
+				self.media.forget(self._picture(media_path)[1])
+				tweet = self._call('update_status', 'update_status',
+					status=status, media_ids=[self.upload_twitter_picture(media_path)], in_reply_to_status_id=reply_id)
 		return tweet
 
 	def reply_text_tweet(self, status, reply_id):
-		tweet = self.account.update_status(status=status, in_reply_to_status_id=reply_id)
+		tweet = self._call('update_status', 'update_status', status=status, in_reply_to_status_id=reply_id)
 		log.info('Responded with text to {}'.format(reply_id))
 		return tweet
 
@@ -47,91 +154,408 @@ class TweetBot:
 		log.info('Rate limit remaining: {}'.format(rate_limit))
 		return rate_limit
 
+	# Twython clients share no state across threads, so every
+	# search worker and reply thread gets its own client
+	def _thread_account(self):
+		if threading.current_thread() is threading.main_thread():
+			return self.account
+		if getattr(self._local, 'account', None) is None:
+			self._local.account = self._new_client()
+		return self._local.account
+
+	def _new_client(self):
+		client = Twython(*self.credentials)
+		if self.configure_client is not None:
+			self.configure_client(client)
+		with self._clients_lock:
+			self._clients.append(client)
+		return client
+
+	# Threads parallel searches are sent from. They live as long as the bot,
+	# so their clients and open connections serve the next search pass too.
+	def _search_pool(self, concurrency):
+		if self._search_workers is None or self._search_workers[0] != concurrency:
+			if self._search_workers is not None:
+				self._search_workers[1].shutdown(wait=False)
+			self._search_workers = (concurrency, ThreadPoolExecutor(max_workers=concurrency))
+		return self._search_workers[1]
+
+	# Stop the search threads and close the connections of all clients
+	def close(self):
+		if self._search_workers is not None:
+			self._search_workers[1].shutdown(wait=True)
+			self._search_workers = None
+		with self._clients_lock:
+			for client in self._clients:
+				client.client.close()
+
+	# Call the Twython method of client (the client of the calling thread by default)
+	# within the rate limit budget of endpoint, unless a token
+	# was reserved beforehand. Afterwards the budget is synced
+	# from the rate limit headers of the response, if there was one.
+	# Raises BudgetExhausted if the call has to be deferred.
+	# resource is the rate budget endpoint the call counts against,
+	# method the name of the Twython method to call with params
+	def _call(self, resource, method, client=None, reserved=False, **params):
+		client = client or self._thread_account()
+		if not reserved:
+			self.budget.acquire(resource)
+		responded = False
+		try:
+			result = getattr(client, method)(**params)
+			responded = True
+			return result
+		except TwythonRateLimitError as error:
+			responded = True
+			self.budget.exhausted(resource, error.retry_after)
+			raise
+		except TwythonError as error:
+			# Twython keeps the headers of the client's previous call until
+			# a response arrives; errors without a code never got one
+			responded = error.error_code is not None
+			raise
+		finally:
+			if responded:
+				self.budget.update(resource, lambda header: _last_header(client, header))
+
+	def _search(self, query, reserved=False):
+		client = self._thread_account()
+		since_id = self.cursors.since_id(query)
+		log.debug("Searching for '{}' since {}".format(', '.join(query), since_id))
+		params = {'q': build_query(query), 'count': SEARCH_COUNT}
+		if since_id is not None:
+			params['since_id'] = since_id
+		statuses = self._call('search', 'search', client=client, reserved=reserved, **params)['statuses']
+		log.debug("Found {} matching tweets".format(len(statuses)))
+		return statuses
+
+	# Take a search token from the budget, False if it is exhausted
+	def _reserve_search(self):
+		try:
+			self.budget.acquire('search')
+			return True
+		except BudgetExhausted as error:
+			log.warn(error)
+			return False
+
+	# Search for every batch of query items in batches.
+	# Yields tuples of (batch, statuses) in the order of batches,
+	# no matter in which order the requests complete.
+	# With concurrency > 1, that many requests are sent in parallel.
+	# Every request takes a token from the search budget first,
+	# stops early if the budget is exhausted.
+	def search_batches(self, batches, concurrency=1):
+		batches = iter(batches)
+		if concurrency <= 1:
+			for batch in batches:
+				if not self._reserve_search():
+					return
+				yield (batch, self._search(batch, reserved=True))
+			return
+		pool = self._search_pool(concurrency)
+		pending = deque()
+		stopped = False
+		try:
+			while True:
+				while not stopped and len(pending) < concurrency:
+					batch = next(batches, None)
+					if batch is None or not self._reserve_search():
+						stopped = True
+						break
+					pending.append((batch, pool.submit(self._search, batch, True)))
+				if not pending:
+					return
+				batch, future = pending.popleft()
+				yield (batch, future.result())
+		finally:
+			# Consumer stopped early, don't start requests nobody waits for
+			for _, future in pending:
+				future.cancel()
+			# Let requests that already started finish, as leaving the executor did
+			for _, future in pending:
+				if not future.cancelled():
+					future.exception()
+
 	def favorite(self, status_id):
-		tweet = self.account.create_favorite(id=status_id)
+		tweet = self._call('create_favorite', 'create_favorite', id=status_id)
 		log.debug('Favorited tweet {}'.format(status_id))
 		return tweet
 
-	# Find first tweet mentioning any element of query_list_OR
+	# Search for tweets mentioning any element of query_list_OR
 	# in the tweet text (excluding user names).
-	# Only tweets for which predicate_func(tweet) is truthy are returned.
+	# Only tweets for which predicate_func(tweet) is truthy are yielded.
+	# matcher is a NameMatcher used to locate the mentions, by default
+	# one is built over query_list_OR.
+	# The query is packed into as few searches as fit the query limits,
+	# which are sent search_concurrency at a time,
+	# their results are checked in query order.
+	# Every batch only asks for statuses newer than the ones checked before.
+	# A failed search (e.g. a 503 or 429) ends the pass without raising.
+	# Yields tuples of the found status/tweet and what element of
+	# the query_list_OR was identified.
+	def search_tweets(self, query_list_OR, predicate_func, matcher=None):
+		if matcher is None:
+			matcher = NameMatcher.for_names(query_list_OR)
+		# Pack the items in a fixed order, so the same batches (and their
+		# cursors) come up every run, then search them in the order of query_list_OR
+		batches = pack_queries(sorted(query_list_OR), self.max_query_length, self.max_query_terms)
+		position = {item: i for i, item in enumerate(query_list_OR)}
+		batches.sort(key=lambda batch: min(position[item] for item in batch))
+		log.debug('Packed {} query items into {} searches, saving {} over {} items per search'.format(
+			len(query_list_OR), len(batches),
+			query_plan_savings(query_list_OR, batches)['saved'], FIXED_QUERY_STEP))
+		affordable = self.budget.shrink('search', len(batches))
+		if affordable < len(batches):
+			log.info('Search budget allows {} of {} batches'.format(affordable, len(batches)))
+			batches = batches[:affordable]
+		try:
+			for current_query, statuses in self.search_batches(batches, self.search_concurrency):
+				query_items = {item.lower(): item for item in current_query}
+				for status in statuses:
+					# Statuses evaluated in an earlier run are rejected or replied to already
+					if self.seen is not None and status['id'] in self.seen:
+						continue
+					found, verdict = identify_mention(status, query_items, matcher, predicate_func)
+					if found is None:
+						if self.seen is not None:
+							self.seen.record(status['id'], verdict)
+						continue
+					log.info(TWITTER_STATUS_URL_TEMPLATE.format(id=status['id']))
+					log.info(status['text'].replace('\n',' '))
+					# If the consumer stops here, older statuses of this
+					# batch were not checked yet, so its cursor stays where it was
+					yield (status, found)
+				# All statuses of the batch were checked, only search newer ones next time
+				self.cursors.advance(current_query, statuses)
+		except TwythonError as error:
+			# What the earlier batches found is kept. The cursors of the failed
+			# batch and the ones after it stay where they were, so they are
+			# searched again next time.
+			log.error('Search failed, stopping this search pass: {}'.format(error))
+
+	# Find first tweet found by search_tweets.
 	# Returns a tuple of the found status/tweet and what element of
 	# the query_list_OR was identified.
 	# Returns (None, None) if no matching tweets were found.
-	def find_single_tweet(self, query_list_OR, predicate_func):
-		counter = 0
-		while counter <= len(query_list_OR):
-			current_query = query_list_OR[counter:counter+self.step]
-			log.debug("Searching for '{}'".format(', '.join(current_query)))
-			statuses = self.account.search(q=' OR '.join(current_query), count=50)['statuses']
-			log.debug("Found {} matching tweets".format(len(statuses)))
-			self.rate_limit_remaining()
-			counter += self.step
-			for status in statuses:
-				# Should be able to identify which part of the query list was mentioned
-				text = status['text'].lower()
-				found = None
-				for query_item in current_query:
-					if text.rfind(query_item.lower()) > -1:
-						found = query_item
-						break
-				if found is None:
-					continue
-				# Identified query part should not be part of tweeting user's name
-				if found.lower() in status['user']['screen_name'].lower():
-					continue
-				# Identified query part should not be part of a mentioned user's name
-				mentions = status['entities'].get('user_mentions')
-				for m in mentions:
-					if found.lower() in m['screen_name'].lower():
-						continue
-				# Identified query part should not be in user name being replied to
-				if found.lower() in (status['in_reply_to_screen_name'] or '').lower():
-					continue
-				# Should return True for the passed predicate_func
-				if not predicate_func(status):
-					continue
-				log.info(TWITTER_STATUS_URL_TEMPLATE.format(id=status['id']))
-				log.info(status['text'].replace('\n',' '))
-				return (status, found)
+	def find_single_tweet(self, query_list_OR, predicate_func, matcher=None):
+		found = self.search_tweets(query_list_OR, predicate_func, matcher)
+		try:
+			for status, query_item in found:
+				return (status, query_item)
+		finally:
+			# Stop pending searches right away
+			found.close()
 		log.warn("No tweets matching '{}' were found".format(query_list_OR))
 		return (None, None)
 
-# Attempt to fill format_str with sentences from text
-# (in the order returned by create_sentence_combinations)
-# to produce a result shorter or equal to length.
-# For every sentence combination, it is attempted to fit optional as well.
-# format_str must have placeholders {optionl} and {text}.
-# Makes sure the result has a full stop at the end
-# Returns None if no sentences could be fitted
-def fit_sentences(format_str, optional, text, length):
-	# Return a list of ordered sentence combinations
-	# create_sentence_combinations('First. Second. Third.') == [
-	#	('First', 'Second', 'Third.'),
-	#	('First', 'Second'),
-	#	('First', 'Third.'),
-	#	('Second', 'Third.'),
-	#	('First',),
-	#	('Second',),
-	#	('Third.',)
-	# ]
-	def create_sentence_combinations(text):
-		sentences = text.split('. ')
-		options = []
-		for i in range(len(sentences), 0, -1):
-			for subset in itertools.combinations(sentences, i):
-				options.append(subset)
-		return options
-
-	for combination in create_sentence_combinations(text):
-		# First try to fit optional, then try without
-		for opt in [optional, '']:
-			fitted = format_str.format(optional=opt, text='. '.join(combination))
-			fitted = fitted + '.' if not fitted.endswith('.') else fitted
-			if len(fitted) <= length:
-				log.debug('Fit {} / {} sentences, {} / {} chars, included optional: "{}"'.format(
-					len(combination), len(text.split('. ')), len(fitted), length, opt))
-				return fitted
-	# No sentence could be fitted
-	log.warn("No sentence of '{}' could be fitted".format(text))
-	return None
\ No newline at end of file
+	# All tweets found by search_tweets, as a list of tuples
+	# of the status/tweet and the identified element of query_list_OR
+	def find_all_tweets(self, query_list_OR, predicate_func, matcher=None):
+		found = list(self.search_tweets(query_list_OR, predicate_func, matcher))
+		log.info('Found {} tweets matching {} query items'.format(len(found), len(query_list_OR)))
+		return found
+
+# Identify which of query_items (lowercased: original) status mentions,
+# and check that the status qualifies for a reply.
+# Returns a tuple of the identified query item and None,
+# or of None and the verdict (see seen_store.py) if it does not qualify.
+def identify_mention(status, query_items, matcher, predicate_func):
+	# Should be able to identify which part of the query list was mentioned
+	match = next((m for m in matcher.find_all(status['text']) if m.name.lower() in query_items), None)
+	if match is None:
+		return (None, UNMATCHED)
+	found = query_items[match.name.lower()]
+	# Identified query part should not be part of tweeting user's name
+	if found.lower() in status['user']['screen_name'].lower():
+		return (None, REJECTED)
+	# Identified query part should not be part of a mentioned user's name
+	mentions = status['entities'].get('user_mentions')
+	if any(found.lower() in m['screen_name'].lower() for m in mentions):
+		return (None, REJECTED)
+	# Identified query part should not be in user name being replied to
+	if found.lower() in (status['in_reply_to_screen_name'] or '').lower():
+		return (None, REJECTED)
+	# Should return True for the passed predicate_func
+	if not predicate_func(status):
+		return (None, REJECTED)
+	return (found, None)
+
+# File-like segment of an upload, as Twython sends whatever has a read().
+# read() returns the memoryview itself, requests writes it into the
+# request body without copying it first.
+class _Segment:
+	def __init__(self, data):
+		self.data = data
+
+	def read(self, size=-1):
+		return self.data
+
+# High-water marks (since_id) of the searches for every batch of query items,
+# so a search only returns statuses that were not checked before.
+# Persisted between runs in the state directory.
+class SearchCursors:
+	STATE_FILE = 'search_cursors.json'
+	# Cursors of batches that were not searched for this long are dropped
+	MAX_AGE = 7 * 24 * 60 * 60
+
+	def __init__(self, cursors=None):
+		# batch key: {'since_id': int, 'used': timestamp}
+		self.cursors = cursors or {}
+		self._lock = threading.Lock()
+
+	@classmethod
+	def load(cls):
+		return cls(bot_state.load_json(cls.STATE_FILE, {}))
+
+	def save(self):
+		now = time.time()
+		with self._lock:
+			self.cursors = {key: c for key, c in self.cursors.items() if now - c['used'] < self.MAX_AGE}
+			bot_state.save_json(self.STATE_FILE, self.cursors)
+
+	@staticmethod
+	def key(batch):
+		return hashlib.sha1('\n'.join(sorted(item.lower() for item in batch)).encode('utf-8')).hexdigest()
+
+	def since_id(self, batch):
+		with self._lock:
+			cursor = self.cursors.get(self.key(batch))
+			return None if cursor is None else cursor['since_id']
+
+	# Move the cursor of batch past all of the statuses
+	def advance(self, batch, statuses):
+		key = self.key(batch)
+		with self._lock:
+			cursor = self.cursors.setdefault(key, {'since_id': None, 'used': None})
+			ids = [status['id'] for status in statuses]
+			if cursor['since_id'] is not None:
+				ids.append(cursor['since_id'])
+			cursor['since_id'] = max(ids) if ids else None
+			cursor['used'] = time.time()
+
+# Search term for a query item, phrases are quoted
+def query_term(item):
+	return '"{}"'.format(item) if ' ' in item else item
+
+def build_query(items):
+	return QUERY_OPERATOR.join(query_term(item) for item in items)
+
+def query_length(query):
+	return len(quote_plus(query.encode('utf-8')))
+
+# Group query items into the fewest search queries that stay within
+# max_length URL-encoded characters and max_terms OR'ed terms (first fit decreasing).
+# Within a query, items keep the order of the input list, queries are
+# ordered by their first item in the input.
+# Returns a list of lists of query items.
+def pack_queries(items, max_length=MAX_QUERY_LENGTH, max_terms=MAX_QUERY_TERMS):
+	separator = query_length(QUERY_OPERATOR)
+	sizes = [query_length(query_term(item)) + separator for item in items]
+	capacity = max_length + separator
+	bins = []
+	for index in sorted(range(len(items)), key=lambda i: -sizes[i]):
+		if sizes[index] > capacity:
+			raise ValueError("Query item '{}' exceeds the query length limit".format(items[index]))
+		target = next((b for b in bins if b['size'] + sizes[index] <= capacity and len(b['items']) < max_terms), None)
+		if target is None:
+			target = {'size': 0, 'items': []}
+			bins.append(target)
+		target['size'] += sizes[index]
+		target['items'].append(index)
+	queries = [sorted(b['items']) for b in bins]
+	queries.sort(key=lambda q: q[0])
+	return [[items[i] for i in query] for query in queries]
+
+# Number of search requests a packed plan (as returned by pack_queries)
+# needs compared to fixed batches of `step` items
+def query_plan_savings(items, queries, step=None):
+	step = FIXED_QUERY_STEP if step is None else step
+	fixed = (len(items) + step - 1) // step
+	return {'fixed': fixed, 'packed': len(queries), 'saved': fixed - len(queries)}
+
+# Header of the last response of a Twython client, None if there was none
+def _last_header(client, header):
+	try:
+		return client.get_lastfunction_header(header)
+	except TwythonError:
+		return None
+
+SENTENCE_SEPARATOR = '. '
+
+# Index tuples of the combinations of sentences (by length) whose lengths,
+# joined by SENTENCE_SEPARATOR (separator long), add up to at most budget. Lazily generated,
+# most sentences first (at most `most`) and in itertools.combinations order
+# within a size:
+#	sentence_combinations([6, 6, 6], 14) -> (0, 1), (0, 2), (1, 2), (0,), (1,), (2,)
+# Combinations that cannot fit are pruned before they are built.
+def sentence_combinations(lengths, budget, most=None, separator=len(SENTENCE_SEPARATOR)):
+	n = len(lengths)
+	# shortest[i][k]: total length of the k shortest sentences from i on
+	shortest = []
+	for i in range(n + 1):
+		totals = [0]
+		for l in sorted(lengths[i:]):
+			totals.append(totals[-1] + l)
+		shortest.append(totals)
+
+	# k more sentences from start on, used characters so far
+	def pick(start, k, used):
+		if k == 0:
+			yield ()
+			return
+		if used + shortest[start][k] > budget:
+			return
+		for i in range(start, n - k + 1):
+			# The rest can't be shorter than the k - 1 shortest after i
+			if used + lengths[i] + shortest[i + 1][k - 1] > budget:
+				continue
+			for rest in pick(i + 1, k - 1, used + lengths[i]):
+				yield (i,) + rest
+
+	for k in range(n if most is None else min(most, n), 0, -1):
+		for combination in pick(0, k, separator * (k - 1)):
+			yield combination
+
+# format_str formatted with as many sentences of text as fit in length
+# characters, ending with a full stop, and optional if there is room.
+# Lengths are taken with measure, by default as Twitter counts them.
+# Sentence combinations are tried most sentences first, earlier
+# sentences first, each with optional and then without:
+#	'First. Second. Third.' -> ('First', 'Second', 'Third.'), ('First', 'Second'),
+#	('First', 'Third.'), ('Second', 'Third.'), ('First',), ('Second',), ('Third.',)
+# format_str must have the placeholders {optional} and {text}.
+# Returns None if not even a single sentence fits.
+def fit_sentences(format_str, optional, text, length, measure=weighted_length):
+	sentences = text.split(SENTENCE_SEPARATOR)
+	# Usually the whole text fits
+	count = len(sentences)
+	fitted = _fit_text(format_str, optional, text, length, measure)
+	if fitted is None:
+		# format_str's length without the text, and how often the text occurs in it.
+		# Measured once; combinations are then sized by adding up sentence lengths.
+		fixed = measure(format_str.format(optional='', text=''))
+		text_count = (measure(format_str.format(optional='', text='.')) - fixed) // measure('.')
+		budget = (length - fixed) // text_count if text_count else float('inf')
+		lengths = [measure(s) for s in sentences]
+		for combination in sentence_combinations(lengths, budget, len(sentences) - 1, measure(SENTENCE_SEPARATOR)):
+			count = len(combination)
+			fitted = _fit_text(format_str, optional, SENTENCE_SEPARATOR.join(sentences[i] for i in combination),
+				length, measure)
+			if fitted is not None:
+				break
+	if fitted is None:
+		# No sentence could be fitted
+		log.warn("No sentence of '{}' could be fitted".format(text))
+		return None
+	log.debug('Fit {} / {} sentences, {} / {} chars'.format(count, len(sentences), measure(fitted), length))
+	return fitted
+
+# format_str with text and optional, then without optional,
+# whichever first fits in length. None if neither does.
+def _fit_text(format_str, optional, text, length, measure):
+	for opt in [optional, '']:
+		fitted = format_str.format(optional=opt, text=text)
+		fitted = fitted + '.' if not fitted.endswith('.') else fitted
+		if measure(fitted) <= length:
+			return fitted
+	return None